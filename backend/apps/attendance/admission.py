@@ -0,0 +1,256 @@
+"""
+Admission control in front of the face pipeline.
+
+Every face detection/encoding (see face_recognition.extract_face_encodings)
+first takes one of FACE_ADMISSION_CONCURRENCY slots. When none is free the
+request waits in a bounded queue:
+
+- Priority: attendance scans and pickup handovers go first, then identify,
+  then enrollment. FACE_ADMISSION_RESERVED_SCAN_SLOTS slots are kept for
+  scans, so a large enrollment never occupies every slot.
+- Fairness: within a priority, schools are served round-robin, and one
+  school may hold at most FACE_ADMISSION_MAX_QUEUED_PER_SCHOOL waiters; a
+  request over that cap evicts the school's own newest waiter of a lower
+  priority, else it is refused.
+- Deadlines: a waiter is dropped once it has waited longer than its
+  priority's deadline (a stale scan is worth less than a retry).
+- When the queue is full, a newer request evicts a waiter of lower priority
+  (the newest one from the school with the most waiters), else it is refused.
+
+Refused, evicted and expired requests raise FaceServiceBusy (503 with
+Retry-After). The priority and school of a request are set by the caller
+with `face_request`. State and metrics are per process.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+
+from django.conf import settings
+
+from .metrics import LatencyRecorder
+from .workers import FaceServiceBusy
+
+
+class FacePriority(IntEnum):
+    SCAN = 0
+    IDENTIFY = 1
+    ENROLL = 2
+
+    @property
+    def label(self):
+        return self.name.lower()
+
+
+DEFAULT_DEADLINES = {'scan': 5, 'identify': 10, 'enroll': 60}
+
+# (priority, school_id) of the face request running in this context
+_current_request = ContextVar('face_request', default=(FacePriority.IDENTIFY, None))
+
+
+@contextmanager
+def face_request(priority, school_id=None):
+    """Tag the face inference done inside the block with a priority and school."""
+    token = _current_request.set((priority, school_id))
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'school_id', 'enqueued', 'deadline', 'state')
+
+    def __init__(self, priority, school_id, deadline_s):
+        self.priority = priority
+        self.school_id = school_id
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + deadline_s
+        self.state = 'waiting'
+
+
+class AdmissionController:
+    """Bounded, prioritized, per-school fair queue of face inference slots."""
+
+    def __init__(self, concurrency, max_queue, max_queued_per_school, reserved_scan_slots, deadlines):
+        self.concurrency = max(concurrency, 1)
+        self.max_queue = max_queue
+        self.max_queued_per_school = max_queued_per_school
+        # Slots lower priorities may use; at least one so they are never locked out
+        self.shared_slots = max(self.concurrency - reserved_scan_slots, 1)
+        self.deadlines = {
+            priority: deadlines.get(priority.label, DEFAULT_DEADLINES[priority.label])
+            for priority in FacePriority
+        }
+        self.wait_times = LatencyRecorder(getattr(settings, 'FACE_ADMISSION_WAIT_SAMPLES', 500))
+        self._running = 0
+        # One OrderedDict per priority: school_id -> deque of waiters, in round-robin order
+        self._queues = {priority: OrderedDict() for priority in FacePriority}
+        self._depth = Counter()
+        self._school_depth = Counter()
+        self._counters = {priority: Counter() for priority in FacePriority}
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def admit(self, priority, school_id):
+        """Hold an inference slot for the block, waiting in the queue if needed."""
+        self._enter(FacePriority(priority), school_id)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._dispatch()
+
+    def _enter(self, priority, school_id):
+        counters = self._counters[priority]
+        with self._cond:
+            if (
+                self._school_depth[school_id] >= self.max_queued_per_school
+                and not self._evict_below(priority, school_id)
+            ):
+                counters['rejected'] += 1
+                raise FaceServiceBusy('Too many face requests queued for this school. Please retry.')
+            if sum(self._depth.values()) >= self.max_queue and not self._evict_below(priority):
+                counters['rejected'] += 1
+                raise FaceServiceBusy()
+
+            waiter = _Waiter(priority, school_id, self.deadlines[priority])
+            self._queues[priority].setdefault(school_id, deque()).append(waiter)
+            self._depth[priority] += 1
+            self._school_depth[school_id] += 1
+            self._dispatch()
+
+            while waiter.state == 'waiting':
+                remaining = waiter.deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(waiter)
+                    waiter.state = 'expired'
+                    break
+                self._cond.wait(remaining)
+
+            if waiter.state != 'admitted':
+                counters[waiter.state] += 1
+                raise FaceServiceBusy()
+            counters['admitted'] += 1
+
+        self.wait_times.record(priority.label, (time.monotonic() - waiter.enqueued) * 1000)
+
+    def _limit(self, priority):
+        return self.concurrency if priority == FacePriority.SCAN else self.shared_slots
+
+    def _dispatch(self):
+        """Hand free slots to waiters, highest priority first. Caller holds the lock."""
+        now = time.monotonic()
+        changed = False
+        for priority in FacePriority:
+            queue = self._queues[priority]
+            while queue and self._running < self._limit(priority):
+                # Serve the school at the front, then send it to the back
+                school_id, waiters = next(iter(queue.items()))
+                waiter = waiters[0]
+                self._remove(waiter)
+                if school_id in queue:
+                    queue.move_to_end(school_id)
+                if waiter.deadline <= now:
+                    waiter.state = 'expired'
+                else:
+                    waiter.state = 'admitted'
+                    self._running += 1
+                changed = True
+        if changed:
+            self._cond.notify_all()
+
+    def _remove(self, waiter):
+        queue = self._queues[waiter.priority]
+        waiters = queue[waiter.school_id]
+        waiters.remove(waiter)
+        if not waiters:
+            del queue[waiter.school_id]
+        self._depth[waiter.priority] -= 1
+        self._school_depth[waiter.school_id] -= 1
+        if not self._school_depth[waiter.school_id]:
+            del self._school_depth[waiter.school_id]
+
+    def _evict_below(self, priority, school_id=None):
+        """
+        Drop the newest waiter in the lowest priority below `priority` that has
+        one: from `school_id` if given, else from the busiest school.
+        """
+        for lower in sorted(FacePriority, reverse=True):
+            if lower <= priority:
+                return False
+            queue = self._queues[lower]
+            if school_id is not None:
+                waiters = queue.get(school_id)
+            else:
+                waiters = max(queue.values(), key=len) if queue else None
+            if waiters:
+                victim = waiters[-1]
+                self._remove(victim)
+                victim.state = 'evicted'
+                self._cond.notify_all()
+                return True
+        return False
+
+    def snapshot(self):
+        """Queue depth, running slots, outcome counters and wait times."""
+        with self._cond:
+            report = {
+                'concurrency': self.concurrency,
+                'running': self._running,
+                'queued': sum(self._depth.values()),
+                'max_queue': self.max_queue,
+                'priorities': {
+                    priority.label: {
+                        'queued': self._depth[priority],
+                        'schools_waiting': len(self._queues[priority]),
+                        'deadline_s': self.deadlines[priority],
+                        **{
+                            outcome: self._counters[priority][outcome]
+                            for outcome in ('admitted', 'rejected', 'expired', 'evicted')
+                        },
+                    }
+                    for priority in FacePriority
+                },
+                'queued_by_school': {
+                    str(school_id): depth for school_id, depth in self._school_depth.items()
+                },
+            }
+        report['wait_ms'] = self.wait_times.snapshot()
+        return report
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Return the process-wide controller, or None when admission control is off."""
+    global _controller
+    if not getattr(settings, 'FACE_ADMISSION_CONTROL', True):
+        return None
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                getattr(settings, 'FACE_ADMISSION_CONCURRENCY', 2),
+                getattr(settings, 'FACE_ADMISSION_MAX_QUEUE', 64),
+                getattr(settings, 'FACE_ADMISSION_MAX_QUEUED_PER_SCHOOL', 16),
+                getattr(settings, 'FACE_ADMISSION_RESERVED_SCAN_SLOTS', 1),
+                getattr(settings, 'FACE_ADMISSION_DEADLINES', DEFAULT_DEADLINES),
+            )
+        return _controller
+
+
+@contextmanager
+def admitted():
+    """Hold a slot for the current face request (see face_request)."""
+    controller = get_admission_controller()
+    if controller is None:
+        yield
+        return
+    priority, school_id = _current_request.get()
+    with controller.admit(priority, school_id):
+        yield
@@ -0,0 +1,234 @@
+"""
+Synthetic benchmark for the face pipeline.
+
+Measures decode, detect, encode and match separately so a regression in the
+attendance path can be traced to one stage. Galleries are random 128-d
+encodings clustered per student and images are generated noise, so the
+suite runs on any machine without a camera, photos or a GPU. Detection and
+encoding need the face_recognition library and are reported as skipped
+without it.
+"""
+import io
+import platform
+import time
+
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+from .gallery import ENCODING_DIM, FaceGallery
+from .face_index import IVFIndex
+from .imaging import load_face_image
+from .metrics import summarize
+
+# Spread of a student's encodings around their centre. Gives same-student
+# distances around 0.35 and different-student distances around 1.0, roughly
+# what dlib produces for real faces.
+SAME_FACE_NOISE = 0.022
+FACE_CENTRE_NORM = 0.7
+
+
+def synthetic_gallery(students, per_student, rng):
+    """
+    Random encodings clustered per student.
+
+    Returns:
+        tuple: (centres array students x 128, FaceGallery)
+    """
+    centres = rng.standard_normal((students, ENCODING_DIM))
+    centres *= FACE_CENTRE_NORM / np.linalg.norm(centres, axis=1, keepdims=True)
+    matrix = np.repeat(centres, per_student, axis=0)
+    matrix += rng.normal(0.0, SAME_FACE_NOISE, matrix.shape)
+    ids = np.repeat(np.arange(students), per_student)
+    return centres, FaceGallery(matrix.astype(np.float32), ids)
+
+
+def synthetic_probes(centres, count, rng):
+    """Noisy probes of random students. Returns (probes, expected student ids)."""
+    expected = rng.integers(0, len(centres), count)
+    probes = centres[expected] + rng.normal(0.0, SAME_FACE_NOISE, (count, ENCODING_DIM))
+    return probes.astype(np.float32), expected
+
+
+def synthetic_image(width, height, rng, quality=90):
+    """A JPEG of smooth colour blobs plus sensor-like noise, as bytes."""
+    coarse = rng.integers(0, 256, (max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(image, dtype=np.int16) + rng.integers(-12, 13, (height, width, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _time_calls(fn, inputs, warmup):
+    """Call fn on each input and return per-call milliseconds (after warmup)."""
+    for item in inputs[:warmup]:
+        fn(item)
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _cycle(items, count):
+    return [items[i % len(items)] for i in range(count)]
+
+
+def bench_decode(images, iterations, warmup):
+    """load_face_image per image: JPEG decode plus the resize to both sizes."""
+    decode, resize = [], []
+
+    def run(data):
+        face_image = load_face_image(io.BytesIO(data))
+        decode.append(face_image.timings['decode_ms'])
+        resize.append(face_image.timings['resize_ms'])
+
+    total = _time_calls(run, _cycle(images, iterations), warmup)
+    # Drop the warmup calls recorded by run()
+    return {
+        'decode': summarize(decode[warmup:]),
+        'resize': summarize(resize[warmup:]),
+        'load_total': summarize(total),
+    }
+
+
+def bench_detect_encode(images, iterations, warmup):
+    """face_locations on the detection copy and face_encodings on a crop."""
+    from . import face_recognition as face_module
+
+    if not face_module.FACE_RECOGNITION_AVAILABLE:
+        reason = 'face_recognition library not installed'
+        return {'detect': {'skipped': reason}, 'encode': {'skipped': reason}}
+
+    face_recognition = face_module.face_recognition
+    model = getattr(settings, 'FACE_DETECTION_MODEL', 'hog')
+    upsample = getattr(settings, 'FACE_DETECTION_UPSAMPLE', 1)
+
+    face_images = [load_face_image(io.BytesIO(data)) for data in images]
+    face_images = _cycle(face_images, iterations)
+
+    detect = _time_calls(
+        lambda face_image: face_recognition.face_locations(
+            face_image.detect_array, number_of_times_to_upsample=upsample, model=model
+        ),
+        face_images, warmup
+    )
+
+    # Synthetic images contain no faces, so encode a fixed central box; the
+    # landmark and embedding network cost does not depend on the content.
+    def encode(face_image):
+        width, height = face_image.image.size
+        side = min(width, height) // 3
+        top, left = (height - side) // 2, (width - side) // 2
+        crop, box = face_image.crop_for_encoding((top, left + side, top + side, left))
+        face_recognition.face_encodings(crop, [box])
+
+    return {
+        'detect': summarize(detect),
+        'encode': summarize(_time_calls(encode, face_images, warmup)),
+    }
+
+
+def bench_match(students, per_student, iterations, warmup, rng):
+    """
+    Route-gallery matching (exact) and school index matching (IVF).
+
+    Also reports top-1 accuracy against the known identities of the probes
+    so a faster but wrong index shows up as a regression too.
+    """
+    centres, gallery = synthetic_gallery(students, per_student, rng)
+    probes, expected = synthetic_probes(centres, iterations, rng)
+    probe_rows = list(probes)
+
+    start = time.perf_counter()
+    index = IVFIndex.from_gallery(gallery)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    results = {}
+    for name, matcher in (('gallery', gallery), ('index', index)):
+        found = []
+        samples = _time_calls(lambda probe: found.append(matcher.match(probe)['student_id']),
+                              probe_rows, warmup)
+        stats = summarize(samples)
+        stats['accuracy'] = round(float(np.mean(np.asarray(found[warmup:]) == expected)), 4)
+        results[name] = stats
+
+    results['index']['build_ms'] = round(build_ms, 2)
+    results['index']['trained'] = index.is_trained
+    return results
+
+
+def run_benchmark(students=500, per_student=3, iterations=200, warmup=10,
+                  image_sizes=((1920, 1080),), seed=0):
+    """
+    Run every stage and return a JSON-serialisable report.
+
+    Args:
+        students: students in the synthetic gallery
+        per_student: encodings stored per student
+        iterations: timed calls per stage
+        warmup: untimed calls before each stage
+        image_sizes: (width, height) of the synthetic camera images
+        seed: random seed, so runs are comparable
+    """
+    rng = np.random.default_rng(seed)
+    images = [synthetic_image(width, height, rng) for width, height in image_sizes]
+
+    from . import face_recognition as face_module
+
+    stages = bench_decode(images, iterations, warmup)
+    stages.update(bench_detect_encode(images, iterations, warmup))
+    match = bench_match(students, per_student, iterations, warmup, rng)
+    stages['match_gallery'] = match['gallery']
+    stages['match_index'] = match['index']
+
+    return {
+        'config': {
+            'students': students,
+            'encodings_per_student': per_student,
+            'iterations': iterations,
+            'warmup': warmup,
+            'image_sizes': [list(size) for size in image_sizes],
+            'image_bytes': [len(data) for data in images],
+            'seed': seed,
+            'detect_max_edge': getattr(settings, 'FACE_DETECTION_MAX_EDGE', 640),
+            'encode_max_edge': getattr(settings, 'FACE_ENCODING_MAX_EDGE', 1280),
+            'detection_model': getattr(settings, 'FACE_DETECTION_MODEL', 'hog'),
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'face_recognition': face_module.FACE_RECOGNITION_AVAILABLE,
+        },
+        'stages': stages,
+    }
+
+
+def compare_reports(baseline, current, metric='p95_ms', max_regression=0.2):
+    """
+    Compare a stage metric between two reports.
+
+    Returns:
+        list of dicts {'stage', 'baseline', 'current', 'change'} for every
+        stage present in both, with 'regressed' set when current exceeds
+        baseline by more than max_regression (a fraction).
+    """
+    rows = []
+    for stage, stats in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {})
+        if metric not in stats or metric not in before or not before[metric]:
+            continue
+        change = stats[metric] / before[metric] - 1
+        rows.append({
+            'stage': stage,
+            'baseline': before[metric],
+            'current': stats[metric],
+            'change': round(change, 4),
+            'regressed': change > max_regression,
+        })
+    return rows
@@ -0,0 +1,588 @@
+"""
+Memory-mapped per-school embedding store.
+
+Each school's encodings live in one file under FACE_EMBEDDING_STORE_DIR:
+
+    header     64 bytes: magic, version, nlist, dim, capacity, count, dead,
+               generation, flags
+    centroids  nlist x 128 float32   IVF cell centroids (nlist 0 = untrained)
+    offsets    nlist + 1 int64       row range of each cell; offsets[-1] is
+                                     the end of the cell-sorted prefix
+    matrix     capacity x 128 float32
+    sq_norms   capacity float32      +inf marks a deleted row
+    ids        capacity x 16 bytes   student UUIDs
+    face_ids   capacity x 16 bytes   FaceEncoding UUIDs
+
+Every worker process maps the file read-only, so the matrix is held once in
+the page cache however many workers there are. New encodings are appended
+in place after the sorted prefix and searched exactly; deletions only
+tombstone rows. A rebuild from the database retrains the cells, drops
+tombstones and grows the capacity; it writes a new file without holding the
+writer lock, then swaps it in with os.replace under the lock and flags the
+old one as superseded so mapped readers reopen. Rebuilds run in a
+background thread when the unsorted tail or the deleted rows grow too large,
+or when the file is stale; readers keep using the old mapping until the new
+file is swapped in. Only a missing or unreadable file is built on request.
+
+The generation counter is kept in the file header and in the Django cache:
+processes on one host see each other's changes through the shared file, and
+hosts sharing a cache backend rebuild their own copy when another host has
+published a newer generation.
+"""
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .face_index import _no_match, _squared_distances, ranked_match, train_kmeans
+from .gallery import ENCODING_DIM
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FEMB'
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('nlist', '<u4'),
+    ('dim', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),
+    ('dead', '<u8'),
+    ('generation', '<u8'),
+    ('flags', '<u8'),
+    ('reserved', 'V8'),
+])
+
+# A newer file has replaced this one at the same path
+SUPERSEDED = 1
+# The file missed a change and must be rebuilt from the database
+STALE = 2
+
+
+def _layout(nlist, capacity):
+    """Return ({section: (offset, dtype, shape)}, file size)."""
+    sections = (
+        ('centroids', np.float32, (nlist, ENCODING_DIM)),
+        ('offsets', np.int64, (nlist + 1,)),
+        ('matrix', np.float32, (capacity, ENCODING_DIM)),
+        ('sq_norms', np.float32, (capacity,)),
+        ('ids', 'S16', (capacity,)),
+        ('face_ids', 'S16', (capacity,)),
+    )
+    layout = {}
+    offset = HEADER.itemsize
+    for name, dtype, shape in sections:
+        dtype = np.dtype(dtype)
+        layout[name] = (offset, dtype, shape)
+        offset += dtype.itemsize * int(np.prod(shape))
+    return layout, offset
+
+
+def _views(buffer):
+    """NumPy views of every section of a mapped store file."""
+    header = np.frombuffer(buffer, HEADER, count=1)
+    if header['magic'][0] != MAGIC or header['version'][0] != VERSION or header['dim'][0] != ENCODING_DIM:
+        raise ValueError('Not a face embedding store file')
+
+    layout, size = _layout(int(header['nlist'][0]), int(header['capacity'][0]))
+    if len(buffer) < size:
+        raise ValueError('Truncated face embedding store file')
+
+    views = {'header': header}
+    for name, (offset, dtype, shape) in layout.items():
+        views[name] = np.frombuffer(buffer, dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return views
+
+
+def _uuid(value):
+    """UUID from an 'S16' value (NumPy strips trailing zero bytes)."""
+    return uuid.UUID(bytes=bytes(value).ljust(16, b'\0'))
+
+
+class EmbeddingStore:
+    """
+    Read-only mapping of one school's store file.
+    Answers `match` with the same keys as IVFIndex.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        views = _views(self._mmap)
+        self._header = views['header']
+        self.centroids = views['centroids']
+        self.offsets = views['offsets']
+        self.matrix = views['matrix']
+        self.sq_norms = views['sq_norms']
+        self.ids = views['ids']
+        self._centroid_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.nprobe = getattr(settings, 'FACE_INDEX_NPROBE', 8)
+
+    @property
+    def generation(self):
+        return int(self._header['generation'][0])
+
+    @property
+    def count(self):
+        return int(self._header['count'][0])
+
+    @property
+    def is_superseded(self):
+        """True once another file has been swapped in at this path."""
+        return bool(int(self._header['flags'][0]) & SUPERSEDED)
+
+    def is_current(self, generation):
+        """True unless replaced, flagged stale or older than `generation`."""
+        return not int(self._header['flags'][0]) & (SUPERSEDED | STALE) and self.generation >= generation
+
+    def __len__(self):
+        return self.count - int(self._header['dead'][0])
+
+    @property
+    def is_trained(self):
+        return len(self.centroids) > 0
+
+    @property
+    def student_ids(self):
+        count = self.count
+        live = np.isfinite(self.sq_norms[:count])
+        return np.array([_uuid(value) for value in np.unique(self.ids[:count][live])], dtype=object)
+
+    def _ranges(self, probe, count):
+        """Row ranges to scan: the nprobe nearest cells plus the unsorted tail."""
+        sorted_count = int(self.offsets[-1])
+        ranges = []
+        if self.is_trained:
+            centroid_d = _squared_distances(probe[None, :], self.centroids, self._centroid_sq)[0]
+            nprobe = min(self.nprobe, len(self.centroids))
+            for cell in np.argpartition(centroid_d, nprobe - 1)[:nprobe]:
+                ranges.append((int(self.offsets[cell]), int(self.offsets[cell + 1])))
+        ranges.append((sorted_count, count))
+        return [(start, end) for start, end in ranges if end > start]
+
+    def match(self, encoding):
+        probe = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        ranges = self._ranges(probe, self.count)
+        if not ranges:
+            return _no_match()
+
+        # Distances straight from the mapped slices, without copying rows
+        distances = np.sqrt(np.concatenate([
+            _squared_distances(probe[None, :], self.matrix[start:end], self.sq_norms[start:end])[0]
+            for start, end in ranges
+        ]))
+        ids = np.concatenate([self.ids[start:end] for start, end in ranges])
+
+        result = ranked_match(distances, ids)
+        for key in ('student_id', 'runner_up_id'):
+            if result[key] is not None:
+                result[key] = _uuid(result[key])
+        for candidate in result['candidates']:
+            candidate['student_id'] = _uuid(candidate['student_id'])
+        return result
+
+
+def _store_dir():
+    return str(getattr(settings, 'FACE_EMBEDDING_STORE_DIR', '') or '')
+
+
+def store_path(school_id):
+    return os.path.join(_store_dir(), f'{school_id}.emb')
+
+
+_process_locks = defaultdict(threading.Lock)
+_process_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _locked(school_id, name='lock'):
+    """
+    Exclusive lock for one school, across threads and processes: the writer
+    lock by default, or `name`='build' to serialise rebuilds.
+    """
+    key = str(school_id)
+    with _process_locks_guard:
+        process_lock = _process_locks[key, name]
+    os.makedirs(_store_dir(), exist_ok=True)
+    with process_lock, open(f'{store_path(key)}.{name}', 'ab') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _map_writable(path):
+    """Writable views of an existing store file; call views['flush']() when done."""
+    with open(path, 'r+b') as f:
+        buffer = mmap.mmap(f.fileno(), 0)
+    views = _views(buffer)
+    views['flush'] = buffer.flush
+    return views
+
+
+def _generation_key(school_id):
+    return f'face_store_gen:{school_id}'
+
+
+def _bump_generation(school_id):
+    key = _generation_key(school_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def _publish_generation(school_id, generation):
+    """Make sure the shared generation is at least the file's."""
+    key = _generation_key(school_id)
+    if cache.get(key, 0) < generation:
+        cache.set(key, generation, timeout=None)
+
+
+def _file_generation(path):
+    """Generation in a store file's header (0 if missing or unreadable)."""
+    try:
+        header = np.fromfile(path, HEADER, count=1)
+    except (FileNotFoundError, ValueError):
+        return 0
+    if not len(header) or header['magic'][0] != MAGIC:
+        return 0
+    return int(header['generation'][0])
+
+
+def _write_store(path, matrix, ids, face_ids, centroids, offsets):
+    """Write a complete store file next to `path`; returns the temporary file's path."""
+    count = len(matrix)
+    min_capacity = getattr(settings, 'FACE_EMBEDDING_STORE_MIN_CAPACITY', 1024)
+    growth = getattr(settings, 'FACE_EMBEDDING_STORE_GROWTH', 2.0)
+    capacity = max(min_capacity, int(count * growth))
+    layout, size = _layout(len(centroids), capacity)
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            f.truncate(size)
+            buffer = mmap.mmap(f.fileno(), size)
+            header = np.frombuffer(buffer, HEADER, count=1)
+            header['magic'] = MAGIC
+            header['version'] = VERSION
+            header['nlist'] = len(centroids)
+            header['dim'] = ENCODING_DIM
+            header['capacity'] = capacity
+            header['count'] = count
+
+            views = _views(buffer)
+            views['centroids'][:] = centroids
+            views['offsets'][:] = offsets
+            views['matrix'][:count] = matrix
+            views['sq_norms'][:count] = np.einsum('ij,ij->i', matrix, matrix)
+            views['ids'][:count] = ids
+            views['face_ids'][:count] = face_ids
+            buffer.flush()
+            del views, header
+            buffer.close()
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def _swap_in(temp_path, path, generation, flags=0):
+    """Stamp a written store file and replace `path` with it (writer lock held)."""
+    try:
+        views = _map_writable(temp_path)
+        views['header']['generation'] = generation
+        views['header']['flags'] = flags
+        views['flush']()
+        del views
+
+        previous = open(path, 'r+b') if os.path.exists(path) else None
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if previous is not None:
+        # Readers still mapping the old inode reopen on their next query
+        with previous:
+            buffer = mmap.mmap(previous.fileno(), 0)
+            header = np.frombuffer(buffer, HEADER, count=1)
+            header['flags'] = int(header['flags'][0]) | SUPERSEDED
+            buffer.flush()
+            del header
+            buffer.close()
+
+
+def write_store(path, matrix, ids, face_ids):
+    """
+    Write encodings ('S16' id arrays) to a new store file next to `path`,
+    sorted into about sqrt(N) IVF cells once there are
+    FACE_INDEX_MIN_TRAIN_SIZE of them.
+    Returns (temporary file path, number of cells); see _swap_in.
+    """
+    centroids = np.empty((0, ENCODING_DIM), dtype=np.float32)
+    offsets = np.zeros(1, dtype=np.int64)
+    if len(matrix) >= getattr(settings, 'FACE_INDEX_MIN_TRAIN_SIZE', 1024):
+        nlist = max(1, int(np.sqrt(len(matrix))))
+        centroids = train_kmeans(matrix, nlist)
+        centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+        assignment = _squared_distances(matrix, centroids, centroid_sq).argmin(axis=1)
+        order = np.argsort(assignment, kind='stable')
+        matrix, ids, face_ids = matrix[order], ids[order], face_ids[order]
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=nlist))))
+
+    return _write_store(path, matrix, ids, face_ids, centroids, offsets), len(centroids)
+
+
+def _published_generation(key):
+    """Newest generation of a school's store, shared or in its file."""
+    return max(cache.get(_generation_key(key), 0), _file_generation(store_path(key)))
+
+
+def _build_from_database(key):
+    """Write a school's encodings from the database to a new store file."""
+    from apps.students.face_vectors import stored_encoding
+    from apps.students.models import FaceEncoding
+
+    rows = list(FaceEncoding.objects.filter(
+        student__school_id=key,
+        student__is_active=True
+    ).values_list('id', 'student_id', 'encoding_vector', 'encoding'))
+
+    matrix = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+    ids = np.empty(len(rows), dtype='S16')
+    face_ids = np.empty(len(rows), dtype='S16')
+    for i, (face_id, student_id, vector_data, legacy_encoding) in enumerate(rows):
+        matrix[i] = stored_encoding(vector_data, legacy_encoding)
+        ids[i] = student_id.bytes
+        face_ids[i] = face_id.bytes
+
+    temp_path, nlist = write_store(store_path(key), matrix, ids, face_ids)
+    return temp_path, len(rows), nlist
+
+
+def rebuild_store(school_id):
+    """
+    Rebuild a school's store from the database, training IVF cells once it
+    has FACE_INDEX_MIN_TRAIN_SIZE encodings. Call with the build lock held.
+
+    The database load, training and file write run without the writer lock,
+    so appends are not blocked meanwhile. A change published while the file
+    was built may be missing from it: the build is retried once, and then
+    the new file is flagged stale so it is rebuilt again.
+    """
+    key = str(school_id)
+    path = store_path(key)
+    for attempt in range(2):
+        started = _published_generation(key)
+        temp_path, count, nlist = _build_from_database(key)
+        with _locked(key):
+            changed = _published_generation(key) != started
+            if changed and attempt == 0:
+                os.remove(temp_path)
+                continue
+            generation = max(_file_generation(path) + 1, cache.get(_generation_key(key), 0))
+            _swap_in(temp_path, path, generation, STALE if changed else 0)
+            _publish_generation(key, generation)
+        logger.info(
+            f"Rebuilt face store for school {key}: {count} encodings "
+            f"in {nlist} cells (generation {generation})"
+        )
+        return
+
+
+def _needs_rebuild(views):
+    """True if the file is stale or its tail or tombstones have grown too large."""
+    header = views['header']
+    if int(header['flags'][0]) & STALE:
+        return True
+    count = int(header['count'][0])
+    tail = count - int(views['offsets'][-1])
+    max_dead = getattr(settings, 'FACE_EMBEDDING_STORE_MAX_DEAD_FRACTION', 0.2)
+    min_train_size = getattr(settings, 'FACE_INDEX_MIN_TRAIN_SIZE', 1024)
+    return tail >= max(min_train_size, count - tail) or int(header['dead'][0]) > max_dead * count
+
+
+def _out_of_date(key):
+    """True if a school's file is missing, unreadable, behind the shared generation or needs a rebuild."""
+    try:
+        views = _map_writable(store_path(key))
+    except (FileNotFoundError, ValueError):
+        return True
+    generation = int(views['header']['generation'][0])
+    return _needs_rebuild(views) or generation < cache.get(_generation_key(key), 0)
+
+
+_rebuilding = set()
+_rebuilding_lock = threading.Lock()
+
+
+def _rebuild_in_background(school_id):
+    key = str(school_id)
+    with _rebuilding_lock:
+        if key in _rebuilding:
+            return
+        _rebuilding.add(key)
+
+    def run():
+        close_old_connections()
+        try:
+            with _locked(key, 'build'):
+                # Another process may have rebuilt it while we waited for the lock
+                if not _out_of_date(key):
+                    return
+                rebuild_store(key)
+        except Exception as e:
+            logger.error(f"Face store rebuild failed for school {key}: {str(e)}", exc_info=True)
+        finally:
+            with _rebuilding_lock:
+                _rebuilding.discard(key)
+            close_old_connections()
+
+    threading.Thread(target=run, name=f'face-store-{key}', daemon=True).start()
+
+
+def _update(school_id, apply):
+    """
+    Apply an in-place change to a school's file under the writer lock.
+    `apply(views)` returns False when the change does not fit (store full).
+    Files that already missed a change are flagged stale instead.
+    """
+    key = str(school_id)
+    with _locked(key):
+        shared = _bump_generation(key)
+        path = store_path(key)
+        if not os.path.exists(path):
+            # Built from the database on first use
+            return
+        try:
+            views = _map_writable(path)
+        except ValueError:
+            # Unreadable file: drop it and let the next reader rebuild
+            os.remove(path)
+            return
+
+        header = views['header']
+        generation = int(header['generation'][0])
+        if (
+            generation < shared - 1
+            or int(header['flags'][0]) & STALE
+            or apply(views) is False
+        ):
+            header['flags'] = int(header['flags'][0]) | STALE
+        header['generation'] = max(generation + 1, shared)
+        views['flush']()
+        _publish_generation(key, int(header['generation'][0]))
+        rebuild = _needs_rebuild(views)
+    if rebuild:
+        _rebuild_in_background(key)
+
+
+def append_to_store(school_id, student_id, encoding, face_id=None):
+    """Append one encoding to the unsorted tail of a school's store."""
+    vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+
+    def apply(views):
+        header = views['header']
+        row = int(header['count'][0])
+        if row >= int(header['capacity'][0]):
+            return False
+        views['matrix'][row] = vector
+        views['sq_norms'][row] = float(vector @ vector)
+        views['ids'][row] = uuid.UUID(str(student_id)).bytes
+        views['face_ids'][row] = uuid.UUID(str(face_id)).bytes if face_id else b''
+        # Publish the row only once it is fully written
+        header['count'] = row + 1
+
+    _update(school_id, apply)
+
+
+def remove_from_store(school_id, face_id):
+    """Tombstone a deleted encoding; the next rebuild drops it."""
+    target = np.array(uuid.UUID(str(face_id)).bytes, dtype='S16')
+
+    def apply(views):
+        count = int(views['header']['count'][0])
+        rows = np.flatnonzero(
+            (views['face_ids'][:count] == target) & np.isfinite(views['sq_norms'][:count])
+        )
+        views['sq_norms'][rows] = np.inf
+        views['header']['dead'] = int(views['header']['dead'][0]) + len(rows)
+
+    _update(school_id, apply)
+
+
+def invalidate_store(school_id):
+    """Flag a school's file for rebuild (e.g. a student moved or left)."""
+    _update(school_id, lambda views: False)
+
+
+_open_stores = OrderedDict()
+_open_stores_lock = threading.Lock()
+
+
+def _open_current(key, generation):
+    """
+    Open the school's file, building it first only if missing or unreadable.
+
+    A stale or out-of-date file is still returned, and rebuilt in the
+    background; readers reopen once the new file is swapped in.
+    """
+    path = store_path(key)
+    try:
+        store = EmbeddingStore(path)
+    except (FileNotFoundError, ValueError):
+        with _locked(key, 'build'):
+            # Another process may have built it while we waited for the lock
+            try:
+                store = EmbeddingStore(path)
+            except (FileNotFoundError, ValueError):
+                rebuild_store(key)
+                store = EmbeddingStore(path)
+
+    if not store.is_current(generation):
+        _rebuild_in_background(key)
+    return store
+
+
+def get_school_store(school_id):
+    """Return the mapped store for a school, reopening it after changes."""
+    key = str(school_id)
+    generation = cache.get(_generation_key(key), 0)
+
+    with _open_stores_lock:
+        store = _open_stores.get(key)
+    if store is not None and not store.is_superseded:
+        # Keep serving a stale mapping until its rebuild is swapped in
+        if not store.is_current(generation):
+            _rebuild_in_background(key)
+        with _open_stores_lock:
+            _open_stores.move_to_end(key)
+        return store
+
+    store = _open_current(key, generation)
+    with _open_stores_lock:
+        _open_stores[key] = store
+        _open_stores.move_to_end(key)
+        while len(_open_stores) > getattr(settings, 'FACE_INDEX_CACHE_SIZE', 32):
+            _open_stores.popitem(last=False)
+    return store
@@ -0,0 +1,397 @@
+"""
+Approximate nearest-neighbour face index for school-wide identification.
+
+Each school gets an inverted-file (IVF) index: encodings are partitioned by
+k-means into `nlist` cells and a query only scans the `nprobe` cells whose
+centroids are closest to the probe. Small schools stay on an exact flat scan
+until they reach FACE_INDEX_MIN_TRAIN_SIZE encodings.
+
+Indexes are built from the database on first use, extended in place as
+FaceEncoding rows are created (see signals.py), and rebuilt after deletions.
+When FACE_EMBEDDING_STORE_DIR is set the same cells are kept in a
+memory-mapped file per school shared by all worker processes (see
+embedding_store); otherwise each process builds its own IVFIndex.
+"""
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .gallery import ENCODING_DIM, GalleryCache, gallery_from_queryset, merge_candidates
+
+logger = logging.getLogger(__name__)
+
+
+def _squared_distances(probes, matrix, matrix_sq_norms):
+    """Squared euclidean distances (M x N) via one matrix product."""
+    probe_sq = np.einsum('ij,ij->i', probes, probes)
+    squared = probe_sq[:, None] + matrix_sq_norms[None, :] - 2.0 * (probes @ matrix.T)
+    np.maximum(squared, 0.0, out=squared)
+    return squared
+
+
+def train_kmeans(matrix, nlist, iterations=10, seed=0):
+    """
+    Lloyd's k-means on float32 rows. Returns centroids (nlist x 128).
+    Empty cells are re-seeded from random rows.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    centroids = matrix[rng.choice(n, size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+        assignment = _squared_distances(matrix, centroids, centroid_sq).argmin(axis=1)
+
+        # Per-cell sums with one sorted reduceat instead of a scatter-add
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=nlist)
+        occupied = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[occupied])[:-1]))
+        centroids = np.zeros_like(centroids)
+        centroids[occupied] = (
+            np.add.reduceat(matrix[order], starts, axis=0) / counts[occupied, None]
+        )
+
+        empty = counts == 0
+        if empty.any():
+            centroids[empty] = matrix[rng.choice(n, size=int(empty.sum()), replace=False)]
+
+    return centroids.astype(np.float32)
+
+
+class _InvertedList:
+    """Growable contiguous storage for the rows of one IVF cell."""
+
+    def __init__(self, capacity=16):
+        self.vectors = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        self.sq_norms = np.empty(capacity, dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=object)
+        self.size = 0
+
+    def extend(self, vectors, ids):
+        needed = self.size + len(vectors)
+        if needed > len(self.vectors):
+            capacity = max(needed, 2 * len(self.vectors))
+            for name in ('vectors', 'sq_norms', 'ids'):
+                old = getattr(self, name)
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+
+        end = self.size + len(vectors)
+        self.vectors[self.size:end] = vectors
+        self.sq_norms[self.size:end] = np.einsum('ij,ij->i', vectors, vectors)
+        self.ids[self.size:end] = ids
+        self.size = end
+
+    def view(self):
+        return self.vectors[:self.size], self.sq_norms[:self.size], self.ids[:self.size]
+
+
+def _no_match():
+    return {
+        'student_id': None,
+        'distance': float('inf'),
+        'runner_up_id': None,
+        'runner_up_distance': float('inf'),
+        'margin': 0.0,
+        'candidates': [],
+    }
+
+
+def ranked_match(distances, ids):
+    """
+    Build a match result from distances to candidate rows and their ids.
+    Rows at infinite distance (deleted from a store) are ignored.
+    """
+    result = _no_match()
+    k = min(len(distances), 32)
+    if not k:
+        return result
+
+    # Closest rows first; the runner-up is the closest row of another student
+    nearest = np.argpartition(distances, k - 1)[:k]
+    nearest = nearest[np.argsort(distances[nearest])]
+    nearest = nearest[np.isfinite(distances[nearest])]
+    if not len(nearest):
+        return result
+
+    best = nearest[0]
+    result['student_id'] = ids[best]
+    result['distance'] = float(distances[best])
+    for row in nearest[1:]:
+        if ids[row] != ids[best]:
+            result['runner_up_id'] = ids[row]
+            result['runner_up_distance'] = float(distances[row])
+            break
+    result['margin'] = result['runner_up_distance'] - result['distance']
+
+    # First row of each student among the nearest rows, in distance order
+    top_k = getattr(settings, 'FACE_MATCH_TOP_K', 3)
+    seen = set()
+    for row in nearest:
+        if ids[row] not in seen:
+            seen.add(ids[row])
+            result['candidates'].append({'student_id': ids[row], 'distance': float(distances[row])})
+            if len(seen) == top_k:
+                break
+    return result
+
+
+class IVFIndex:
+    """
+    Inverted-file index over face encodings.
+
+    Untrained indexes hold everything in a single cell and answer with an
+    exact scan; `train` partitions the rows into about sqrt(N) cells.
+    Centroids and cells are swapped as one tuple so queries never see a
+    half-trained index. Indexes built from a gallery are trained while
+    loading; when appends make training due, it runs in a background
+    thread and the index keeps answering from its current cells meanwhile.
+    """
+
+    def __init__(self, nprobe=None, min_train_size=None):
+        self.nprobe = nprobe or getattr(settings, 'FACE_INDEX_NPROBE', 8)
+        self.min_train_size = min_train_size or getattr(settings, 'FACE_INDEX_MIN_TRAIN_SIZE', 1024)
+        # (centroids or None, centroid squared norms or None, cells)
+        self._state = (None, None, [_InvertedList()])
+        self.trained_size = 0
+        self._lock = threading.Lock()
+        # While training: rows added since its snapshot, else None
+        self._added = None
+
+    @classmethod
+    def from_gallery(cls, gallery, **kwargs):
+        index = cls(**kwargs)
+        index.add(gallery.matrix, gallery.ids, background=False)
+        return index
+
+    def __len__(self):
+        return sum(cell.size for cell in self._state[2])
+
+    @property
+    def is_trained(self):
+        return self._state[0] is not None
+
+    @property
+    def is_training(self):
+        return self._added is not None
+
+    @property
+    def student_ids(self):
+        ids = [cell.view()[2] for cell in self._state[2]]
+        return np.unique(np.concatenate(ids)) if len(self) else np.empty(0, dtype=object)
+
+    def train(self):
+        """
+        Partition all stored rows into about sqrt(N) k-means cells.
+        Returns False if another training is already running.
+        """
+        with self._lock:
+            if self._added is not None:
+                return False
+            self._added = []
+        self._train()
+        return True
+
+    def _train(self):
+        """Run k-means without the lock, then swap in the new cells. Call with _added set."""
+        try:
+            with self._lock:
+                views = [cell.view() for cell in self._state[2]]
+                matrix = np.concatenate([v[0] for v in views])
+                ids = np.concatenate([v[2] for v in views])
+                self._added = []
+
+            nlist = max(1, int(np.sqrt(len(matrix))))
+            centroids = train_kmeans(matrix, nlist)
+            state = (centroids, np.einsum('ij,ij->i', centroids, centroids),
+                     [_InvertedList() for _ in range(nlist)])
+            self._assign(state, matrix, ids)
+
+            with self._lock:
+                # Rows appended while k-means ran
+                for vectors, added_ids in self._added:
+                    self._assign(state, vectors, added_ids)
+                self._state = state
+                self.trained_size = len(matrix)
+        finally:
+            with self._lock:
+                self._added = None
+
+        logger.info(f"Trained face index: {len(matrix)} encodings in {nlist} cells")
+
+    def _train_in_background(self):
+        try:
+            self._train()
+        except Exception as e:
+            logger.error(f"Face index training failed: {str(e)}", exc_info=True)
+
+    @staticmethod
+    def _assign(state, vectors, ids):
+        centroids, centroid_sq, cells = state
+        if centroids is None:
+            cells[0].extend(vectors, ids)
+            return
+        nearest = _squared_distances(vectors, centroids, centroid_sq).argmin(axis=1)
+        for cell in np.unique(nearest):
+            mask = nearest == cell
+            cells[cell].extend(vectors[mask], ids[mask])
+
+    def add(self, vectors, ids, background=True):
+        """
+        Add one or more encodings with their student ids.
+
+        Trains once big enough and retrains when the data has doubled since;
+        in a background thread unless `background` is False.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        ids = np.asarray(ids, dtype=object).reshape(-1)
+        if not len(vectors):
+            return
+
+        with self._lock:
+            self._assign(self._state, vectors, ids)
+            if self._added is not None:
+                self._added.append((vectors, ids))
+                return
+            size = len(self)
+            due = (
+                (not self.is_trained and size >= self.min_train_size)
+                or (self.is_trained and size >= 2 * self.trained_size)
+            )
+            if due:
+                self._added = []
+
+        if not due:
+            return
+        if background:
+            threading.Thread(target=self._train_in_background, name='face-index-train', daemon=True).start()
+        else:
+            self._train()
+
+    def _candidates(self, probe):
+        centroids, centroid_sq, cells = self._state
+        if centroids is None:
+            probed = [0]
+        else:
+            centroid_d = _squared_distances(probe[None, :], centroids, centroid_sq)[0]
+            nprobe = min(self.nprobe, len(centroids))
+            probed = np.argpartition(centroid_d, nprobe - 1)[:nprobe]
+
+        views = [cells[cell].view() for cell in probed]
+        views = [v for v in views if len(v[0])]
+        if not views:
+            return None, None, None
+        if len(views) == 1:
+            return views[0]
+        return (
+            np.concatenate([v[0] for v in views]),
+            np.concatenate([v[1] for v in views]),
+            np.concatenate([v[2] for v in views]),
+        )
+
+    def match(self, encoding):
+        """
+        Approximate closest student to a single encoding.
+        Returns the same keys as FaceGallery.match, minus student_distances.
+        """
+        probe = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        vectors, sq_norms, ids = self._candidates(probe)
+        if vectors is None:
+            return _no_match()
+
+        distances = np.sqrt(_squared_distances(probe[None, :], vectors, sq_norms)[0])
+        return ranked_match(distances, ids)
+
+
+class FaceIndexGroup:
+    """Query several school indexes as one and keep the closest answer."""
+
+    def __init__(self, indexes):
+        self.indexes = [index for index in indexes if len(index)]
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes)
+
+    @property
+    def student_ids(self):
+        ids = [index.student_ids for index in self.indexes]
+        return np.concatenate(ids) if ids else np.empty(0, dtype=object)
+
+    def match(self, encoding):
+        results = sorted(
+            (index.match(encoding) for index in self.indexes),
+            key=lambda result: result['distance']
+        )
+        if not results:
+            return _no_match()
+
+        best = dict(results[0])
+        if len(results) > 1 and results[1]['distance'] < best['runner_up_distance']:
+            best['runner_up_id'] = results[1]['student_id']
+            best['runner_up_distance'] = results[1]['distance']
+            best['margin'] = best['runner_up_distance'] - best['distance']
+        best['candidates'] = merge_candidates(*(result['candidates'] for result in results))
+        return best
+
+
+def load_school_index(school_id):
+    """Build the index of active students in a school from the database."""
+    from apps.students.models import FaceEncoding
+
+    gallery = gallery_from_queryset(FaceEncoding.objects.filter(
+        student__school_id=school_id,
+        student__is_active=True
+    ))
+    return IVFIndex.from_gallery(gallery)
+
+
+school_indexes = GalleryCache(
+    'face_index_school',
+    load_school_index,
+    getattr(settings, 'FACE_INDEX_CACHE_SIZE', 32)
+)
+
+
+def _use_store():
+    return bool(getattr(settings, 'FACE_EMBEDDING_STORE_DIR', None))
+
+
+def get_school_indexes(school_ids):
+    """Return one searchable group over the given schools' indexes."""
+    if _use_store():
+        from .embedding_store import get_school_store
+        return FaceIndexGroup(get_school_store(school_id) for school_id in school_ids)
+    return FaceIndexGroup(school_indexes.get(school_id) for school_id in school_ids)
+
+
+def add_to_school_index(school_id, student_id, encoding, face_id=None):
+    """Append a new encoding to a school's index (if loaded here) or store."""
+    if _use_store():
+        from .embedding_store import append_to_store
+        append_to_store(school_id, student_id, encoding, face_id)
+    else:
+        school_indexes.apply(school_id, lambda index: index.add(encoding, [student_id]))
+
+
+def remove_from_school_index(school_id, face_id):
+    """Drop a deleted encoding: tombstoned in the store, else a rebuild."""
+    if _use_store():
+        from .embedding_store import remove_from_store
+        remove_from_store(school_id, face_id)
+    else:
+        invalidate_school_index(school_id)
+
+
+def invalidate_school_index(school_id):
+    """Force a rebuild of a school's index (e.g. after deletions)."""
+    if school_id is None:
+        return
+    if _use_store():
+        from .embedding_store import invalidate_store
+        invalidate_store(school_id)
+    else:
+        school_indexes.invalidate(school_id)
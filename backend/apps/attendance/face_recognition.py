@@ -3,11 +3,14 @@ Face recognition utilities for attendance.
 """
 import logging
 import numpy as np
-from io import BytesIO
-from io import BytesIO
-from PIL import Image, ImageOps
 from django.conf import settings
 
+from apps.students.face_vectors import pack_encoding, unpack_encoding
+from .admission import admitted
+from .gallery import FaceGallery
+from .imaging import StageTimer, encode_scan_photo, load_face_image
+from .workers import FaceServiceBusy, extract_in_worker, get_worker_pool
+
 logger = logging.getLogger(__name__)
 
 # Flag to check if face_recognition is available
@@ -20,306 +23,620 @@ except ImportError:
     logger.warning("face_recognition library not available. Using mock implementation.")
 
 
-def generate_face_encoding(image_file):
+def extract_face_encodings(image_file, max_faces=None, scan_photo=False, face_box=None):
+    """
+    Decode, detect and encode faces in an uploaded image.
+    
+    Runs in the face worker pool when FACE_WORKER_PROCESSES > 0, otherwise
+    inline, once the admission queue grants a slot (see admission; callers
+    set the priority and school with face_request). See
+    extract_face_encodings_local for the arguments and return value.
+    
+    Raises:
+        FaceServiceBusy: if the request is refused or dropped by the admission
+                         queue, or the worker pool is saturated or times out
+    """
+    with admitted():
+        pool = get_worker_pool()
+        if pool is not None:
+            return extract_in_worker(pool, image_file, max_faces=max_faces, scan_photo=scan_photo, face_box=face_box)
+        return extract_face_encodings_local(image_file, max_faces=max_faces, scan_photo=scan_photo, face_box=face_box)
+
+
+def _detect_in_hint(face_image, face_box, model):
+    """Detect faces only in the padded crop around a client face box."""
+    array, scale, offset = face_image.hint_region(face_box)
+    return [
+        face_image.to_image_box(location, scale=scale, offset=offset)
+        for location in face_recognition.face_locations(array, number_of_times_to_upsample=0, model=model)
+    ]
+
+
+def extract_face_encodings_local(image_file, max_faces=None, scan_photo=False, face_box=None):
+    """
+    Decode, detect and encode faces in an uploaded image in this process.
+    
+    Detection runs on a downscaled copy (FACE_DETECTION_MAX_EDGE); each box
+    is mapped back to a moderate-resolution crop (FACE_ENCODING_MAX_EDGE)
+    for encoding. With a face box hint, detection first runs only on a small
+    crop around the hint and falls back to the full frame if that finds no face.
+    
+    Args:
+        image_file: Django uploaded file object
+        max_faces: Encode at most this many faces (largest first), None for all
+        scan_photo: Also re-encode the decoded image as the stored scan photo
+        face_box: Optional client hint, (left, top, right, bottom) as
+                  fractions of the image size (see imaging.parse_face_box)
+    
+    Returns:
+        dict: {
+            'success': bool,
+            'encodings': list of ndarray (128-dimensional vectors),
+            'locations': list of (top, right, bottom, left) boxes in the
+                         encoding-resolution image,
+            'face_count': int (faces detected, before max_faces),
+            'hinted': bool (faces were found inside the face box hint),
+            'timings': dict of stage -> milliseconds,
+            'scan_photo': ScanPhoto on success when requested, else None,
+            'error': str or None
+        }
+    """
+    model = getattr(settings, 'FACE_DETECTION_MODEL', 'hog')
+    upsample = getattr(settings, 'FACE_DETECTION_UPSAMPLE', 1)
+    
+    face_image = load_face_image(image_file)
+    timings = face_image.timings
+    
+    boxes = []
+    if face_box is not None:
+        with StageTimer(timings, 'hint_detect_ms'):
+            boxes = _detect_in_hint(face_image, face_box, model)
+        if not boxes:
+            logger.info("No face inside the face box hint, detecting on the full frame")
+    hinted = bool(boxes)
+    
+    if not boxes:
+        with StageTimer(timings, 'detect_ms'):
+            detected = face_recognition.face_locations(
+                face_image.detect_array,
+                number_of_times_to_upsample=upsample,
+                model=model
+            )
+        boxes = [face_image.to_image_box(location) for location in detected]
+    
+    if not boxes:
+        return {
+            'success': False,
+            'encodings': [],
+            'locations': [],
+            'face_count': 0,
+            'hinted': False,
+            'timings': timings,
+            'scan_photo': None,
+            'error': 'No face detected'
+        }
+    
+    face_count = len(boxes)
+    # Largest face first: the child being scanned is closest to the camera
+    boxes.sort(key=lambda box: (box[2] - box[0]) * (box[1] - box[3]), reverse=True)
+    if max_faces is not None:
+        boxes = boxes[:max_faces]
+    
+    encodings = []
+    with StageTimer(timings, 'encode_ms'):
+        for box in boxes:
+            crop, relative_box = face_image.crop_for_encoding(box)
+            encoded = face_recognition.face_encodings(crop, [relative_box])
+            if encoded:
+                encodings.append(encoded[0])
+    
+    if not encodings:
+        return {
+            'success': False,
+            'encodings': [],
+            'locations': boxes,
+            'face_count': face_count,
+            'hinted': hinted,
+            'timings': timings,
+            'scan_photo': None,
+            'error': 'Could not process face'
+        }
+    
+    # Stored scan photo comes from the pixels already decoded for detection
+    photo = None
+    if scan_photo:
+        with StageTimer(timings, 'scan_photo_ms'):
+            photo = encode_scan_photo(face_image.image)
+    
+    logger.debug(f"Face pipeline timings: {timings}")
+    
+    return {
+        'success': True,
+        'encodings': encodings,
+        'locations': boxes,
+        'face_count': face_count,
+        'hinted': hinted,
+        'timings': timings,
+        'scan_photo': photo,
+        'error': None
+    }
+
+
+def generate_face_encoding(image_file, face_box=None):
     """
     Generate face encoding from an uploaded image.
     
     Args:
         image_file: Django uploaded file object
+        face_box: Optional client face box hint (see extract_face_encodings_local)
     
     Returns:
         dict: {
             'success': bool,
             'encoding': list (128-dimensional vector) or None,
+            'encoding_bytes': bytes (packed float32, see face_vectors) or None,
             'confidence': float,
+            'timings': dict of stage -> milliseconds,
             'error': str or None
         }
     """
     if not FACE_RECOGNITION_AVAILABLE:
         # Return mock encoding for development
+        encoding = np.random.rand(128)
         return {
             'success': True,
-            'encoding': list(np.random.rand(128)),
+            'encoding': encoding.tolist(),
+            'encoding_bytes': pack_encoding(encoding),
             'confidence': 0.95,
+            'timings': {},
             'error': None
         }
     
     try:
-        # Read image
-        image_data = image_file.read()
-        image = Image.open(BytesIO(image_data))
-        image = ImageOps.exif_transpose(image)
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Convert to numpy array
-        image_array = np.array(image)
+        extracted = extract_face_encodings(image_file, max_faces=1, face_box=face_box)
         
-        # Find face locations
-        face_locations = face_recognition.face_locations(image_array)
-        
-        if not face_locations:
+        if extracted['face_count'] == 0:
             return {
                 'success': False,
                 'encoding': None,
+                'encoding_bytes': None,
                 'confidence': 0.0,
+                'timings': extracted['timings'],
                 'error': 'No face detected in the image'
             }
         
-        if len(face_locations) > 1:
+        if extracted['face_count'] > 1:
             return {
                 'success': False,
                 'encoding': None,
+                'encoding_bytes': None,
                 'confidence': 0.0,
+                'timings': extracted['timings'],
                 'error': 'Multiple faces detected. Please upload an image with only one face.'
             }
         
-        # Generate encoding
-        encodings = face_recognition.face_encodings(image_array, face_locations)
-        
-        if not encodings:
+        if not extracted['success']:
             return {
                 'success': False,
                 'encoding': None,
+                'encoding_bytes': None,
                 'confidence': 0.0,
+                'timings': extracted['timings'],
                 'error': 'Could not generate face encoding'
             }
         
-        encoding = encodings[0]
-        
-        # Reset file pointer
-        image_file.seek(0)
+        encoding = extracted['encodings'][0]
         
         return {
             'success': True,
             'encoding': encoding.tolist(),
+            'encoding_bytes': pack_encoding(encoding),
             'confidence': 1.0,  # face_recognition doesn't provide confidence for encoding
+            'timings': extracted['timings'],
             'error': None
         }
     
+    except FaceServiceBusy:
+        raise
     except Exception as e:
         logger.error(f"Error generating face encoding: {str(e)}")
         return {
             'success': False,
             'encoding': None,
+            'encoding_bytes': None,
             'confidence': 0.0,
+            'timings': {},
             'error': str(e)
         }
 
 
-def match_face(image_file, student_encodings, tolerance=None):
+def match_encoding(encoding, gallery, tolerance=None):
+    """
+    Match an already computed face encoding against a gallery.
+    
+    Args:
+        encoding: 128-dimensional vector
+        gallery: FaceGallery, face index, or anything with a compatible match()
+        tolerance: Float, lower means stricter matching (default from settings)
+    
+    Returns:
+        dict: same keys as match_face, without timings
+    """
+    if tolerance is None:
+        tolerance = getattr(settings, 'FACE_RECOGNITION_TOLERANCE', 0.6)
+    
+    min_confidence = getattr(settings, 'FACE_RECOGNITION_MIN_CONFIDENCE', 0.7)
+    ambiguous_margin = getattr(settings, 'FACE_MATCH_AMBIGUOUS_MARGIN', 0.06)
+    
+    # Compare against every known encoding in one batched pass
+    match = gallery.match(encoding)
+    best_match = match['student_id']
+    best_distance = match['distance']
+    
+    # Convert distance to confidence (0 = perfect match, 1 = no match)
+    confidence = 1 - best_distance
+    
+    candidates = [
+        {
+            'student_id': candidate['student_id'],
+            'distance': candidate['distance'],
+            'confidence': 1 - candidate['distance'],
+        }
+        for candidate in match['candidates']
+    ]
+    
+    logger.info(
+        f"Face match result: distance={best_distance:.4f}, confidence={confidence:.4f}, "
+        f"margin={match['margin']:.4f}, tolerance={tolerance}"
+    )
+    
+    if best_distance <= tolerance and confidence >= min_confidence:
+        # A runner-up that also passes and is nearly as close is a look-alike
+        ambiguous = (
+            match['runner_up_distance'] <= tolerance
+            and match['margin'] < ambiguous_margin
+        )
+        logger.info(f"Match found: student_id={best_match}, ambiguous={ambiguous}")
+        return {
+            'success': True,
+            'student_id': best_match,
+            'confidence': confidence,
+            'distance': best_distance,
+            'margin': match['margin'],
+            'ambiguous': ambiguous,
+            'candidates': candidates,
+            'error': None
+        }
+    
+    logger.warning(f"No match found: best_distance={best_distance:.4f} > tolerance={tolerance}")
+    return {
+        'success': False,
+        'student_id': None,
+        'confidence': confidence,
+        'distance': best_distance,
+        'margin': match['margin'],
+        'ambiguous': False,
+        'candidates': candidates,
+        'error': 'No matching student found'
+    }
+
+
+def _failed_match(error, timings=None, encoding=None):
+    """match_face result for a scan that matched nobody."""
+    return {
+        'success': False,
+        'student_id': None,
+        'confidence': 0.0,
+        'distance': float('inf'),
+        'margin': 0.0,
+        'ambiguous': False,
+        'candidates': [],
+        'timings': timings or {},
+        'scan_photo': None,
+        'encoding': encoding,
+        'error': error
+    }
+
+
+def _failed_group_match(error, face_count=0, timings=None):
+    """match_faces result for a group photo that matched nobody."""
+    return {
+        'success': False,
+        'matches': [],
+        'face_count': face_count,
+        'unmatched_count': face_count,
+        'timings': timings or {},
+        'scan_photo': None,
+        'error': error
+    }
+
+
+def _mock_scan_photo(image_file, scan_photo):
+    """Scan photo for the mock paths, which never decode the image otherwise."""
+    if not scan_photo:
+        return None
+    return encode_scan_photo(load_face_image(image_file).image)
+
+
+def match_face(image_file, student_encodings, tolerance=None, scan_photo=False, face_box=None):
     """
     Match a face in an image against known student encodings.
     
     Args:
         image_file: Django uploaded file object
-        student_encodings: List of dicts with 'student_id' and 'encoding'
+        student_encodings: FaceGallery (or face index), or list of dicts with
+                           'student_id' and 'encoding'
         tolerance: Float, lower means stricter matching (default from settings)
+        scan_photo: Also return the re-encoded photo to store with the scan
+        face_box: Optional client face box hint (see extract_face_encodings_local)
     
     Returns:
         dict: {
             'success': bool,
             'student_id': UUID or None,
             'confidence': float,
+            'distance': float,
+            'margin': float (distance gap to the runner-up student),
+            'ambiguous': bool (runner-up also passes within
+                         FACE_MATCH_AMBIGUOUS_MARGIN of the best),
+            'candidates': list of {'student_id', 'distance', 'confidence'},
+                          the nearest FACE_MATCH_TOP_K students,
+            'timings': dict of stage -> milliseconds,
+            'scan_photo': ScanPhoto when a face was found and it was requested, else None,
+            'encoding': the scan's face encoding when a face was found, else None,
             'error': str or None
         }
+        Every branch returns all of these keys.
     """
-    if tolerance is None:
-        tolerance = getattr(settings, 'FACE_RECOGNITION_TOLERANCE', 0.6)
-    
-    min_confidence = getattr(settings, 'FACE_RECOGNITION_MIN_CONFIDENCE', 0.7)
+    if hasattr(student_encodings, 'match'):
+        gallery = student_encodings
+    else:
+        gallery = FaceGallery.from_encodings(student_encodings)
     
     if not FACE_RECOGNITION_AVAILABLE:
         # Return mock match for development (match first student)
-        if student_encodings:
+        if len(gallery):
             return {
                 'success': True,
-                'student_id': student_encodings[0]['student_id'],
+                'student_id': gallery.student_ids[0],
                 'confidence': 0.92,
+                'distance': 0.08,
+                'margin': float('inf'),
+                'ambiguous': False,
+                'candidates': [{
+                    'student_id': gallery.student_ids[0],
+                    'distance': 0.08,
+                    'confidence': 0.92,
+                }],
+                'timings': {},
+                'scan_photo': _mock_scan_photo(image_file, scan_photo),
+                'encoding': None,
                 'error': None
             }
-        return {
-            'success': False,
-            'student_id': None,
-            'confidence': 0.0,
-            'error': 'No students to match against'
-        }
+        return _failed_match('No students to match against')
     
     try:
-        # Read image
-        image_data = image_file.read()
-        image = Image.open(BytesIO(image_data))
-        image = ImageOps.exif_transpose(image)
-        
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        image_array = np.array(image)
-        
-        # Find face in scan image
-        face_locations = face_recognition.face_locations(image_array)
+        extracted = extract_face_encodings(image_file, max_faces=1, scan_photo=scan_photo, face_box=face_box)
         
-        if not face_locations:
-            return {
-                'success': False,
-                'student_id': None,
-                'confidence': 0.0,
-                'error': 'No face detected'
-            }
-        
-        # Generate encoding for scanned face
-        scan_encodings = face_recognition.face_encodings(image_array, face_locations)
-        
-        if not scan_encodings:
-            return {
-                'success': False,
-                'student_id': None,
-                'confidence': 0.0,
-                'error': 'Could not process face'
-            }
+        if not extracted['success']:
+            return _failed_match(extracted['error'], extracted['timings'])
         
-        scan_encoding = scan_encodings[0]
-        
-        # Compare against known encodings
-        best_match = None
-        best_distance = float('inf')
-        
-        for student_data in student_encodings:
-            known_encoding = np.array(student_data['encoding'])
-            
-            # Calculate face distance
-            distance = face_recognition.face_distance([known_encoding], scan_encoding)[0]
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_match = student_data['student_id']
-        
-        # Reset file pointer
-        image_file.seek(0)
-        
-        # Convert distance to confidence (0 = perfect match, 1 = no match)
-        confidence = 1 - best_distance
-        
-        # Convert distance to confidence (0 = perfect match, 1 = no match)
-        confidence = 1 - best_distance
-        
-        logger.info(f"Face match result: distance={best_distance:.4f}, confidence={confidence:.4f}, tolerance={tolerance}")
-        
-        if best_distance <= tolerance and confidence >= min_confidence:
-            logger.info(f"Match found: student_id={best_match}")
+        with StageTimer(extracted['timings'], 'match_ms'):
+            result = match_encoding(extracted['encodings'][0], gallery, tolerance)
+        result['timings'] = extracted['timings']
+        result['scan_photo'] = extracted['scan_photo']
+        result['encoding'] = extracted['encodings'][0]
+        return result
+    
+    except FaceServiceBusy:
+        raise
+    except Exception as e:
+        logger.error(f"Error matching face: {str(e)}")
+        return _failed_match(str(e))
+
+
+def match_faces(image_file, gallery, tolerance=None, scan_photo=False):
+    """
+    Detect every face in a group photo and assign each to a distinct student.
+    
+    Args:
+        image_file: Django uploaded file object
+        gallery: FaceGallery of candidate students
+        tolerance: Float, lower means stricter matching (default from settings)
+        scan_photo: Also return the re-encoded photo to store with the scans
+    
+    Returns:
+        dict: {
+            'success': bool,
+            'matches': list of {'student_id', 'confidence', 'distance', 'margin',
+                       'ambiguous', 'candidates', 'location'}, with the same
+                       meaning as in match_face,
+            'face_count': int (faces detected),
+            'unmatched_count': int (faces not assigned to any student),
+            'timings': dict of stage -> milliseconds,
+            'scan_photo': ScanPhoto on success when requested, else None,
+            'error': str or None
+        }
+        Every branch returns all of these keys.
+    """
+    if tolerance is None:
+        tolerance = getattr(settings, 'FACE_RECOGNITION_TOLERANCE', 0.6)
+    
+    min_confidence = getattr(settings, 'FACE_RECOGNITION_MIN_CONFIDENCE', 0.7)
+    max_faces = getattr(settings, 'FACE_GROUP_MAX_FACES', 10)
+    ambiguous_margin = getattr(settings, 'FACE_MATCH_AMBIGUOUS_MARGIN', 0.06)
+    
+    # Same acceptance rules as match_encoding: within tolerance and confident
+    max_distance = min(tolerance, 1 - min_confidence)
+    
+    if not FACE_RECOGNITION_AVAILABLE:
+        # Mock group match for development (match first student)
+        if len(gallery):
             return {
                 'success': True,
-                'student_id': best_match,
-                'confidence': confidence,
+                'matches': [{
+                    'student_id': gallery.student_ids[0],
+                    'confidence': 0.92,
+                    'distance': 0.08,
+                    'margin': float('inf'),
+                    'ambiguous': False,
+                    'candidates': [{
+                        'student_id': gallery.student_ids[0],
+                        'distance': 0.08,
+                        'confidence': 0.92,
+                    }],
+                    'location': None,
+                }],
+                'face_count': 1,
+                'unmatched_count': 0,
+                'timings': {},
+                'scan_photo': _mock_scan_photo(image_file, scan_photo),
                 'error': None
             }
-        else:
-            logger.warning(f"No match found: best_distance={best_distance:.4f} > tolerance={tolerance}")
-            return {
-                'success': False,
-                'student_id': None,
-                'confidence': confidence,
-                'error': 'No matching student found'
-            }
+        return _failed_group_match('No students to match against')
     
-    except Exception as e:
-        logger.error(f"Error matching face: {str(e)}")
+    try:
+        extracted = extract_face_encodings(image_file, max_faces=max_faces, scan_photo=scan_photo)
+        
+        if not extracted['success']:
+            return _failed_group_match(extracted['error'], extracted['face_count'], extracted['timings'])
+        
+        with StageTimer(extracted['timings'], 'match_ms'):
+            assignments = gallery.assign(extracted['encodings'], max_distance)
+        
+        matches = [
+            {
+                'student_id': assignment['student_id'],
+                'confidence': 1 - assignment['distance'],
+                'distance': assignment['distance'],
+                'margin': assignment['margin'],
+                # A runner-up that also passes and is nearly as close is a look-alike
+                'ambiguous': (
+                    assignment['runner_up_distance'] <= tolerance
+                    and assignment['margin'] < ambiguous_margin
+                ),
+                'candidates': [
+                    {
+                        'student_id': candidate['student_id'],
+                        'distance': candidate['distance'],
+                        'confidence': 1 - candidate['distance'],
+                    }
+                    for candidate in assignment['candidates']
+                ],
+                'location': extracted['locations'][assignment['face_index']],
+            }
+            for assignment in assignments
+        ]
+        
+        logger.info(
+            f"Group face match: {extracted['face_count']} faces, {len(matches)} matched, "
+            f"{sum(match['ambiguous'] for match in matches)} ambiguous"
+        )
+        
         return {
-            'success': False,
-            'student_id': None,
-            'confidence': 0.0,
-            'error': str(e)
+            'success': bool(matches),
+            'matches': matches,
+            'face_count': extracted['face_count'],
+            'unmatched_count': extracted['face_count'] - len(matches),
+            'timings': extracted['timings'],
+            'scan_photo': extracted['scan_photo'],
+            'error': None if matches else 'No matching students found'
         }
+    
+    except FaceServiceBusy:
+        raise
+    except Exception as e:
+        logger.error(f"Error matching group photo: {str(e)}")
+        return _failed_group_match(str(e))
 
 
-def verify_face(image_file, known_encoding, tolerance=None):
+def verify_face(image_file, known_encoding, tolerance=None, face_box=None):
     """
-    Verify if a face matches a specific known encoding.
+    Verify if a face matches a specific known encoding, or the closest of
+    several known faces.
     
     Args:
         image_file: Django uploaded file object
-        known_encoding: List (128-dimensional vector)
+        known_encoding: List, ndarray, or packed bytes (128-dimensional
+                        vector), or a FaceGallery of several known faces
+                        (e.g. a student's authorized pickups) compared in one call
         tolerance: Float, lower means stricter matching
+        face_box: Optional client face box hint (see extract_face_encodings_local)
     
     Returns:
         dict: {
             'success': bool,
             'is_match': bool,
             'confidence': float,
+            'matched_id': gallery id of the closest face (None for a single encoding),
+            'timings': dict of stage -> milliseconds,
             'error': str or None
         }
     """
     if tolerance is None:
         tolerance = getattr(settings, 'FACE_RECOGNITION_TOLERANCE', 0.6)
     
+    is_gallery = hasattr(known_encoding, 'match')
+    
     if not FACE_RECOGNITION_AVAILABLE:
-        # Mock verification for development
+        # Mock verification for development (match first known face)
         return {
             'success': True,
             'is_match': True,
             'confidence': 0.88,
+            'matched_id': known_encoding.student_ids[0] if is_gallery and len(known_encoding) else None,
+            'timings': {},
             'error': None
         }
     
     try:
-        # Read image
-        image_data = image_file.read()
-        image = Image.open(BytesIO(image_data))
-        image = ImageOps.exif_transpose(image)
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        image_array = np.array(image)
+        extracted = extract_face_encodings(image_file, max_faces=1, face_box=face_box)
         
-        # Find face
-        face_locations = face_recognition.face_locations(image_array)
-        
-        if not face_locations:
+        if not extracted['success']:
             return {
                 'success': False,
                 'is_match': False,
                 'confidence': 0.0,
-                'error': 'No face detected'
+                'matched_id': None,
+                'timings': extracted['timings'],
+                'error': extracted['error']
             }
         
-        # Generate encoding
-        scan_encodings = face_recognition.face_encodings(image_array, face_locations)
+        scan_encoding = extracted['encodings'][0]
+        matched_id = None
+        with StageTimer(extracted['timings'], 'match_ms'):
+            if is_gallery:
+                match = known_encoding.match(scan_encoding)
+                distance = match['distance']
+                matched_id = match['student_id']
+            else:
+                if isinstance(known_encoding, (bytes, memoryview)):
+                    known_array = unpack_encoding(known_encoding)
+                else:
+                    known_array = np.asarray(known_encoding, dtype=np.float32)
+                distance = float(np.linalg.norm(known_array - scan_encoding))
         
-        if not scan_encodings:
-            return {
-                'success': False,
-                'is_match': False,
-                'confidence': 0.0,
-                'error': 'Could not process face'
-            }
-        
-        scan_encoding = scan_encodings[0]
-        known_array = np.array(known_encoding)
-        
-        # Compare
-        distance = face_recognition.face_distance([known_array], scan_encoding)[0]
         confidence = 1 - distance
         is_match = distance <= tolerance
         
-        # Reset file pointer
-        image_file.seek(0)
-        
         return {
             'success': True,
             'is_match': is_match,
             'confidence': confidence,
+            'matched_id': matched_id,
+            'timings': extracted['timings'],
             'error': None
         }
     
+    except FaceServiceBusy:
+        raise
     except Exception as e:
         logger.error(f"Error verifying face: {str(e)}")
         return {
             'success': False,
             'is_match': False,
             'confidence': 0.0,
+            'matched_id': None,
+            'timings': {},
             'error': str(e)
         }
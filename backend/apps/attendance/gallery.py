@@ -0,0 +1,492 @@
+"""
+Face gallery matching for attendance.
+
+A gallery is a contiguous float32 matrix of known face encodings (N x 128)
+with a parallel array of student ids. All distances for a scan are computed
+in one batched operation instead of one NumPy call per stored encoding.
+
+Each student also has a centroid (stored on Student, or the mean of their
+rows). In galleries with many students a scan first shortlists the
+FACE_CENTROID_SHORTLIST students with the nearest centroids and compares
+only their rows.
+
+Route galleries are cached per process in an LRU keyed by route id and
+invalidated by signals on FaceEncoding and Student (see signals.py); the
+invalidation reaches every worker process through generation counters in
+the shared Django cache (Redis, see CACHES).
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+ENCODING_DIM = 128
+
+
+class FaceGallery:
+    """
+    Known face encodings grouped by student.
+
+    Rows are sorted by student so the per-student minimum distance across
+    multiple encodings is a single `np.minimum.reduceat` call.
+
+    `centroids` optionally maps student ids to stored centroids; missing
+    ones are the mean of the student's rows.
+    """
+
+    def __init__(self, matrix, ids, centroids=None):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        ids = np.asarray(ids, dtype=object).reshape(-1)
+
+        if len(matrix) != len(ids):
+            raise ValueError('Gallery matrix and id array must have the same length')
+
+        if len(ids):
+            student_ids, inverse = np.unique(ids, return_inverse=True)
+            order = np.argsort(inverse, kind='stable')
+            matrix = matrix[order]
+            inverse = inverse[order]
+            starts = np.flatnonzero(np.r_[True, inverse[1:] != inverse[:-1]])
+        else:
+            student_ids = np.empty(0, dtype=object)
+            inverse = np.empty(0, dtype=np.intp)
+            starts = np.empty(0, dtype=np.intp)
+
+        self.matrix = np.ascontiguousarray(matrix)
+        self.ids = student_ids[inverse] if len(ids) else ids
+        self.student_ids = student_ids
+        self._starts = starts
+        self.matrix.flags.writeable = False
+        self._sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self._counts = np.diff(np.r_[starts, len(self.matrix)])
+        self._build_centroids(centroids or {})
+
+    def _build_centroids(self, stored):
+        self.centroids = np.empty((len(self.student_ids), ENCODING_DIM), dtype=np.float32)
+        if len(self.student_ids):
+            self.centroids[:] = np.add.reduceat(self.matrix, self._starts, axis=0) / self._counts[:, None]
+            for i, student_id in enumerate(self.student_ids):
+                if stored.get(student_id) is not None:
+                    self.centroids[i] = stored[student_id]
+        self._centroid_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+    @classmethod
+    def from_encodings(cls, student_encodings):
+        """Build a gallery from a list of {'student_id', 'encoding'} dicts."""
+        if not student_encodings:
+            return cls(np.empty((0, ENCODING_DIM), dtype=np.float32), [])
+        matrix = np.array(
+            [item['encoding'] for item in student_encodings],
+            dtype=np.float32
+        )
+        ids = [item['student_id'] for item in student_encodings]
+        return cls(matrix, ids)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def student_count(self):
+        return len(self.student_ids)
+
+    def subset(self, student_ids):
+        """Gallery restricted to the given students; unknown ids are ignored."""
+        keep = np.fromiter(
+            (student_id in student_ids for student_id in self.student_ids),
+            dtype=bool, count=self.student_count
+        )
+        rows = np.repeat(keep, self._counts)
+        centroids = dict(zip(self.student_ids[keep], self.centroids[keep]))
+        return FaceGallery(self.matrix[rows], self.ids[rows], centroids)
+
+    def distances(self, encodings):
+        """
+        Euclidean distance from one encoding (128,) or a batch (M x 128)
+        to every gallery row. Returns (N,) or (M x N) respectively.
+        """
+        probes = np.asarray(encodings, dtype=np.float32)
+        single = probes.ndim == 1
+        probes = probes.reshape(-1, ENCODING_DIM)
+
+        # |a - b|^2 = |a|^2 + |b|^2 - 2ab, one matrix product for all rows
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        squared = probe_sq[:, None] + self._sq_norms[None, :] - 2.0 * (probes @ self.matrix.T)
+        np.maximum(squared, 0.0, out=squared)
+        distances = np.sqrt(squared)
+
+        return distances[0] if single else distances
+
+    def student_distances(self, encodings):
+        """
+        Minimum distance per student, aligned with `student_ids`.
+        Returns (S,) for one encoding or (M x S) for a batch.
+        """
+        distances = self.distances(encodings)
+        if not self.student_count:
+            return distances
+        return np.minimum.reduceat(distances, self._starts, axis=-1)
+
+    def _shortlist_student_distances(self, encoding, shortlist):
+        """
+        Per-student minimum distances for the `shortlist` students with the
+        nearest centroids; the others are inf.
+        """
+        probe = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        # |p|^2 is the same for every centroid, so it is left out of the ranking
+        centroid_sq = self._centroid_sq - 2.0 * (self.centroids @ probe)
+        candidates = np.argpartition(centroid_sq, shortlist - 1)[:shortlist]
+
+        counts = self._counts[candidates]
+        ends = np.cumsum(counts)
+        rows = np.repeat(self._starts[candidates] - ends + counts, counts) + np.arange(ends[-1])
+
+        squared = self._sq_norms[rows] - 2.0 * (self.matrix[rows] @ probe) + probe @ probe
+        distances = np.sqrt(np.maximum(squared, 0.0))
+
+        per_student = np.full(self.student_count, np.inf, dtype=np.float32)
+        per_student[candidates] = np.minimum.reduceat(distances, ends - counts)
+        return per_student
+
+    def match(self, encoding):
+        """
+        Find the closest student to a single encoding.
+
+        Returns:
+            dict: {
+                'student_id': id of the closest student or None,
+                'distance': float,
+                'runner_up_id': id of the second closest student or None,
+                'runner_up_distance': float (inf with a single student),
+                'margin': float (runner-up distance minus best distance),
+                'candidates': closest FACE_MATCH_TOP_K students as
+                              [{'student_id', 'distance'}], nearest first,
+                'student_distances': ndarray aligned with `student_ids`
+                                     (inf outside the centroid shortlist)
+            }
+        """
+        if not self.student_count:
+            return {
+                'student_id': None,
+                'distance': float('inf'),
+                'runner_up_id': None,
+                'runner_up_distance': float('inf'),
+                'margin': 0.0,
+                'candidates': [],
+                'student_distances': np.empty(0, dtype=np.float32),
+            }
+
+        shortlist = getattr(settings, 'FACE_CENTROID_SHORTLIST', 16)
+        if self.student_count >= getattr(settings, 'FACE_CENTROID_FILTER_MIN_STUDENTS', 256):
+            per_student = self._shortlist_student_distances(encoding, min(shortlist, self.student_count))
+        else:
+            per_student = self.student_distances(encoding)
+
+        if self.student_count > 1:
+            best_two = np.argpartition(per_student, 1)[:2]
+            if per_student[best_two[1]] < per_student[best_two[0]]:
+                best_two = best_two[::-1]
+            best, runner_up = best_two
+            runner_up_id = self.student_ids[runner_up]
+            runner_up_distance = float(per_student[runner_up])
+        else:
+            best = 0
+            runner_up_id = None
+            runner_up_distance = float('inf')
+
+        best_distance = float(per_student[best])
+
+        k = min(getattr(settings, 'FACE_MATCH_TOP_K', 3), self.student_count)
+        nearest = np.argpartition(per_student, k - 1)[:k]
+        nearest = nearest[np.argsort(per_student[nearest])]
+
+        return {
+            'student_id': self.student_ids[best],
+            'distance': best_distance,
+            'runner_up_id': runner_up_id,
+            'runner_up_distance': runner_up_distance,
+            'margin': runner_up_distance - best_distance,
+            'candidates': [
+                {'student_id': self.student_ids[i], 'distance': float(per_student[i])}
+                for i in nearest if np.isfinite(per_student[i])
+            ],
+            'student_distances': per_student,
+        }
+
+    def assign(self, encodings, tolerance):
+        """
+        Assign several faces to distinct students.
+
+        Solves the optimal one-to-one assignment over the face x student
+        distance matrix; pairs farther apart than `tolerance` are dropped.
+        Each face also gets the distance to its closest other student and
+        its nearest FACE_MATCH_TOP_K students, as in `match`.
+
+        Returns:
+            list of dicts: [{'face_index', 'student_id', 'distance',
+                             'runner_up_distance', 'margin', 'candidates'}, ...]
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        if not len(encodings) or not self.student_count:
+            return []
+
+        distances = self.student_distances(encodings)
+        # Out-of-tolerance pairs are allowed but priced so they are never preferred
+        cost = np.where(distances <= tolerance, distances, tolerance + 1000.0)
+        rows, cols = linear_sum_assignment(cost)
+
+        top_k = min(getattr(settings, 'FACE_MATCH_TOP_K', 3), self.student_count)
+        assignments = []
+        for row, col in zip(rows, cols):
+            if distances[row, col] > tolerance:
+                continue
+            others = np.delete(distances[row], col)
+            runner_up = float(others.min()) if len(others) else float('inf')
+            nearest = np.argsort(distances[row])[:top_k]
+            assignments.append({
+                'face_index': int(row),
+                'student_id': self.student_ids[col],
+                'distance': float(distances[row, col]),
+                'runner_up_distance': runner_up,
+                'margin': runner_up - float(distances[row, col]),
+                'candidates': [
+                    {'student_id': self.student_ids[i], 'distance': float(distances[row, i])}
+                    for i in nearest
+                ],
+            })
+        return assignments
+
+
+def merge_candidates(*candidate_lists):
+    """Merge match candidate lists, keeping the nearest FACE_MATCH_TOP_K students."""
+    merged = {}
+    for candidates in candidate_lists:
+        for candidate in candidates:
+            current = merged.get(candidate['student_id'])
+            if current is None or candidate['distance'] < current['distance']:
+                merged[candidate['student_id']] = candidate
+    top_k = getattr(settings, 'FACE_MATCH_TOP_K', 3)
+    return sorted(merged.values(), key=lambda candidate: candidate['distance'])[:top_k]
+
+
+def linear_sum_assignment(cost):
+    """
+    Minimum-cost one-to-one assignment (Hungarian algorithm, O(n^2 m)).
+
+    Works on rectangular matrices; every row of the smaller side is
+    assigned. Returns (row_indices, col_indices) sorted by row.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # 1-indexed potentials; p[j] is the row matched to column j (0 = free)
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.intp)
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            free = ~used[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.flatnonzero(p[1:])
+    rows = p[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+class GalleryCache:
+    """
+    Thread-safe LRU of prebuilt galleries (or face indexes).
+
+    Each entry is stamped with a generation counter kept in the Django cache,
+    so an invalidation in one worker process is seen by the others when a
+    shared cache backend (e.g. Redis) is configured. While the cache is
+    unreachable nothing is served from memory: every get() loads afresh.
+    """
+
+    def __init__(self, prefix, loader, max_size):
+        self.prefix = prefix
+        self.loader = loader
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _generation_key(self, key):
+        return f'{self.prefix}_gen:{key}'
+
+    def _generation(self, key):
+        """Current generation of `key`, or None when the cache is unreachable."""
+        try:
+            return cache.get(self._generation_key(key), 0)
+        except Exception as e:
+            logger.warning(f"Cannot read {self.prefix} generation: {str(e)}")
+            return None
+
+    def _bump_generation(self, key):
+        generation_key = self._generation_key(key)
+        try:
+            cache.add(generation_key, 0, timeout=None)
+            try:
+                return cache.incr(generation_key)
+            except ValueError:
+                cache.set(generation_key, 1, timeout=None)
+                return 1
+        except Exception as e:
+            logger.error(f"Cannot publish {self.prefix} invalidation for {key}: {str(e)}")
+            return None
+
+    def get(self, key):
+        """Return the gallery for `key`, building it on a miss."""
+        key = str(key)
+        generation = self._generation(key)
+        if generation is None:
+            return self.loader(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = self.loader(key)
+
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def is_cached(self, key):
+        """True if a current entry for `key` is loaded in this process."""
+        key = str(key)
+        generation = self._generation(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and generation is not None and entry[0] == generation
+
+    def apply(self, key, update):
+        """
+        Update a cached entry in place with `update(value)` and publish a new
+        generation, so other processes reload while this one keeps its copy.
+        """
+        key = str(key)
+        generation = self._bump_generation(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        if generation is None or entry[0] != generation - 1:
+            # Missed another change meanwhile; rebuild on next access
+            with self._lock:
+                self._entries.pop(key, None)
+            return
+
+        update(entry[1])
+
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._entries[key] = (generation, entry[1])
+
+    def invalidate(self, key):
+        """Drop the cached gallery for `key` in this and other processes."""
+        key = str(key)
+        with self._lock:
+            self._entries.pop(key, None)
+        self._bump_generation(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def gallery_from_queryset(queryset):
+    """
+    Build a gallery from a FaceEncoding queryset with one query.
+    Each binary encoding is read with a single np.frombuffer.
+    """
+    from apps.students.face_vectors import stored_encoding, unpack_encoding
+
+    rows = list(queryset.values_list(
+        'student_id', 'encoding_vector', 'encoding', 'student__face_centroid'
+    ))
+
+    matrix = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+    ids = np.empty(len(rows), dtype=object)
+    centroids = {}
+    for i, (student_id, vector_data, legacy_encoding, centroid) in enumerate(rows):
+        matrix[i] = stored_encoding(vector_data, legacy_encoding)
+        ids[i] = student_id
+        if centroid is not None and student_id not in centroids:
+            centroids[student_id] = unpack_encoding(centroid)
+
+    return FaceGallery(matrix, ids, centroids)
+
+
+def load_route_gallery(route_id):
+    """Build the gallery of active students on a route."""
+    from apps.students.models import FaceEncoding
+
+    gallery = gallery_from_queryset(FaceEncoding.objects.filter(
+        student__route_id=route_id,
+        student__is_active=True
+    ))
+    logger.debug(f"Built face gallery for route {route_id}: {len(gallery)} encodings")
+    return gallery
+
+
+route_galleries = GalleryCache(
+    'face_gallery_route',
+    load_route_gallery,
+    getattr(settings, 'FACE_GALLERY_CACHE_SIZE', 64)
+)
+
+
+def get_route_gallery(route_id):
+    """Return the cached gallery for a route."""
+    return route_galleries.get(route_id)
+
+
+def invalidate_route_gallery(route_id):
+    """Invalidate the cached gallery for a route (no-op for None)."""
+    if route_id is not None:
+        route_galleries.invalidate(route_id)
@@ -0,0 +1,133 @@
+"""
+Face verification of the adult collecting a student at drop-off.
+
+Each authorized pickup person's photo is encoded once and the encoding is
+stored on the AuthorizedPickup row in the background, when the photo is
+saved or when a gallery load finds it unencoded. A student's active pickups form a small
+FaceGallery keyed by pickup id, cached per student, so a handover is one
+face encoding plus one vectorized comparison. A match is only reported once
+the cached encoding is checked against the pickup's current row.
+"""
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .gallery import ENCODING_DIM, FaceGallery, GalleryCache
+
+logger = logging.getLogger(__name__)
+
+
+def encode_pickup_photo(pickup):
+    """Encode a pickup person's photo and store it. Returns the encoding or None."""
+    from apps.students.face_vectors import unpack_encoding
+    from apps.students.models import AuthorizedPickup
+    from .admission import FacePriority, face_request
+    from .face_recognition import generate_face_encoding
+
+    with pickup.photo.open('rb') as photo, face_request(FacePriority.ENROLL, pickup.student.school_id):
+        result = generate_face_encoding(photo)
+    if not result['success']:
+        logger.warning(f"Could not encode authorized pickup photo {pickup.pk}: {result['error']}")
+        return None
+
+    # update() skips signals, so storing the encoding does not queue another one
+    AuthorizedPickup.objects.filter(pk=pickup.pk).update(encoding_vector=result['encoding_bytes'])
+    pickup.encoding_vector = result['encoding_bytes']
+    return unpack_encoding(result['encoding_bytes'])
+
+
+def load_pickup_gallery(student_id):
+    """
+    Build the gallery of a student's active authorized pickups with photos.
+
+    Pickups not encoded yet (e.g. photo saved before encodings existed) are
+    left out and encoded in the background, which reloads the gallery.
+    """
+    from apps.students.face_vectors import unpack_encoding
+    from apps.students.models import AuthorizedPickup
+
+    pickups = AuthorizedPickup.objects.filter(
+        student_id=student_id,
+        is_active=True
+    ).exclude(photo='').exclude(photo__isnull=True)
+
+    encodings, ids = [], []
+    for pickup in pickups:
+        if pickup.encoding_vector is None:
+            encode_pickup_in_background(pickup.pk)
+            continue
+        encodings.append(unpack_encoding(pickup.encoding_vector))
+        ids.append(pickup.pk)
+
+    matrix = np.array(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    return FaceGallery(matrix, ids)
+
+
+pickup_galleries = GalleryCache(
+    'pickup_gallery',
+    load_pickup_gallery,
+    getattr(settings, 'FACE_PICKUP_CACHE_SIZE', 512)
+)
+
+
+def get_pickup_gallery(student_id):
+    """Return the cached gallery of a student's authorized pickups."""
+    return pickup_galleries.get(student_id)
+
+
+def matches_current_encoding(gallery, pickup):
+    """
+    True if `gallery` holds the pickup's current encoding. A gallery cached
+    before the pickup's photo was replaced still has the old person's face.
+    """
+    from apps.students.face_vectors import unpack_encoding
+
+    if pickup.encoding_vector is None:
+        return False
+    rows = gallery.matrix[gallery.ids == pickup.pk]
+    return bool(len(rows)) and np.array_equal(rows[0], unpack_encoding(pickup.encoding_vector))
+
+
+def invalidate_pickup_gallery(student_id):
+    if student_id is not None:
+        pickup_galleries.invalidate(student_id)
+
+
+_encoding = set()
+_encoding_lock = threading.Lock()
+
+
+def encode_pickup_in_background(pickup_id):
+    """
+    Encode a pickup photo without holding up the request. Returns the
+    thread, or None if this pickup is already being encoded.
+    """
+    with _encoding_lock:
+        if pickup_id in _encoding:
+            return None
+        _encoding.add(pickup_id)
+
+    def run():
+        from apps.students.models import AuthorizedPickup
+
+        close_old_connections()
+        try:
+            pickup = AuthorizedPickup.objects.filter(
+                pk=pickup_id,
+                encoding_vector__isnull=True
+            ).exclude(photo='').first()
+            if pickup is not None and pickup.photo and encode_pickup_photo(pickup) is not None:
+                invalidate_pickup_gallery(pickup.student_id)
+        except Exception as e:
+            logger.error(f"Encoding authorized pickup {pickup_id} failed: {str(e)}", exc_info=True)
+        finally:
+            with _encoding_lock:
+                _encoding.discard(pickup_id)
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name=f'pickup-encoding-{pickup_id}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,286 @@
+"""
+Image preprocessing for the face pipeline.
+
+A scan photo is decoded once (using JPEG draft mode so a 12 MP upload is
+decoded straight to a moderate resolution), EXIF-transposed, and kept at two
+sizes: a small copy for face detection and a moderate copy from which the
+detected face is cropped for encoding. Each stage is timed.
+
+The same decoded image is re-encoded into the stored scan photo and its
+thumbnail, so the raw upload is never decoded twice or saved verbatim.
+
+Clients may send a face box hint from their camera preview; detection then
+only runs on a small padded crop around it (see FaceImage.hint_region).
+"""
+import io
+import json
+import math
+import time
+
+import numpy as np
+from PIL import Image, ImageOps, features
+from django.conf import settings
+
+
+class FaceImage:
+    """
+    A decoded scan photo ready for detection and encoding.
+
+    Attributes:
+        image: RGB PIL image at encoding resolution (<= encode_max_edge)
+        detect_array: RGB uint8 array at detection resolution (<= detect_max_edge)
+        scale: factor mapping detection coordinates to `image` coordinates
+        timings: dict of stage name -> milliseconds
+    """
+
+    def __init__(self, image, detect_array, scale, timings):
+        self.image = image
+        self.detect_array = detect_array
+        self.scale = scale
+        self.timings = timings
+
+    def to_image_box(self, location, scale=None, offset=(0, 0)):
+        """
+        Map a (top, right, bottom, left) detection box to `image` coordinates.
+        Defaults to the detection copy; pass the scale and (left, top) offset
+        returned by hint_region for boxes found in a hint crop.
+        """
+        if scale is None:
+            scale = self.scale
+        top, right, bottom, left = location
+        offset_left, offset_top = offset
+        width, height = self.image.size
+        return (
+            max(0, int(round(top * scale)) + offset_top),
+            min(width, int(round(right * scale)) + offset_left),
+            min(height, int(round(bottom * scale)) + offset_top),
+            max(0, int(round(left * scale)) + offset_left),
+        )
+
+    def hint_region(self, face_box, padding=None, detect_edge=None):
+        """
+        Padded crop around a client face box, resized so its longest edge is
+        `detect_edge` for a quick detection pass.
+
+        Args:
+            face_box: (left, top, right, bottom) as fractions of the image size
+                      (see parse_face_box)
+
+        Returns:
+            tuple: (RGB uint8 array, scale mapping array coordinates to
+                    `image` coordinates, (left, top) of the crop in `image`)
+        """
+        if padding is None:
+            padding = getattr(settings, 'FACE_HINT_PADDING', 0.25)
+        if detect_edge is None:
+            detect_edge = getattr(settings, 'FACE_HINT_DETECT_EDGE', 240)
+
+        left, top, right, bottom = face_box
+        pad_x = (right - left) * padding
+        pad_y = (bottom - top) * padding
+        width, height = self.image.size
+        region = (
+            max(0, int((left - pad_x) * width)),
+            max(0, int((top - pad_y) * height)),
+            min(width, int(math.ceil((right + pad_x) * width))),
+            min(height, int(math.ceil((bottom + pad_y) * height))),
+        )
+
+        crop = self.image.crop(region)
+        # Small faces are scaled up too, so the detector sees them without upsampling
+        scale = max(crop.size) / detect_edge
+        size = (max(1, int(round(crop.size[0] / scale))), max(1, int(round(crop.size[1] / scale))))
+        crop = crop.resize(size, Image.BILINEAR)
+        return np.asarray(crop), scale, region[:2]
+
+    def crop_for_encoding(self, box, padding=None):
+        """
+        Crop a padded region around an image-space box.
+
+        Returns:
+            tuple: (RGB uint8 array of the crop, box relative to the crop)
+        """
+        if padding is None:
+            padding = getattr(settings, 'FACE_CROP_PADDING', 0.25)
+
+        top, right, bottom, left = box
+        pad_y = int((bottom - top) * padding)
+        pad_x = int((right - left) * padding)
+        width, height = self.image.size
+
+        crop_left = max(0, left - pad_x)
+        crop_top = max(0, top - pad_y)
+        crop_right = min(width, right + pad_x)
+        crop_bottom = min(height, bottom + pad_y)
+
+        crop = np.asarray(self.image.crop((crop_left, crop_top, crop_right, crop_bottom)))
+        relative_box = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+        return crop, relative_box
+
+
+def parse_face_box(value):
+    """
+    Validate a client face box hint.
+
+    Args:
+        value: [left, top, right, bottom] as fractions of the (EXIF-rotated)
+               image width and height, as a sequence or a JSON string.
+               Values slightly outside the image are clamped.
+
+    Returns:
+        tuple of four floats
+
+    Raises:
+        ValueError: if the box is malformed, empty or too small
+    """
+    try:
+        if isinstance(value, str):
+            value = json.loads(value)
+        left, top, right, bottom = (float(item) for item in value)
+    except (TypeError, ValueError):
+        raise ValueError('face_box must be four numbers: [left, top, right, bottom].')
+
+    if not all(math.isfinite(item) for item in (left, top, right, bottom)):
+        raise ValueError('face_box must be four numbers: [left, top, right, bottom].')
+
+    left, top = max(0.0, left), max(0.0, top)
+    right, bottom = min(1.0, right), min(1.0, bottom)
+    min_size = getattr(settings, 'FACE_HINT_MIN_SIZE', 0.05)
+    if right - left < min_size or bottom - top < min_size:
+        raise ValueError('face_box must cover part of the image, as fractions of its size.')
+
+    return (left, top, right, bottom)
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def load_face_image(image_file, detect_max_edge=None, encode_max_edge=None):
+    """
+    Decode an uploaded image once and prepare detection/encoding copies.
+
+    Args:
+        image_file: Django uploaded file object (or any binary file object)
+        detect_max_edge: longest edge for detection (default from settings)
+        encode_max_edge: longest edge kept for encoding (default from settings)
+
+    Returns:
+        FaceImage
+    """
+    if detect_max_edge is None:
+        detect_max_edge = getattr(settings, 'FACE_DETECTION_MAX_EDGE', 640)
+    if encode_max_edge is None:
+        encode_max_edge = getattr(settings, 'FACE_ENCODING_MAX_EDGE', 1280)
+
+    timings = {}
+
+    start = time.perf_counter()
+    image_file.seek(0)
+    image = Image.open(image_file)
+    # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+    image.draft('RGB', (encode_max_edge, encode_max_edge))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image_file.seek(0)
+    timings['decode_ms'] = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    if max(image.size) > encode_max_edge:
+        image.thumbnail((encode_max_edge, encode_max_edge), Image.BILINEAR)
+
+    scale = 1.0
+    detect_image = image
+    if max(image.size) > detect_max_edge:
+        detect_image = image.copy()
+        detect_image.thumbnail((detect_max_edge, detect_max_edge), Image.BILINEAR)
+        scale = image.size[0] / detect_image.size[0]
+    detect_array = np.asarray(detect_image)
+    timings['resize_ms'] = _elapsed_ms(start)
+
+    return FaceImage(image, detect_array, scale, timings)
+
+
+class StageTimer:
+    """Context manager recording a stage duration into a timings dict."""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings[self.name] = _elapsed_ms(self.start)
+        return False
+
+
+class ScanPhoto:
+    """Re-encoded scan photo and thumbnail bytes, small enough to pickle back from a worker."""
+
+    def __init__(self, photo, thumbnail, extension):
+        self.photo = photo
+        self.thumbnail = thumbnail
+        self.extension = extension
+
+    def files(self, name):
+        """Return (photo, thumbnail) ContentFiles named after the uploaded file."""
+        from django.core.files.base import ContentFile
+
+        stem = name.rsplit('/', 1)[-1].rsplit('.', 1)[0] or 'scan'
+        return (
+            ContentFile(self.photo, name=f'{stem}.{self.extension}'),
+            ContentFile(self.thumbnail, name=f'{stem}_thumb.{self.extension}'),
+        )
+
+
+def _encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_scan_photo(image):
+    """
+    Re-encode a decoded RGB image as the stored scan photo plus a thumbnail.
+
+    Sizes, format and quality come from FACE_SCAN_PHOTO_* settings; WebP
+    falls back to JPEG when Pillow was built without it.
+
+    Returns:
+        ScanPhoto
+    """
+    max_edge = getattr(settings, 'FACE_SCAN_PHOTO_MAX_EDGE', 800)
+    thumbnail_edge = getattr(settings, 'FACE_SCAN_THUMBNAIL_EDGE', 160)
+    quality = getattr(settings, 'FACE_SCAN_PHOTO_QUALITY', 80)
+    image_format = getattr(settings, 'FACE_SCAN_PHOTO_FORMAT', 'WEBP').upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        image_format = 'JPEG'
+
+    photo = image
+    if max(photo.size) > max_edge:
+        photo = photo.copy()
+        photo.thumbnail((max_edge, max_edge), Image.BILINEAR)
+
+    thumbnail = photo.copy()
+    thumbnail.thumbnail((thumbnail_edge, thumbnail_edge), Image.BILINEAR)
+
+    extension = 'webp' if image_format == 'WEBP' else 'jpg'
+    return ScanPhoto(
+        _encode(photo, image_format, quality),
+        _encode(thumbnail, image_format, quality),
+        extension,
+    )
+
+
+def scan_photo_from_file(image_file):
+    """Decode a small upload (e.g. a face crop from the device) and re-encode it as a scan photo."""
+    image_file.seek(0)
+    image = ImageOps.exif_transpose(Image.open(image_file))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image_file.seek(0)
+    return encode_scan_photo(image)
@@ -0,0 +1,91 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.attendance.benchmark import compare_reports, run_benchmark
+
+
+def image_size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f'Invalid image size "{value}", expected WIDTHxHEIGHT')
+    return width, height
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks decode, detect, encode and match stages of the face pipeline on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=500, help='Students in the synthetic gallery')
+        parser.add_argument('--per-student', type=int, default=3, help='Encodings stored per student')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed calls per stage')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed calls before each stage')
+        parser.add_argument(
+            '--image-size', type=image_size, action='append', dest='image_sizes',
+            help='Synthetic camera image size as WIDTHxHEIGHT (repeatable, default 1920x1080)'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+        parser.add_argument(
+            '--max-regression', type=float, default=0.2,
+            help='Fail if a stage p95 is slower than the baseline by more than this fraction'
+        )
+
+    def handle(self, *args, **options):
+        report = run_benchmark(
+            students=options['students'],
+            per_student=options['per_student'],
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            image_sizes=options['image_sizes'] or [(1920, 1080)],
+            seed=options['seed'],
+        )
+
+        comparison = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            comparison = compare_reports(baseline, report, max_regression=options['max_regression'])
+            report['comparison'] = comparison
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self._print_report(report)
+
+        if comparison:
+            regressed = [row['stage'] for row in comparison if row['regressed']]
+            if regressed:
+                raise CommandError(f'p95 regression in: {", ".join(regressed)}')
+
+    def _print_report(self, report):
+        config = report['config']
+        self.stdout.write(
+            f"{config['students']} students x {config['encodings_per_student']} encodings, "
+            f"{config['iterations']} iterations, images {config['image_sizes']}"
+        )
+        self.stdout.write(f"{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>12}")
+        for stage, stats in report['stages'].items():
+            if 'skipped' in stats:
+                self.stdout.write(f"{stage:<16}skipped: {stats['skipped']}")
+                continue
+            line = (
+                f"{stage:<16}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+                f"{stats['p99_ms']:>10.3f}{stats['throughput_per_s'] or 0:>12.1f}"
+            )
+            if 'accuracy' in stats:
+                line += f"  accuracy {stats['accuracy']:.3f}"
+            self.stdout.write(line)
+
+        for row in report.get('comparison') or []:
+            style = self.style.ERROR if row['regressed'] else self.style.SUCCESS
+            self.stdout.write(style(
+                f"{row['stage']:<16}p95 {row['baseline']:.3f} -> {row['current']:.3f} ms ({row['change']:+.1%})"
+            ))
@@ -0,0 +1,69 @@
+"""
+In-process latency metrics for face scans.
+
+Scans are labelled 'cold' when the route gallery or trip roster had to be
+loaded during the request and 'warm' otherwise, so the effect of trip
+warm-up (see warmup) can be read off directly. Samples are kept per worker
+process in a bounded window.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+
+
+def summarize(samples_ms):
+    """Latency percentiles and throughput for a list of per-call milliseconds."""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    mean = float(samples.mean())
+    return {
+        'count': int(len(samples)),
+        'mean_ms': round(mean, 4),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+        'max_ms': round(float(samples.max()), 4),
+        'throughput_per_s': round(1000.0 / mean, 2) if mean > 0 else None,
+    }
+
+
+class LatencyRecorder:
+    """Bounded window of latency samples per label."""
+
+    def __init__(self, max_samples):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, label, elapsed_ms):
+        with self._lock:
+            if label not in self._samples:
+                self._samples[label] = deque(maxlen=self.max_samples)
+                self._totals[label] = 0
+            self._samples[label].append(elapsed_ms)
+            self._totals[label] += 1
+
+    def snapshot(self):
+        """Return {label: summary of the recent window plus 'total' scans}."""
+        with self._lock:
+            samples = {label: list(values) for label, values in self._samples.items()}
+            totals = dict(self._totals)
+        report = {}
+        for label, values in samples.items():
+            report[label] = summarize(values)
+            report[label]['total'] = totals[label]
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+
+scan_latency = LatencyRecorder(getattr(settings, 'FACE_SCAN_LATENCY_SAMPLES', 500))
+
+
+def record_scan_latency(cold, elapsed_ms):
+    scan_latency.record('cold' if cold else 'warm', elapsed_ms)
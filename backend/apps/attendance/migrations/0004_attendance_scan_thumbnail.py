@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0003_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='scan_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='attendance/scans/thumbnails/'),
+        ),
+    ]
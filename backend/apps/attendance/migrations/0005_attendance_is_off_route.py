@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_attendance_scan_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='is_off_route',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_attendance_is_off_route'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='scan_nonce',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+    ]
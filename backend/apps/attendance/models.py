@@ -50,7 +50,18 @@ class Attendance(BaseModel):
         upload_to='attendance/scans/',
         null=True,
         blank=True
-    )  # Photo taken during scan
+    )  # Photo taken during scan, re-encoded and size-capped
+    scan_thumbnail = models.ImageField(
+        upload_to='attendance/scans/thumbnails/',
+        null=True,
+        blank=True
+    )
+    
+    # Matched school-wide after missing the trip's route (boarded another bus)
+    is_off_route = models.BooleanField(default=False)
+    
+    # Nonce of the confirmed ambiguous scan; one photo records one student
+    scan_nonce = models.CharField(max_length=32, null=True, blank=True, unique=True, editable=False)
     
     # Manual override
     is_manual = models.BooleanField(default=False)  # True if manually marked
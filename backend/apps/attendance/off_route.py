@@ -0,0 +1,84 @@
+"""
+Off-route fallback for face scans.
+
+A scan only searches its trip's route gallery, so a child who boards a
+different bus is not recognized there. On such a miss the scan's encoding
+is searched once more in the school-wide face index (see face_index), with
+a stricter threshold and margin than the on-route match, and the record is
+flagged as off-route.
+
+The on-route path is untouched: the fallback only runs after a miss. The
+search runs on a small thread pool and is abandoned after
+FACE_OFF_ROUTE_BUDGET_MS; an abandoned search still finishes loading the
+school index, so the next miss finds it cached. Trip warm-up (see warmup)
+also preloads the school index.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'FACE_OFF_ROUTE_WORKERS', 2),
+                thread_name_prefix='face-off-route'
+            )
+        return _executor
+
+
+def _search(school_id, encoding, tolerance):
+    from .face_index import get_school_indexes
+    from .face_recognition import match_encoding
+
+    try:
+        return match_encoding(encoding, get_school_indexes([school_id]), tolerance)
+    finally:
+        close_old_connections()
+
+
+def match_off_route(encoding, school_id):
+    """
+    Search a school's whole face index for a scan that missed its route.
+
+    Args:
+        encoding: 128-dimensional face encoding of the scan
+        school_id: School of the trip
+
+    Returns:
+        dict: match_encoding result for a confident, unambiguous match, or
+        None when nothing passes the strict threshold within the time budget
+    """
+    if encoding is None or school_id is None or not getattr(settings, 'FACE_OFF_ROUTE_FALLBACK', True):
+        return None
+
+    tolerance = getattr(settings, 'FACE_OFF_ROUTE_TOLERANCE', 0.25)
+    min_margin = getattr(settings, 'FACE_OFF_ROUTE_MIN_MARGIN', 0.1)
+    budget_ms = getattr(settings, 'FACE_OFF_ROUTE_BUDGET_MS', 150)
+
+    future = _get_executor().submit(_search, school_id, encoding, tolerance)
+    try:
+        result = future.result(timeout=budget_ms / 1000)
+    except FutureTimeoutError:
+        # Drops the search if it has not started; a running one still warms the index
+        future.cancel()
+        logger.warning(f"Off-route face search for school {school_id} exceeded {budget_ms} ms")
+        return None
+    except Exception as e:
+        logger.error(f"Off-route face search for school {school_id} failed: {str(e)}", exc_info=True)
+        return None
+
+    if not result['success'] or result['ambiguous'] or result['margin'] < min_margin:
+        return None
+    return result
@@ -1,10 +1,192 @@
 """
 Serializers for attendance app.
 """
-from rest_framework import serializers
+import json
+import logging
+import random
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core import signing
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
 from .models import Attendance, EventType
+from .gallery import ENCODING_DIM
 from apps.students.serializers import StudentListSerializer
 
+logger = logging.getLogger(__name__)
+
+
+class PhotoRequired(APIException):
+    """An embedding-only scan needs the full photo before it can be accepted."""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A full photo is required to confirm this scan.'
+    default_code = 'photo_required'
+
+
+class AmbiguousMatch(Exception):
+    """A scan matched look-alike students; `data` lists them with a scan_id to confirm."""
+    
+    def __init__(self, data):
+        super().__init__(data['error'])
+        self.data = data
+
+
+PENDING_SCAN_SALT = 'attendance.pending_face_scan'
+
+
+def _create_attendance(trip, student, event_type, duplicate_error, **fields):
+    """
+    Record one attendance event and update the trip counters.
+    
+    The trip row is locked while the database is checked for an existing
+    record, so duplicates are refused across worker processes; cached trip
+    rosters are only a hint. Raises ValidationError(duplicate_error) for a
+    student already recorded for this event, and for a `scan_nonce` that
+    was already used.
+    """
+    from django.db import transaction
+    from apps.transport.models import Trip
+    
+    with transaction.atomic():
+        locked_trip = Trip.objects.select_for_update().get(pk=trip.pk)
+        
+        scan_nonce = fields.get('scan_nonce')
+        if scan_nonce and Attendance.objects.filter(scan_nonce=scan_nonce).exists():
+            raise serializers.ValidationError({"scan_id": "This scan was already confirmed."})
+        
+        if Attendance.objects.filter(student=student, trip=trip, event_type=event_type).exists():
+            raise serializers.ValidationError(duplicate_error)
+        
+        attendance = Attendance.objects.create(
+            student=student,
+            trip=trip,
+            event_type=event_type,
+            **fields
+        )
+        
+        # Update trip counters
+        if event_type == EventType.CHECKIN:
+            locked_trip.students_boarded += 1
+        else:
+            locked_trip.students_dropped += 1
+        locked_trip.save(update_fields=['students_boarded', 'students_dropped'])
+    
+    trip.students_boarded = locked_trip.students_boarded
+    trip.students_dropped = locked_trip.students_dropped
+    return attendance
+
+
+def _save_scan_photo(scan_photo, source_name):
+    """Store a ScanPhoto and its thumbnail; returns their storage names."""
+    from django.core.files.storage import default_storage
+    
+    photo_file, thumbnail_file = scan_photo.files(source_name)
+    photo_name = default_storage.save(
+        Attendance._meta.get_field('scan_photo').generate_filename(None, photo_file.name),
+        photo_file
+    )
+    thumbnail_name = default_storage.save(
+        Attendance._meta.get_field('scan_thumbnail').generate_filename(None, thumbnail_file.name),
+        thumbnail_file
+    )
+    return photo_name, thumbnail_name
+
+
+def _pending_scan(request, trip, event_type, data, candidates, scan_photo, scan_thumbnail, is_recorded):
+    """
+    Sign a scan that needs a candidate confirmed (see ConfirmFaceScanSerializer).
+    
+    Only candidates within tolerance are offered. Returns the scan_id, its
+    lifetime and the candidate students for the client to choose from.
+    """
+    from apps.students.models import Student
+    
+    tolerance = getattr(settings, 'FACE_RECOGNITION_TOLERANCE', 0.6)
+    candidates = [c for c in candidates if c['distance'] <= tolerance]
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    scan_id = signing.dumps({
+        'nonce': uuid.uuid4().hex,
+        'trip_id': str(trip.id),
+        'event_type': event_type,
+        'conductor_id': str(request.user.id),
+        'latitude': str(latitude) if latitude is not None else None,
+        'longitude': str(longitude) if longitude is not None else None,
+        'candidates': {str(c['student_id']): c['distance'] for c in candidates},
+        'scan_photo': scan_photo,
+        'scan_thumbnail': scan_thumbnail,
+    }, salt=PENDING_SCAN_SALT, compress=True)
+    
+    students = Student.objects.in_bulk([c['student_id'] for c in candidates])
+    choices = []
+    for candidate in candidates:
+        student = students.get(candidate['student_id'])
+        if student is None:
+            continue
+        choices.append({
+            'id': str(student.id),
+            'full_name': student.full_name,
+            'admission_number': student.admission_number,
+            'photo': request.build_absolute_uri(student.photo.url) if student.photo else None,
+            'confidence': candidate['confidence'],
+            'already_recorded': is_recorded(student.id),
+        })
+    
+    return {
+        'scan_id': scan_id,
+        'expires_in': getattr(settings, 'FACE_PENDING_SCAN_TTL', 120),
+        'candidates': choices,
+    }
+
+
+class FaceEncodingField(serializers.Field):
+    """
+    A 128-d face encoding: a list of numbers, or in multipart forms a JSON
+    array or comma separated string.
+    """
+    default_error_messages = {
+        'invalid': f'Expected {ENCODING_DIM} finite numbers.',
+    }
+    
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = data.strip()
+            try:
+                data = json.loads(data) if data.startswith('[') else data.split(',')
+            except ValueError:
+                self.fail('invalid')
+        try:
+            vector = np.asarray(data, dtype=np.float32)
+        except (TypeError, ValueError):
+            self.fail('invalid')
+        if vector.shape != (ENCODING_DIM,) or not np.isfinite(vector).all():
+            self.fail('invalid')
+        return vector
+    
+    def to_representation(self, value):
+        return [float(x) for x in value]
+
+
+class FaceBoxField(serializers.Field):
+    """
+    Face box hint from the device camera: [left, top, right, bottom] as
+    fractions of the photo size, as a list or in multipart forms a JSON array.
+    """
+    
+    def to_internal_value(self, data):
+        from .imaging import parse_face_box
+        
+        try:
+            return parse_face_box(data)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+    
+    def to_representation(self, value):
+        return list(value)
+
 
 class AttendanceSerializer(serializers.ModelSerializer):
     """Serializer for Attendance model."""
@@ -18,99 +200,283 @@ class AttendanceSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'student', 'student_name', 'trip', 'trip_type', 'conductor', 'conductor_name',
             'event_type', 'timestamp', 'latitude', 'longitude', 'location',
-            'confidence_score', 'scan_photo', 'is_manual', 'notes'
+            'confidence_score', 'scan_photo', 'scan_thumbnail', 'is_off_route', 'is_manual', 'notes'
         ]
-        read_only_fields = ['id', 'timestamp']
+        read_only_fields = ['id', 'timestamp', 'is_off_route']
 
 
 class FaceScanSerializer(serializers.Serializer):
-    """Serializer for face scan attendance."""
+    """
+    Serializer for face scan attendance.
+    
+    Either `photo` (matched on the server) or `encoding` (computed on the
+    device, optionally with a small `face_crop` to keep as the scan photo).
+    With a photo, an optional `face_box` hint lets the server skip
+    full-frame face detection.
+    Embedding-only scans are refused with 409 photo_required when the match
+    is missing or ambiguous, or when sampled for server-side verification;
+    the client then resends with the photo.
+    A photo that matches nobody on the route is searched school-wide with a
+    stricter threshold (see off_route) and recorded with `is_off_route`.
+    """
     trip_id = serializers.UUIDField()
     event_type = serializers.ChoiceField(choices=EventType.choices)
-    photo = serializers.ImageField()
+    photo = serializers.ImageField(required=False)
+    encoding = FaceEncodingField(required=False)
+    face_crop = serializers.ImageField(required=False)
+    face_box = FaceBoxField(required=False)
     latitude = serializers.DecimalField(max_digits=20, decimal_places=15, required=False)
     longitude = serializers.DecimalField(max_digits=20, decimal_places=15, required=False)
     
+    def validate(self, attrs):
+        if 'photo' not in attrs and 'encoding' not in attrs:
+            raise serializers.ValidationError({"photo": "A photo or a face encoding is required."})
+        return attrs
+    
+    def _match_encoding(self, encoding, gallery, face_crop):
+        """Match a device-computed encoding, or raise PhotoRequired."""
+        from .face_recognition import match_encoding
+        from .imaging import scan_photo_from_file
+        
+        sample_rate = getattr(settings, 'FACE_CLIENT_EMBEDDING_SAMPLE_RATE', 0.05)
+        min_margin = getattr(settings, 'FACE_CLIENT_EMBEDDING_MIN_MARGIN', 0.08)
+        
+        result = match_encoding(encoding, gallery)
+        
+        reason = None
+        if not result['success']:
+            reason = 'no_match'
+        elif result['ambiguous']:
+            # Look-alikes are resolved by confirming a candidate, not by the photo
+            pass
+        elif result['margin'] < min_margin:
+            reason = 'low_margin'
+        elif random.random() < sample_rate:
+            reason = 'sampled'
+        
+        if reason:
+            raise PhotoRequired({
+                'error': 'Please resend this scan with the full photo.',
+                'code': 'photo_required',
+                'reason': reason,
+            })
+        
+        result['scan_photo'] = scan_photo_from_file(face_crop) if face_crop else None
+        result['encoding'] = encoding
+        return result
+    
+    def _ambiguous_match(self, trip, event_type, result, roster, source_name):
+        """
+        Park an ambiguous scan: store its photo now and hand the client a
+        signed scan_id listing the candidates, so confirming one of them
+        does not need another upload.
+        """
+        scan_photo = scan_thumbnail = None
+        if result['scan_photo'] is not None:
+            scan_photo, scan_thumbnail = _save_scan_photo(result['scan_photo'], source_name)
+        
+        pending = _pending_scan(
+            self.context['request'],
+            trip,
+            event_type,
+            self.validated_data,
+            result['candidates'],
+            scan_photo,
+            scan_thumbnail,
+            lambda student_id: roster.is_recorded(student_id, event_type),
+        )
+        return AmbiguousMatch({
+            'error': 'Several students look alike. Please confirm who this is.',
+            'code': 'ambiguous_match',
+            **pending,
+        })
+    
     def create(self, validated_data):
         """Process face scan and record attendance."""
         from apps.transport.models import Trip, TripStatus
-        from apps.students.models import Student, FaceEncoding
-        from .face_recognition import match_face
+        from apps.students.models import Student
+        from .admission import FacePriority, face_request
+        from .face_recognition import match_encoding, match_face
+        from .gallery import get_route_gallery, route_galleries
+        from .metrics import record_scan_latency
+        from .off_route import match_off_route
+        from .trip_roster import get_trip_roster, refresh_trip_roster, trip_rosters
         from apps.notifications.services import send_attendance_notification
         
+        start = time.perf_counter()
         trip_id = validated_data['trip_id']
         event_type = validated_data['event_type']
-        photo = validated_data['photo']
+        photo = validated_data.get('photo')
+        encoding = validated_data.get('encoding')
         latitude = validated_data.get('latitude')
         longitude = validated_data.get('longitude')
         conductor = self.context['request'].user
         
         # Get trip
         try:
-            trip = Trip.objects.get(id=trip_id, status=TripStatus.IN_PROGRESS)
+            trip = Trip.objects.select_related('route').get(id=trip_id, status=TripStatus.IN_PROGRESS)
         except Trip.DoesNotExist:
             raise serializers.ValidationError({"trip_id": "Active trip not found."})
         
-        # Get students on this route with face encodings
-        students = Student.objects.filter(
-            route=trip.route,
-            is_active=True
-        ).prefetch_related('face_encodings')
-        
-        # Prepare encodings for matching
-        student_encodings = []
-        for student in students:
-            for face in student.face_encodings.all():
-                student_encodings.append({
-                    'student_id': student.id,
-                    'encoding': face.encoding
-                })
-        
-        if not student_encodings:
+        # Cold if this scan has to load the gallery or roster (trip not warmed here)
+        cold = not route_galleries.is_cached(trip.route_id) or not trip_rosters.is_cached(trip.id)
+        
+        # Cached gallery of active students on this route with face encodings,
+        # narrowed to students who can still check in (or out) on this trip
+        roster = get_trip_roster(trip.id)
+        gallery = roster.gallery_for(event_type, get_route_gallery(trip.route_id))
+        
+        if not len(gallery) and event_type == EventType.CHECKOUT:
+            # Nobody on the bus here; the roster may lag check-ins on other workers
+            roster = refresh_trip_roster(trip.id, roster)
+            gallery = roster.gallery_for(event_type, get_route_gallery(trip.route_id))
+        
+        if not len(gallery):
             raise serializers.ValidationError({
                 "photo": "No students with face encodings on this route."
             })
         
-        # Match face
-        result = match_face(photo, student_encodings)
+        if photo is None:
+            result = self._match_encoding(encoding, gallery, validated_data.get('face_crop'))
+        else:
+            # Match face; the stored scan photo is re-encoded from the same decode
+            with face_request(FacePriority.SCAN, trip.route.school_id):
+                result = match_face(photo, gallery, scan_photo=True, face_box=validated_data.get('face_box'))
+            
+            if encoding is not None and result['success']:
+                # Sampled scan: check the device model still agrees with the server
+                client = match_encoding(encoding, gallery)
+                if client['student_id'] != result['student_id']:
+                    logger.warning(
+                        f"Client face encoding disagrees with server on trip {trip.id}: "
+                        f"client={client['student_id']} server={result['student_id']}"
+                    )
+        
+        if not result['success'] and event_type == EventType.CHECKOUT and result['encoding'] is not None:
+            # Check-in candidates may be missing from a roster that lags other workers
+            fresh_roster = refresh_trip_roster(trip.id, roster)
+            if fresh_roster is not roster:
+                roster = fresh_roster
+                gallery = roster.gallery_for(event_type, get_route_gallery(trip.route_id))
+                result = dict(
+                    match_encoding(result['encoding'], gallery),
+                    encoding=result['encoding'],
+                    scan_photo=result['scan_photo']
+                )
+        
+        off_route = False
+        if not result['success'] and result['encoding'] is not None:
+            # Missed the route: strict school-wide search for a child on the wrong bus
+            fallback = match_off_route(result['encoding'], trip.route.school_id)
+            if fallback is not None and (
+                event_type == EventType.CHECKIN or roster.is_on_bus(fallback['student_id'])
+            ):
+                result = dict(fallback, scan_photo=result['scan_photo'])
+                off_route = True
         
         if not result['success']:
             raise serializers.ValidationError({
                 "photo": result['error'] or "Face not recognized."
             })
         
+        if result['ambiguous']:
+            source = photo or validated_data.get('face_crop')
+            raise self._ambiguous_match(trip, event_type, result, roster, source.name if source else 'scan')
+        
         student = Student.objects.get(id=result['student_id'])
         
-        # Check for duplicate scan
-        existing = Attendance.objects.filter(
-            student=student,
-            trip=trip,
-            event_type=event_type
-        ).exists()
+        off_route = off_route and student.route_id != trip.route_id
+        if off_route:
+            logger.warning(
+                f"Off-route {event_type} on trip {trip.id}: student {student.id} "
+                f"is assigned to route {student.route_id}"
+            )
         
-        if existing:
-            raise serializers.ValidationError({
-                "photo": f"Student {student.full_name} already {event_type}."
-            })
+        scan_photo = scan_thumbnail = None
+        if result['scan_photo'] is not None:
+            source = photo or validated_data.get('face_crop')
+            scan_photo, scan_thumbnail = result['scan_photo'].files(source.name)
         
-        # Create attendance record
-        attendance = Attendance.objects.create(
-            student=student,
-            trip=trip,
+        # Create attendance record, refusing a duplicate scan
+        attendance = _create_attendance(
+            trip,
+            student,
+            event_type,
+            {"photo": f"Student {student.full_name} already {event_type}."},
             conductor=conductor,
-            event_type=event_type,
             latitude=latitude,
             longitude=longitude,
             confidence_score=result['confidence'],
-            scan_photo=photo,
+            scan_photo=scan_photo,
+            scan_thumbnail=scan_thumbnail,
+            is_off_route=off_route,
         )
         
-        # Update trip counters
-        if event_type == EventType.CHECKIN:
-            trip.students_boarded += 1
-        else:
-            trip.students_dropped += 1
-        trip.save(update_fields=['students_boarded', 'students_dropped'])
+        # Send notification to parents
+        send_attendance_notification(attendance)
+        
+        record_scan_latency(cold, (time.perf_counter() - start) * 1000)
+        return attendance
+
+
+class ConfirmFaceScanSerializer(serializers.Serializer):
+    """Confirm one candidate of an ambiguous face scan without rescanning."""
+    scan_id = serializers.CharField()
+    student_id = serializers.UUIDField()
+    
+    def validate_scan_id(self, value):
+        try:
+            return signing.loads(
+                value,
+                salt=PENDING_SCAN_SALT,
+                max_age=getattr(settings, 'FACE_PENDING_SCAN_TTL', 120)
+            )
+        except signing.SignatureExpired:
+            raise serializers.ValidationError("This scan has expired. Please scan again.")
+        except signing.BadSignature:
+            raise serializers.ValidationError("Invalid scan.")
+    
+    def create(self, validated_data):
+        """Record attendance for the confirmed candidate."""
+        from apps.transport.models import Trip, TripStatus
+        from apps.students.models import Student
+        from apps.notifications.services import send_attendance_notification
+        
+        pending = validated_data['scan_id']
+        student_id = validated_data['student_id']
+        event_type = pending['event_type']
+        conductor = self.context['request'].user
+        
+        if pending['conductor_id'] != str(conductor.id):
+            raise serializers.ValidationError({"scan_id": "This scan was made by another user."})
+        
+        distance = pending['candidates'].get(str(student_id))
+        if distance is None:
+            raise serializers.ValidationError({"student_id": "Student is not a candidate for this scan."})
+        
+        try:
+            trip = Trip.objects.get(id=pending['trip_id'], status=TripStatus.IN_PROGRESS)
+            student = Student.objects.get(id=student_id)
+        except Trip.DoesNotExist:
+            raise serializers.ValidationError({"scan_id": "Active trip not found."})
+        except Student.DoesNotExist:
+            raise serializers.ValidationError({"student_id": "Student not found."})
+        
+        # Create attendance record, refusing a duplicate; the nonce is stored
+        # with it so one photo records one student
+        attendance = _create_attendance(
+            trip,
+            student,
+            event_type,
+            {"student_id": f"Student {student.full_name} already {event_type}."},
+            conductor=conductor,
+            latitude=pending['latitude'],
+            longitude=pending['longitude'],
+            confidence_score=1 - distance,
+            scan_photo=pending['scan_photo'],
+            scan_thumbnail=pending['scan_thumbnail'],
+            scan_nonce=pending['nonce'],
+        )
         
         # Send notification to parents
         send_attendance_notification(attendance)
@@ -118,6 +484,155 @@ class FaceScanSerializer(serializers.Serializer):
         return attendance
 
 
+class PickupHandoverSerializer(serializers.Serializer):
+    """Photo of the adult collecting a student, checked against their authorized pickups."""
+    student_id = serializers.UUIDField()
+    photo = serializers.ImageField()
+    face_box = FaceBoxField(required=False)
+
+
+class GroupFaceScanSerializer(serializers.Serializer):
+    """Serializer for checking in/out several students from one group photo."""
+    trip_id = serializers.UUIDField()
+    event_type = serializers.ChoiceField(choices=EventType.choices)
+    photo = serializers.ImageField()
+    latitude = serializers.DecimalField(max_digits=20, decimal_places=15, required=False)
+    longitude = serializers.DecimalField(max_digits=20, decimal_places=15, required=False)
+    
+    def create(self, validated_data):
+        """
+        Match every face in the photo and record attendance in one transaction.
+        
+        Faces matched to look-alike students are not recorded; each is
+        returned as a pending scan to confirm, like an ambiguous single scan.
+        """
+        from django.db import transaction
+        from apps.transport.models import Trip, TripStatus
+        from apps.students.models import Student
+        from .admission import FacePriority, face_request
+        from .face_recognition import match_faces
+        from .gallery import get_route_gallery
+        from .trip_roster import record_attendance
+        from apps.notifications.services import send_attendance_notification
+        
+        trip_id = validated_data['trip_id']
+        event_type = validated_data['event_type']
+        photo = validated_data['photo']
+        latitude = validated_data.get('latitude')
+        longitude = validated_data.get('longitude')
+        conductor = self.context['request'].user
+        
+        # Get trip
+        try:
+            trip = Trip.objects.select_related('route').get(id=trip_id, status=TripStatus.IN_PROGRESS)
+        except Trip.DoesNotExist:
+            raise serializers.ValidationError({"trip_id": "Active trip not found."})
+        
+        gallery = get_route_gallery(trip.route_id)
+        
+        if not len(gallery):
+            raise serializers.ValidationError({
+                "photo": "No students with face encodings on this route."
+            })
+        
+        # Detect all faces and assign each to a distinct student
+        with face_request(FacePriority.SCAN, trip.route.school_id):
+            result = match_faces(photo, gallery, scan_photo=True)
+        
+        if not result['success']:
+            raise serializers.ValidationError({
+                "photo": result['error'] or "No faces recognized."
+            })
+        
+        matches = {match['student_id']: match for match in result['matches']}
+        students = Student.objects.in_bulk(list(matches))
+        matches = {student_id: match for student_id, match in matches.items() if student_id in students}
+        
+        if not matches:
+            raise serializers.ValidationError({
+                "photo": "No students recognized."
+            })
+        
+        ambiguous = [match for match in matches.values() if match['ambiguous']]
+        matches = {student_id: match for student_id, match in matches.items() if not match['ambiguous']}
+        
+        with transaction.atomic():
+            # Lock the trip so the duplicate check holds across worker processes
+            locked_trip = Trip.objects.select_for_update().get(pk=trip.pk)
+            
+            # Skip students already recorded for this event on this trip
+            candidate_ids = {c['student_id'] for match in ambiguous for c in match['candidates']}
+            recorded = set(Attendance.objects.filter(
+                trip=trip,
+                event_type=event_type,
+                student_id__in=list(candidate_ids.union(matches))
+            ).values_list('student_id', flat=True))
+            already_recorded = recorded.intersection(matches)
+            new_matches = {
+                student_id: match for student_id, match in matches.items()
+                if student_id not in recorded
+            }
+            
+            # Store the group photo once and share it across the records
+            scan_photo = scan_thumbnail = None
+            if new_matches or ambiguous:
+                scan_photo, scan_thumbnail = _save_scan_photo(result['scan_photo'], photo.name)
+            
+            records = [
+                Attendance(
+                    student=students[student_id],
+                    trip=trip,
+                    conductor=conductor,
+                    event_type=event_type,
+                    latitude=latitude,
+                    longitude=longitude,
+                    confidence_score=match['confidence'],
+                    scan_photo=scan_photo,
+                    scan_thumbnail=scan_thumbnail,
+                )
+                for student_id, match in new_matches.items()
+            ]
+            attendances = Attendance.objects.bulk_create(records)
+            
+            # Update trip counters once for the whole group
+            if event_type == EventType.CHECKIN:
+                locked_trip.students_boarded += len(attendances)
+            else:
+                locked_trip.students_dropped += len(attendances)
+            locked_trip.save(update_fields=['students_boarded', 'students_dropped'])
+        
+        recorded_ids = [attendance.student_id for attendance in attendances]
+        transaction.on_commit(lambda: record_attendance(trip.id, recorded_ids, event_type))
+        
+        # One pending scan per look-alike face, sharing the stored photo
+        recorded.update(recorded_ids)
+        pending = [
+            _pending_scan(
+                self.context['request'],
+                trip,
+                event_type,
+                validated_data,
+                match['candidates'],
+                scan_photo,
+                scan_thumbnail,
+                recorded.__contains__,
+            )
+            for match in ambiguous
+        ]
+        
+        # Send notifications to parents
+        for attendance in attendances:
+            send_attendance_notification(attendance)
+        
+        return {
+            'attendances': attendances,
+            'already_recorded': [students[pk] for pk in already_recorded],
+            'pending': pending,
+            'face_count': result['face_count'],
+            'unmatched_count': result['unmatched_count'],
+        }
+
+
 class ManualAttendanceSerializer(serializers.Serializer):
     """Serializer for manual attendance marking."""
     trip_id = serializers.UUIDField()
@@ -150,24 +665,13 @@ class ManualAttendanceSerializer(serializers.Serializer):
         except Student.DoesNotExist:
             raise serializers.ValidationError({"student_id": "Student not found."})
         
-        # Check for duplicate
-        existing = Attendance.objects.filter(
-            student=student,
-            trip=trip,
-            event_type=event_type
-        ).exists()
-        
-        if existing:
-            raise serializers.ValidationError({
-                "student_id": f"Student already {event_type}."
-            })
-        
-        # Create attendance record
-        attendance = Attendance.objects.create(
-            student=student,
-            trip=trip,
+        # Create attendance record, refusing a duplicate
+        attendance = _create_attendance(
+            trip,
+            student,
+            event_type,
+            {"student_id": f"Student already {event_type}."},
             conductor=conductor,
-            event_type=event_type,
             latitude=latitude,
             longitude=longitude,
             confidence_score=1.0,
@@ -175,13 +679,6 @@ class ManualAttendanceSerializer(serializers.Serializer):
             notes=notes,
         )
         
-        # Update trip counters
-        if event_type == EventType.CHECKIN:
-            trip.students_boarded += 1
-        else:
-            trip.students_dropped += 1
-        trip.save(update_fields=['students_boarded', 'students_dropped'])
-        
         # Send notification
         send_attendance_notification(attendance)
         
@@ -0,0 +1,120 @@
+"""
+Signals for attendance app.
+Keep cached route face galleries and school face indexes in sync with
+encodings and student routes, trip rosters in sync with attendance, and
+authorized pickup encodings in sync with their photos.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from apps.students.models import AuthorizedPickup, Student, FaceEncoding
+from .models import Attendance
+from .gallery import invalidate_route_gallery
+from .handover import encode_pickup_in_background, invalidate_pickup_gallery
+from .face_index import add_to_school_index, invalidate_school_index, remove_from_school_index
+from .trip_roster import invalidate_trip_roster, record_attendance
+
+
+def _student_state(student_id):
+    return Student.objects.filter(pk=student_id).values_list(
+        'route_id', 'school_id', 'is_active'
+    ).first()
+
+
+@receiver(post_save, sender=FaceEncoding)
+def update_galleries_on_encoding_save(sender, instance, created, **kwargs):
+    """Rebuild the route gallery and extend the school index with new encodings."""
+    state = _student_state(instance.student_id)
+    if state is None:
+        return
+
+    route_id, school_id, is_active = state
+    invalidate_route_gallery(route_id)
+    if not created:
+        invalidate_school_index(school_id)
+    elif is_active:
+        # Only committed encodings reach the shared index or store
+        student_id, vector, face_id = instance.student_id, instance.vector, instance.id
+        transaction.on_commit(lambda: add_to_school_index(school_id, student_id, vector, face_id))
+
+
+@receiver(post_delete, sender=FaceEncoding)
+def invalidate_galleries_on_encoding_delete(sender, instance, **kwargs):
+    state = _student_state(instance.student_id)
+    if state is not None:
+        invalidate_route_gallery(state[0])
+        school_id, face_id = state[1], instance.id
+        transaction.on_commit(lambda: remove_from_school_index(school_id, face_id))
+
+
+@receiver(pre_save, sender=Student)
+def remember_student_gallery_state(sender, instance, **kwargs):
+    """Capture route, school and active flag before save to detect gallery moves."""
+    update_fields = kwargs.get('update_fields')
+    if instance._state.adding or (
+        update_fields is not None
+        and not {'route', 'route_id', 'school', 'school_id', 'is_active'} & set(update_fields)
+    ):
+        instance._gallery_previous_state = None
+        return
+    instance._gallery_previous_state = _student_state(instance.pk)
+
+
+@receiver(post_save, sender=Student)
+def invalidate_galleries_on_student_change(sender, instance, created, **kwargs):
+    """Invalidate old and new galleries when route, school or is_active change."""
+    previous = getattr(instance, '_gallery_previous_state', None)
+    if created or previous is None:
+        return
+
+    previous_route_id, previous_school_id, previous_is_active = previous
+    if previous_route_id != instance.route_id or previous_is_active != instance.is_active:
+        invalidate_route_gallery(previous_route_id)
+        invalidate_route_gallery(instance.route_id)
+    if previous_school_id != instance.school_id or previous_is_active != instance.is_active:
+        invalidate_school_index(previous_school_id)
+        invalidate_school_index(instance.school_id)
+
+
+@receiver(post_delete, sender=Student)
+def invalidate_galleries_on_student_delete(sender, instance, **kwargs):
+    invalidate_route_gallery(instance.route_id)
+    invalidate_school_index(instance.school_id)
+
+
+@receiver(post_save, sender=Attendance)
+def update_trip_roster_on_attendance_save(sender, instance, created, **kwargs):
+    if created:
+        trip_id, student_id, event_type = instance.trip_id, instance.student_id, instance.event_type
+        transaction.on_commit(lambda: record_attendance(trip_id, [student_id], event_type))
+    else:
+        invalidate_trip_roster(instance.trip_id)
+
+
+@receiver(post_delete, sender=Attendance)
+def invalidate_trip_roster_on_attendance_delete(sender, instance, **kwargs):
+    invalidate_trip_roster(instance.trip_id)
+
+
+@receiver(pre_save, sender=AuthorizedPickup)
+def clear_pickup_encoding_on_photo_change(sender, instance, **kwargs):
+    """A new photo needs a new encoding."""
+    if instance._state.adding:
+        return
+    previous_photo = AuthorizedPickup.objects.filter(pk=instance.pk).values_list('photo', flat=True).first()
+    if previous_photo != instance.photo.name:
+        instance.encoding_vector = None
+
+
+@receiver(post_save, sender=AuthorizedPickup)
+def encode_pickup_on_save(sender, instance, **kwargs):
+    invalidate_pickup_gallery(instance.student_id)
+    if instance.photo and instance.encoding_vector is None:
+        pickup_id = instance.pk
+        transaction.on_commit(lambda: encode_pickup_in_background(pickup_id))
+
+
+@receiver(post_delete, sender=AuthorizedPickup)
+def invalidate_pickup_gallery_on_delete(sender, instance, **kwargs):
+    invalidate_pickup_gallery(instance.student_id)
@@ -0,0 +1,107 @@
+"""Per-school fair queueing of the face admission controller at its cap."""
+import threading
+import time
+
+import pytest
+
+from apps.attendance.admission import AdmissionController, FacePriority
+from apps.attendance.workers import FaceServiceBusy
+
+
+class Requests:
+    """Face requests held in threads until released."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.release = threading.Event()
+        self.outcomes = {}
+        self._threads = []
+
+    def start(self, name, priority, school_id):
+        def run():
+            try:
+                with self.controller.admit(priority, school_id):
+                    self.outcomes[name] = 'admitted'
+                    self.release.wait(5)
+            except FaceServiceBusy:
+                self.outcomes[name] = 'busy'
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition(self.controller.snapshot()):
+            assert time.monotonic() < deadline, self.controller.snapshot()
+            time.sleep(0.01)
+
+    def finish(self):
+        self.release.set()
+        for thread in self._threads:
+            thread.join(5)
+
+
+@pytest.fixture
+def requests():
+    controller = AdmissionController(
+        concurrency=1,
+        max_queue=64,
+        max_queued_per_school=2,
+        reserved_scan_slots=0,
+        deadlines={},
+    )
+    requests = Requests(controller)
+    yield requests
+    requests.finish()
+
+
+def fill_school(requests, priority, school_id='a'):
+    """Occupy the only slot, then queue the school up to its cap."""
+    requests.start('running', FacePriority.ENROLL, 'other')
+    requests.wait_for(lambda report: report['running'] == 1)
+    for number in range(2):
+        requests.start(f'{school_id}{number}', priority, school_id)
+    requests.wait_for(lambda report: report['queued_by_school'].get(school_id) == 2)
+
+
+def test_higher_priority_displaces_own_lower_waiter_at_cap(requests):
+    fill_school(requests, FacePriority.ENROLL)
+
+    requests.start('scan', FacePriority.SCAN, 'a')
+    requests.wait_for(lambda report: report['priorities']['scan']['queued'] == 1)
+
+    report = requests.controller.snapshot()
+    assert report['queued_by_school'] == {'a': 2}
+    assert report['priorities']['enroll']['evicted'] == 1
+    assert requests.outcomes == {'running': 'admitted', 'a1': 'busy'}
+
+    requests.finish()
+    assert requests.outcomes['scan'] == 'admitted'
+    assert requests.outcomes['a0'] == 'admitted'
+
+
+def test_same_priority_is_refused_at_cap(requests):
+    fill_school(requests, FacePriority.SCAN)
+
+    with pytest.raises(FaceServiceBusy):
+        with requests.controller.admit(FacePriority.SCAN, 'a'):
+            pass
+
+    report = requests.controller.snapshot()
+    assert report['priorities']['scan']['rejected'] == 1
+    assert report['queued_by_school'] == {'a': 2}
+
+
+def test_other_schools_waiters_are_not_displaced(requests):
+    fill_school(requests, FacePriority.SCAN)
+    requests.start('b0', FacePriority.ENROLL, 'b')
+    requests.wait_for(lambda report: report['queued_by_school'].get('b') == 1)
+
+    with pytest.raises(FaceServiceBusy):
+        with requests.controller.admit(FacePriority.SCAN, 'a'):
+            pass
+
+    report = requests.controller.snapshot()
+    assert report['queued_by_school'] == {'a': 2, 'b': 1}
+    assert report['priorities']['enroll']['evicted'] == 0
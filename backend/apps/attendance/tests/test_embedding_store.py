@@ -0,0 +1,108 @@
+"""
+Generation and stale-file handoff of the memory-mapped embedding store.
+
+A second process is simulated by mapping the school's file again, and
+another host by publishing a newer generation in the cache.
+"""
+from unittest import mock
+
+import numpy as np
+import pytest
+from django.core.cache import cache
+
+from apps.attendance import embedding_store
+from apps.attendance.embedding_store import EmbeddingStore
+from apps.schools.models import School
+from apps.students.models import FaceEncoding, Student
+
+
+@pytest.fixture
+def store_dir(settings, tmp_path):
+    settings.FACE_EMBEDDING_STORE_DIR = str(tmp_path)
+    cache.clear()
+    embedding_store._open_stores.clear()
+    yield tmp_path
+    embedding_store._open_stores.clear()
+    cache.clear()
+
+
+@pytest.fixture
+def rebuilds():
+    """Record background rebuilds instead of running them in a thread."""
+    with mock.patch.object(embedding_store, '_rebuild_in_background') as scheduled:
+        yield scheduled
+
+
+@pytest.fixture
+def school(db):
+    school = School.objects.create(name='Test School', address='1 Road', city='City', state='State', pincode='000000')
+    rng = np.random.default_rng(0)
+    for number in range(3):
+        student = Student.objects.create(school=school, admission_number=f'A{number}', first_name=f'Student {number}')
+        encoding = FaceEncoding(student=student, photo='face.jpg')
+        encoding.set_vector(rng.normal(0, 0.1, 128))
+        encoding.save()
+    return school
+
+
+def rebuild(school):
+    with embedding_store._locked(school.id, 'build'):
+        embedding_store.rebuild_store(school.id)
+
+
+def test_missing_file_is_built_on_first_use(store_dir, rebuilds, school):
+    store = embedding_store.get_school_store(school.id)
+
+    assert len(store) == 3
+    assert store.generation == 1
+    assert cache.get(embedding_store._generation_key(school.id)) == 1
+    rebuilds.assert_not_called()
+
+
+def test_append_is_seen_by_other_mappings(store_dir, rebuilds, school):
+    store = embedding_store.get_school_store(school.id)
+    other_process = EmbeddingStore(embedding_store.store_path(school.id))
+    student = Student.objects.filter(school=school).first()
+    encoding = np.full(128, 0.5, dtype=np.float32)
+
+    embedding_store.append_to_store(school.id, student.id, encoding)
+
+    assert embedding_store.get_school_store(school.id) is store
+    assert len(store) == len(other_process) == 4
+    assert other_process.generation == cache.get(embedding_store._generation_key(school.id)) == 2
+    assert other_process.match(encoding)['student_id'] == student.id
+
+
+def test_stale_store_is_served_until_its_rebuild_swaps_in(store_dir, rebuilds, school):
+    store = embedding_store.get_school_store(school.id)
+
+    embedding_store.invalidate_store(school.id)
+
+    assert not store.is_current(0)
+    with mock.patch.object(embedding_store, 'rebuild_store') as synchronous:
+        assert embedding_store.get_school_store(school.id) is store
+    synchronous.assert_not_called()
+    rebuilds.assert_called_with(str(school.id))
+
+    rebuild(school)
+
+    fresh = embedding_store.get_school_store(school.id)
+    assert store.is_superseded
+    assert fresh is not store
+    assert fresh.is_current(cache.get(embedding_store._generation_key(school.id)))
+    assert len(fresh) == 3
+
+
+def test_newer_generation_from_another_host_rebuilds_in_background(store_dir, rebuilds, school):
+    store = embedding_store.get_school_store(school.id)
+    cache.set(embedding_store._generation_key(school.id), store.generation + 1, timeout=None)
+
+    assert embedding_store.get_school_store(school.id) is store
+    assert embedding_store._out_of_date(str(school.id))
+    rebuilds.assert_called_with(str(school.id))
+
+    rebuild(school)
+
+    fresh = embedding_store.get_school_store(school.id)
+    assert fresh.generation == store.generation + 1
+    assert not embedding_store._out_of_date(str(school.id))
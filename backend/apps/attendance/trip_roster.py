@@ -0,0 +1,159 @@
+"""
+Per-trip attendance state for face scans.
+
+A TripRoster holds the students already checked in and out on a trip, so a
+scan can be matched against a smaller gallery: check-in candidates are the
+students not yet boarded and check-out candidates are the students
+currently on the bus. Students who were already recorded stay searchable
+separately, so a child scanned twice is reported as a duplicate instead of
+being matched to someone else.
+
+Rosters are cached like route galleries and kept current by signals on
+Attendance once records commit (see signals.py). A roster may lag
+attendance recorded by another worker, so it is only a hint: duplicates
+are refused by a database check when recording, and a check-out scan that
+matches nobody is retried against a roster reloaded from the database.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .gallery import GalleryCache, merge_candidates
+from .models import EventType
+
+
+class TripGallery:
+    """
+    Candidate students for one scan, plus the students already recorded.
+
+    `match` searches both and returns the closest student with the usual
+    FaceGallery.match keys; callers check the roster to tell a duplicate
+    scan from a new one.
+    """
+
+    def __init__(self, candidates, recorded):
+        self.candidates = candidates
+        self.recorded = recorded
+
+    def __len__(self):
+        return len(self.candidates) + len(self.recorded)
+
+    @property
+    def student_ids(self):
+        return np.concatenate([self.candidates.student_ids, self.recorded.student_ids])
+
+    def match(self, encoding):
+        results = [
+            gallery.match(encoding)
+            for gallery in (self.candidates, self.recorded)
+            if len(gallery)
+        ]
+        if len(results) < 2:
+            return results[0] if results else self.candidates.match(encoding)
+
+        best, other = sorted(results, key=lambda result: result['distance'])
+        best = dict(best)
+        if other['distance'] < best['runner_up_distance']:
+            best['runner_up_id'] = other['student_id']
+            best['runner_up_distance'] = other['distance']
+            best['margin'] = best['runner_up_distance'] - best['distance']
+        best['candidates'] = merge_candidates(best['candidates'], other['candidates'])
+        best.pop('student_distances', None)
+        return best
+
+
+class TripRoster:
+    """Students checked in and checked out on one trip."""
+
+    def __init__(self, checked_in=(), checked_out=()):
+        self.checked_in = set(checked_in)
+        self.checked_out = set(checked_out)
+        self._galleries = {}
+        self._lock = threading.Lock()
+
+    def _recorded(self, event_type):
+        return self.checked_in if event_type == EventType.CHECKIN else self.checked_out
+
+    def is_recorded(self, student_id, event_type):
+        return student_id in self._recorded(event_type)
+
+    def is_on_bus(self, student_id):
+        return student_id in self.checked_in and student_id not in self.checked_out
+
+    def record(self, student_ids, event_type):
+        """Mark students as checked in or out."""
+        with self._lock:
+            self._recorded(event_type).update(student_ids)
+            self._galleries.clear()
+
+    def gallery_for(self, event_type, route_gallery):
+        """
+        Split a route gallery into candidates and already-recorded students
+        for this event. Memoized until the roster or route gallery changes.
+        """
+        with self._lock:
+            cached = self._galleries.get(event_type)
+            if cached is not None and cached[0] is route_gallery:
+                return cached[1]
+            recorded = set(self._recorded(event_type))
+            on_bus = self.checked_in - self.checked_out
+
+        if event_type == EventType.CHECKIN:
+            candidate_ids = set(route_gallery.student_ids) - recorded
+        else:
+            candidate_ids = on_bus
+        gallery = TripGallery(
+            route_gallery.subset(candidate_ids),
+            route_gallery.subset(recorded),
+        )
+
+        with self._lock:
+            self._galleries[event_type] = (route_gallery, gallery)
+        return gallery
+
+
+def load_trip_roster(trip_id):
+    """Build a trip's roster from its attendance records."""
+    from .models import Attendance
+
+    records = list(Attendance.objects.filter(trip_id=trip_id).values_list('student_id', 'event_type'))
+    return TripRoster(
+        (student_id for student_id, event_type in records if event_type == EventType.CHECKIN),
+        (student_id for student_id, event_type in records if event_type == EventType.CHECKOUT),
+    )
+
+
+trip_rosters = GalleryCache(
+    'trip_roster',
+    load_trip_roster,
+    getattr(settings, 'FACE_TRIP_ROSTER_CACHE_SIZE', 128)
+)
+
+
+def get_trip_roster(trip_id):
+    """Return the cached roster for a trip."""
+    return trip_rosters.get(trip_id)
+
+
+def record_attendance(trip_id, student_ids, event_type):
+    """Add new attendance to a trip's roster (bulk_create skips the signals)."""
+    trip_rosters.apply(trip_id, lambda roster: roster.record(student_ids, event_type))
+
+
+def invalidate_trip_roster(trip_id):
+    trip_rosters.invalidate(trip_id)
+
+
+def refresh_trip_roster(trip_id, roster):
+    """
+    Reload a trip's roster from the database.
+
+    Returns `roster` itself if it is still current, else the fresh roster
+    (and drops the stale copy from the cache).
+    """
+    fresh = load_trip_roster(trip_id)
+    if fresh.checked_in == roster.checked_in and fresh.checked_out == roster.checked_out:
+        return roster
+    trip_rosters.invalidate(trip_id)
+    return fresh
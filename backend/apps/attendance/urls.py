@@ -5,13 +5,19 @@ from django.urls import path
 from .views import (
     FaceScanCheckinView,
     FaceScanCheckoutView,
+    ConfirmFaceScanView,
+    GroupFaceScanCheckinView,
+    GroupFaceScanCheckoutView,
     ManualAttendanceView,
+    PickupHandoverView,
     TripAttendanceView,
     StudentAttendanceHistoryView,
     ChildAttendanceHistoryView,
     ChildAttendanceHistoryView,
     ChildCurrentStatusView,
     AttendanceListView,
+    ScanLatencyView,
+    FaceQueueView,
 )
 
 app_name = 'attendance'
@@ -23,6 +29,14 @@ urlpatterns = [
     # Face scan endpoints
     path('checkin/', FaceScanCheckinView.as_view(), name='face-checkin'),
     path('checkout/', FaceScanCheckoutView.as_view(), name='face-checkout'),
+    path('confirm/', ConfirmFaceScanView.as_view(), name='face-scan-confirm'),
+    path('checkin/group/', GroupFaceScanCheckinView.as_view(), name='group-face-checkin'),
+    path('checkout/group/', GroupFaceScanCheckoutView.as_view(), name='group-face-checkout'),
+    path('metrics/scan-latency/', ScanLatencyView.as_view(), name='scan-latency'),
+    path('metrics/face-queue/', FaceQueueView.as_view(), name='face-queue'),
+    
+    # Drop-off handover to an authorized pickup person
+    path('handover/verify/', PickupHandoverView.as_view(), name='pickup-handover'),
     
     # Manual attendance
     path('manual/', ManualAttendanceView.as_view(), name='manual-attendance'),
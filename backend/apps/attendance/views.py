@@ -4,15 +4,19 @@ Views for attendance app.
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.utils import timezone
 from datetime import timedelta
 
 from .models import Attendance, EventType
 from .serializers import (
+    AmbiguousMatch,
     AttendanceSerializer,
+    ConfirmFaceScanSerializer,
     FaceScanSerializer,
+    GroupFaceScanSerializer,
     ManualAttendanceSerializer,
+    PickupHandoverSerializer,
     TripAttendanceSerializer,
 )
 from core.permissions import IsConductorOrDriver, IsStaff, IsParent, IsSchoolAdmin
@@ -22,12 +26,12 @@ from apps.accounts.models import SchoolMembership, UserRole
 
 
 class FaceScanCheckinView(APIView):
-    """Face scan check-in endpoint."""
+    """Face scan check-in endpoint (photo upload or device-computed encoding)."""
     permission_classes = [IsConductorOrDriver]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
     
     def post(self, request):
-        data = request.data.dict()
+        data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
         data['event_type'] = EventType.CHECKIN
         
         serializer = FaceScanSerializer(
@@ -37,7 +41,10 @@ class FaceScanCheckinView(APIView):
         if not serializer.is_valid():
             print(f"Check-in Serializer errors: {serializer.errors}")
             serializer.is_valid(raise_exception=True)
-        attendance = serializer.save()
+        try:
+            attendance = serializer.save()
+        except AmbiguousMatch as e:
+            return Response(e.data, status=status.HTTP_409_CONFLICT)
         
         # Broadcast update to parents
         from channels.layers import get_channel_layer
@@ -64,12 +71,12 @@ class FaceScanCheckinView(APIView):
 
 
 class FaceScanCheckoutView(APIView):
-    """Face scan check-out endpoint."""
+    """Face scan check-out endpoint (photo upload or device-computed encoding)."""
     permission_classes = [IsConductorOrDriver]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
     
     def post(self, request):
-        data = request.data.dict()
+        data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
         data['event_type'] = EventType.CHECKOUT
         
         serializer = FaceScanSerializer(
@@ -77,7 +84,10 @@ class FaceScanCheckoutView(APIView):
             context={'request': request}
         )
         serializer.is_valid(raise_exception=True)
-        attendance = serializer.save()
+        try:
+            attendance = serializer.save()
+        except AmbiguousMatch as e:
+            return Response(e.data, status=status.HTTP_409_CONFLICT)
 
         # Broadcast update to parents
         from channels.layers import get_channel_layer
@@ -103,6 +113,186 @@ class FaceScanCheckoutView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class ConfirmFaceScanView(APIView):
+    """Confirm one candidate of an ambiguous face scan (409 ambiguous_match)."""
+    permission_classes = [IsConductorOrDriver]
+    
+    def post(self, request):
+        serializer = ConfirmFaceScanSerializer(
+            data=request.data,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        attendance = serializer.save()
+        
+        # Broadcast update to parents
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+        
+        channel_layer = get_channel_layer()
+        action = "boarded the bus" if attendance.event_type == EventType.CHECKIN else "been dropped off"
+        for parent in attendance.student.parents.all():
+            if parent.user:
+                async_to_sync(channel_layer.group_send)(
+                    f"user_{parent.user.id}",
+                    {
+                        'type': 'trip_event',
+                        'event_type': 'trip_started', # Reusing this to trigger full refresh
+                        'data': {
+                            'message': f"{attendance.student.first_name} has {action}"
+                        }
+                    }
+                )
+        
+        verb = 'checked in' if attendance.event_type == EventType.CHECKIN else 'checked out'
+        return Response({
+            'message': f'{attendance.student.full_name} {verb} successfully',
+            'attendance': AttendanceSerializer(attendance).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class GroupFaceScanView(APIView):
+    """Check in or out every recognized student in one group photo."""
+    permission_classes = [IsConductorOrDriver]
+    parser_classes = [MultiPartParser, FormParser]
+    event_type = EventType.CHECKIN
+    
+    def post(self, request):
+        data = request.data.dict()
+        data['event_type'] = self.event_type
+        
+        serializer = GroupFaceScanSerializer(
+            data=data,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        result = serializer.save()
+        attendances = result['attendances']
+        
+        # Broadcast update to parents
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+        
+        channel_layer = get_channel_layer()
+        action = "boarded the bus" if self.event_type == EventType.CHECKIN else "been dropped off"
+        for attendance in attendances:
+            for parent in attendance.student.parents.all():
+                if parent.user:
+                    async_to_sync(channel_layer.group_send)(
+                        f"user_{parent.user.id}",
+                        {
+                            'type': 'trip_event',
+                            'event_type': 'trip_started', # Reusing this to trigger full refresh
+                            'data': {
+                                'message': f"{attendance.student.first_name} has {action}"
+                            }
+                        }
+                    )
+        
+        verb = 'checked in' if self.event_type == EventType.CHECKIN else 'checked out'
+        return Response({
+            'message': f'{len(attendances)} student(s) {verb} successfully',
+            'attendances': AttendanceSerializer(attendances, many=True).data,
+            'already_recorded': [
+                {'id': str(student.id), 'full_name': student.full_name}
+                for student in result['already_recorded']
+            ],
+            'pending': result['pending'],
+            'face_count': result['face_count'],
+            'unmatched_count': result['unmatched_count'],
+        }, status=status.HTTP_201_CREATED)
+
+
+class GroupFaceScanCheckinView(GroupFaceScanView):
+    """Group photo check-in endpoint."""
+    event_type = EventType.CHECKIN
+
+
+class GroupFaceScanCheckoutView(GroupFaceScanView):
+    """Group photo check-out endpoint."""
+    event_type = EventType.CHECKOUT
+
+
+class PickupHandoverView(APIView):
+    """
+    Verify the adult collecting a student at drop-off against the student's
+    authorized pickup persons (encodings cached per student).
+    """
+    permission_classes = [IsConductorOrDriver]
+    parser_classes = [MultiPartParser, FormParser]
+    
+    def post(self, request):
+        from django.conf import settings
+        from apps.students.models import AuthorizedPickup
+        from .admission import FacePriority, face_request
+        from .face_recognition import verify_face
+        from .handover import get_pickup_gallery, invalidate_pickup_gallery, matches_current_encoding
+        
+        serializer = PickupHandoverSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        students = Student.objects.filter(pk=data['student_id'])
+        user = request.user
+        if user.role != UserRole.ROOT_ADMIN:
+            school_ids = SchoolMembership.objects.filter(
+                user=user,
+                is_active=True
+            ).values_list('school_id', flat=True)
+            students = students.filter(school_id__in=school_ids)
+        student = students.first()
+        if student is None:
+            return Response(
+                {'error': 'Student not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        for attempt in range(2):
+            gallery = get_pickup_gallery(student.id)
+            if not len(gallery):
+                return Response(
+                    {'error': 'No authorized pickup persons with encoded photos for this student'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            with face_request(FacePriority.SCAN, student.school_id):
+                result = verify_face(
+                    data['photo'],
+                    gallery,
+                    tolerance=getattr(settings, 'FACE_PICKUP_TOLERANCE', 0.5),
+                    face_box=data.get('face_box')
+                )
+            if not result['success']:
+                return Response(
+                    {'error': result['error']},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            pickup = None
+            if result['is_match']:
+                pickup = AuthorizedPickup.objects.filter(pk=result['matched_id'], is_active=True).first()
+            if pickup is None or matches_current_encoding(gallery, pickup):
+                break
+            
+            # Matched an encoding cached before this pickup's photo was replaced
+            invalidate_pickup_gallery(student.id)
+            data['photo'].seek(0)
+            pickup = None
+        
+        return Response({
+            'verified': pickup is not None,
+            'student_id': str(student.id),
+            'confidence': result['confidence'],
+            'pickup': {
+                'id': str(pickup.id),
+                'name': pickup.name,
+                'relationship': pickup.relationship,
+                'phone': pickup.phone,
+                'photo': request.build_absolute_uri(pickup.photo.url) if pickup.photo else None,
+            } if pickup else None,
+        })
+
+
 class ManualAttendanceView(APIView):
     """Manual attendance marking endpoint."""
     permission_classes = [IsConductorOrDriver]
@@ -390,3 +580,24 @@ class AttendanceListView(generics.ListAPIView):
             queryset = queryset.filter(student_id=student_id)
             
         return queryset.order_by('-timestamp')
+
+
+class ScanLatencyView(APIView):
+    """Cold vs warm face scan latency recorded by this worker process."""
+    permission_classes = [IsStaff]
+    
+    def get(self, request):
+        from .metrics import scan_latency
+        
+        return Response({'scan_latency': scan_latency.snapshot()})
+
+
+class FaceQueueView(APIView):
+    """Face inference admission queue depth, wait times and rejections in this worker process."""
+    permission_classes = [IsStaff]
+    
+    def get(self, request):
+        from .admission import get_admission_controller
+        
+        controller = get_admission_controller()
+        return Response({'face_queue': controller.snapshot() if controller else None})
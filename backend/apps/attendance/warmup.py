@@ -0,0 +1,84 @@
+"""
+Trip warm-up.
+
+When a trip starts, the route's face gallery, the trip roster (with its
+check-in candidate gallery) and the school-wide face index used for
+off-route scans are loaded into their caches in a background thread, and
+the face worker processes are started, so the first scan of the trip does
+not pay for them.
+Caches are per process: the worker that handled the trip start is warmed,
+other processes still load on their first scan (see metrics for the
+cold/warm split).
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .imaging import StageTimer
+from .models import EventType
+
+logger = logging.getLogger(__name__)
+
+
+def warm_trip(trip_id):
+    """
+    Preload everything the first scans of a trip need.
+
+    Returns:
+        dict: stage timings in milliseconds
+    """
+    from apps.transport.models import Trip
+    from . import face_recognition as face_module
+    from .face_index import get_school_indexes
+    from .gallery import get_route_gallery
+    from .trip_roster import get_trip_roster
+    from .workers import get_worker_pool
+
+    close_old_connections()
+    timings = {}
+    try:
+        trip = Trip.objects.filter(pk=trip_id).values('route_id', 'route__school_id').first()
+        if trip is None:
+            return timings
+        route_id = trip['route_id']
+
+        with StageTimer(timings, 'workers_ms'):
+            pool = get_worker_pool()
+            if pool is not None:
+                pool.warm()
+        with StageTimer(timings, 'gallery_ms'):
+            route_gallery = get_route_gallery(route_id)
+        with StageTimer(timings, 'roster_ms'):
+            get_trip_roster(trip_id).gallery_for(EventType.CHECKIN, route_gallery)
+        if getattr(settings, 'FACE_OFF_ROUTE_FALLBACK', True):
+            with StageTimer(timings, 'school_index_ms'):
+                get_school_indexes([trip['route__school_id']])
+
+        logger.info(
+            f"Warmed trip {trip_id} (face_recognition available: "
+            f"{face_module.FACE_RECOGNITION_AVAILABLE}, {len(route_gallery)} encodings): {timings}"
+        )
+    except Exception as e:
+        # Warm-up is an optimisation; scans load whatever is missing themselves
+        logger.warning(f"Trip warm-up failed for {trip_id}: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+    return timings
+
+
+def start_trip_warmup(trip):
+    """Warm a trip's caches in a background thread once the trip is committed."""
+    if not getattr(settings, 'FACE_TRIP_WARMUP', True):
+        return
+
+    def start():
+        threading.Thread(
+            target=warm_trip,
+            args=(trip.pk,),
+            name=f'trip-warmup-{trip.pk}',
+            daemon=True,
+        ).start()
+
+    transaction.on_commit(start)
@@ -0,0 +1,184 @@
+"""
+Face inference worker pool.
+
+dlib detection and encoding are CPU-bound and would otherwise run inside the
+daphne/gunicorn request threads, starving GPS and WebSocket traffic during a
+burst of scans. When FACE_WORKER_PROCESSES > 0 they run in a dedicated
+process pool instead. Workers are started with the spawn method, set up
+Django and load the face models once, and are pre-started so the first scan
+does not pay for it.
+
+The pool has a bounded number of outstanding jobs. When it is full, or a
+job exceeds FACE_WORKER_TIMEOUT, FaceServiceBusy is raised and DRF answers
+503 with a Retry-After header.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+
+class FaceServiceBusy(APIException):
+    """Face inference is saturated or timed out; the client should retry."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Face recognition is busy. Please retry shortly.'
+    default_code = 'face_service_busy'
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        # DRF's exception handler turns `wait` into a Retry-After header
+        self.wait = wait if wait is not None else getattr(settings, 'FACE_WORKER_RETRY_AFTER', 2)
+
+
+def _init_worker(settings_module):
+    """Process initializer: set up Django and load the face models once."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+    from . import face_recognition as face_module
+    logger.info(
+        f"Face worker {os.getpid()} ready "
+        f"(face_recognition available: {face_module.FACE_RECOGNITION_AVAILABLE})"
+    )
+
+
+def _warm():
+    return os.getpid()
+
+
+def _extract_job(image_bytes, max_faces, scan_photo, face_box=None):
+    """Run in a worker: decode, detect and encode faces from raw image bytes."""
+    from .face_recognition import extract_face_encodings_local
+    return extract_face_encodings_local(
+        BytesIO(image_bytes), max_faces=max_faces, scan_photo=scan_photo, face_box=face_box
+    )
+
+
+class FaceWorkerPool:
+    """Process pool with a bounded number of queued plus running jobs."""
+
+    def __init__(self, processes, max_pending, timeout):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings.development'),),
+                )
+                # Start every worker now so models are loaded before the first scan
+                for _ in range(self.processes):
+                    self._executor.submit(_warm)
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def warm(self):
+        """Start the worker processes if they are not running yet."""
+        self._get_executor()
+
+    def pending(self):
+        """Number of jobs currently queued or running."""
+        return self._pending
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._pending += 1
+        return True
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        """
+        Run `fn(*args)` in a worker and wait for the result.
+
+        Raises:
+            FaceServiceBusy: if the pool is full or the job times out
+        """
+        if not self._acquire():
+            logger.warning(f"Face worker pool saturated ({self.max_pending} pending jobs)")
+            raise FaceServiceBusy()
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._reset(executor)
+            raise FaceServiceBusy('Face recognition workers restarted. Please retry.')
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the job really finishes, even after a timeout
+        future.add_done_callback(lambda _: self._release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning(f"Face worker job timed out after {self.timeout}s")
+            raise FaceServiceBusy('Face recognition timed out. Please retry.')
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise FaceServiceBusy('Face recognition workers restarted. Please retry.')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Return the process-wide pool, or None when running inline."""
+    global _pool
+    processes = getattr(settings, 'FACE_WORKER_PROCESSES', 0)
+    if processes <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = FaceWorkerPool(
+                processes,
+                getattr(settings, 'FACE_WORKER_MAX_PENDING', 4 * processes),
+                getattr(settings, 'FACE_WORKER_TIMEOUT', 15),
+            )
+        return _pool
+
+
+def extract_in_worker(pool, image_file, max_faces=None, scan_photo=False, face_box=None):
+    """
+    Send an uploaded image to the pool for decode/detect/encode.
+
+    The worker also re-encodes the scan photo when asked, so the request
+    process never decodes the upload itself.
+    """
+    image_file.seek(0)
+    image_bytes = image_file.read()
+    image_file.seek(0)
+    return pool.submit(_extract_job, image_bytes, max_faces, scan_photo, face_box)
@@ -2,7 +2,7 @@
 Admin configuration for students app.
 """
 from django.contrib import admin
-from .models import Student, Parent, FaceEncoding
+from .models import Student, Parent, FaceEncoding, FaceEnrollmentJob
 
 
 @admin.register(Student)
@@ -37,8 +37,22 @@ class ParentAdmin(admin.ModelAdmin):
 @admin.register(FaceEncoding)
 class FaceEncodingAdmin(admin.ModelAdmin):
     """Admin for FaceEncoding model."""
-    list_display = ['student', 'is_primary', 'quality_score', 'created_at']
+    list_display = ['student', 'is_primary', 'quality_score', 'has_encoding', 'created_at']
     list_filter = ['is_primary']
     search_fields = ['student__first_name', 'student__last_name']
     ordering = ['-created_at']
-    readonly_fields = ['encoding', 'created_at', 'updated_at']
+    exclude = ['encoding']
+    readonly_fields = ['has_encoding', 'created_at', 'updated_at']
+    
+    @admin.display(boolean=True, description='Encoding')
+    def has_encoding(self, obj):
+        return obj.encoding_vector is not None or obj.encoding is not None
+
+
+@admin.register(FaceEnrollmentJob)
+class FaceEnrollmentJobAdmin(admin.ModelAdmin):
+    """Admin for FaceEnrollmentJob model."""
+    list_display = ['school', 'status', 'processed_files', 'total_files', 'enrolled_count', 'failed_count', 'created_at']
+    list_filter = ['status', 'school']
+    ordering = ['-created_at']
+    readonly_fields = ['errors', 'started_at', 'finished_at', 'created_at', 'updated_at']
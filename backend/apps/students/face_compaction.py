@@ -0,0 +1,149 @@
+"""
+Face encoding compaction.
+
+Keeps each student's gallery small and diverse: near-duplicate encodings are
+rejected at enrollment, at most FACE_MAX_ENCODINGS_PER_STUDENT encodings are
+kept (chosen greedily for quality and spread), and the mean encoding is
+stored on the student as `face_centroid` for the gallery's first-pass filter.
+"""
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .face_vectors import pack_encoding, stored_encoding
+from .models import Student, FaceEncoding
+
+logger = logging.getLogger(__name__)
+
+
+def _distances(matrix, vector):
+    return np.linalg.norm(matrix - vector, axis=1)
+
+
+def nearest_distance(encoding, encodings):
+    """Distance from an encoding to the closest of `encodings` (inf if none)."""
+    if not len(encodings):
+        return float('inf')
+    matrix = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+    return float(_distances(matrix, np.asarray(encoding, dtype=np.float32)).min())
+
+
+def student_vectors(student_id):
+    """Stored encodings of one student as a list of float32 arrays."""
+    return [
+        stored_encoding(vector_data, legacy_encoding)
+        for vector_data, legacy_encoding in FaceEncoding.objects.filter(
+            student_id=student_id
+        ).values_list('encoding_vector', 'encoding')
+    ]
+
+
+def is_near_duplicate(encoding, encodings, threshold=None):
+    """True if `encoding` adds nothing over one of the existing encodings."""
+    if threshold is None:
+        threshold = getattr(settings, 'FACE_DUPLICATE_DISTANCE', 0.15)
+    return nearest_distance(encoding, encodings) < threshold
+
+
+def select_representatives(matrix, quality, max_count, duplicate_distance, required=()):
+    """
+    Pick up to `max_count` diverse rows of `matrix`.
+
+    Starts from `required` rows (or the best quality row) and repeatedly adds
+    the row farthest from everything kept so far, weighted by quality. Rows
+    within `duplicate_distance` of a kept row are never picked.
+
+    Returns:
+        sorted list of row indices to keep
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    quality = np.clip(np.asarray(quality, dtype=np.float32), 0.0, 1.0)
+
+    keep = list(dict.fromkeys(required)) or [int(np.argmax(quality))]
+    nearest = np.full(len(matrix), np.inf, dtype=np.float32)
+    for row in keep:
+        nearest = np.minimum(nearest, _distances(matrix, matrix[row]))
+
+    while len(keep) < max_count:
+        score = np.where(nearest >= duplicate_distance, nearest * (0.5 + 0.5 * quality), -1.0)
+        row = int(np.argmax(score))
+        if score[row] < 0:
+            break
+        keep.append(row)
+        nearest = np.minimum(nearest, _distances(matrix, matrix[row]))
+
+    return sorted(keep)
+
+
+def refresh_face_centroid(student_id):
+    """
+    Recompute and store the mean encoding of a student (None without encodings).
+
+    update() skips Student signals, so the student's route gallery, which
+    holds the old centroid, is invalidated here. School indexes hold only
+    the encodings themselves and are kept current by FaceEncoding signals.
+    """
+    from apps.attendance.gallery import invalidate_route_gallery
+
+    vectors = student_vectors(student_id)
+    centroid = pack_encoding(np.mean(vectors, axis=0)) if vectors else None
+    Student.objects.filter(pk=student_id).update(face_centroid=centroid)
+
+    route_id = Student.objects.filter(pk=student_id).values_list('route_id', flat=True).first()
+    if route_id is not None:
+        invalidate_route_gallery(route_id)
+    return centroid
+
+
+def compact_student_encodings(student_id, max_count=None, duplicate_distance=None,
+                              keep_ids=(), dry_run=False):
+    """
+    Drop redundant encodings of one student and refresh their centroid.
+
+    The primary encoding and any `keep_ids` are always kept.
+
+    Returns:
+        int: number of encodings removed (or that would be, with dry_run)
+    """
+    if max_count is None:
+        max_count = getattr(settings, 'FACE_MAX_ENCODINGS_PER_STUDENT', 5)
+    if duplicate_distance is None:
+        duplicate_distance = getattr(settings, 'FACE_DUPLICATE_DISTANCE', 0.15)
+
+    encodings = list(FaceEncoding.objects.filter(student_id=student_id).order_by('created_at'))
+    if not encodings:
+        if not dry_run:
+            refresh_face_centroid(student_id)
+        return 0
+
+    keep_ids = set(keep_ids)
+    required = [
+        i for i, face in enumerate(encodings)
+        if face.is_primary or face.id in keep_ids
+    ]
+    keep = select_representatives(
+        np.stack([face.vector for face in encodings]),
+        [face.quality_score for face in encodings],
+        max(max_count, len(required)),
+        duplicate_distance,
+        required,
+    )
+    removed = [face for i, face in enumerate(encodings) if i not in set(keep)]
+
+    if dry_run:
+        return len(removed)
+
+    if removed:
+        # Bulk enrollment may point the profile photo at an encoding's file
+        profile_photo = Student.objects.filter(pk=student_id).values_list('photo', flat=True).first()
+        photos = [face.photo for face in removed if face.photo and face.photo.name != profile_photo]
+        with transaction.atomic():
+            FaceEncoding.objects.filter(pk__in=[face.pk for face in removed]).delete()
+        for photo in photos:
+            photo.delete(save=False)
+        logger.info(f"Compacted face encodings of student {student_id}: removed {len(removed)}")
+
+    refresh_face_centroid(student_id)
+    return len(removed)
@@ -0,0 +1,279 @@
+"""
+Bulk face enrollment.
+
+An uploaded zip archive (or a set of photos packed into one) is processed by
+a Celery task (see tasks), so web workers never hold photo data or job
+state. Photos are matched to students by admission number:
+`ADM123.jpg`, or any image inside an `ADM123/` folder. Encodings run
+concurrently through the face pipeline (and the face worker pool when it is
+enabled) and FaceEncoding rows are written with bulk_create in batches.
+Near-duplicate photos are skipped and each enrolled student is compacted
+at the end (see face_compaction).
+
+A job that stops reporting progress for FACE_ENROLLMENT_STALE_AFTER seconds
+(its worker was killed or redeployed) is marked failed when a worker starts
+and whenever jobs are listed.
+"""
+import logging
+import os
+import time
+from datetime import timedelta
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .face_compaction import compact_student_encodings, is_near_duplicate
+from .face_vectors import stored_encoding
+from .models import Student, FaceEncoding, FaceEnrollmentJob
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+
+def build_archive(files):
+    """Pack several uploaded photos into one zip so jobs have a single input."""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for uploaded in files:
+            archive.writestr(os.path.basename(uploaded.name), uploaded.read())
+    return ContentFile(buffer.getvalue(), name='photos.zip')
+
+
+def admission_number_for(path):
+    """Return the admission number a photo path refers to."""
+    folder, filename = os.path.split(path.strip('/'))
+    if folder:
+        return os.path.basename(folder)
+    return os.path.splitext(filename)[0]
+
+
+def list_photos(archive):
+    """
+    List image entries of an open ZipFile.
+
+    Returns:
+        tuple: (list of ZipInfo to process, list of error dicts for skipped entries)
+    """
+    max_files = getattr(settings, 'FACE_ENROLLMENT_MAX_FILES', 5000)
+    max_bytes = getattr(settings, 'FACE_ENROLLMENT_MAX_FILE_BYTES', 15 * 1024 * 1024)
+
+    entries = []
+    errors = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or os.path.basename(name).startswith('.') or '__MACOSX' in name:
+            continue
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            errors.append({'file': name, 'admission_number': None, 'error': 'Not an image file'})
+            continue
+        if info.file_size > max_bytes:
+            errors.append({'file': name, 'admission_number': None, 'error': 'File too large'})
+            continue
+        if len(entries) >= max_files:
+            errors.append({'file': name, 'admission_number': None, 'error': 'Too many files in archive'})
+            continue
+        entries.append(info)
+    return entries, errors
+
+
+def _encode_photo(data, school_id):
+    """Encode one photo, waiting out face worker backpressure instead of failing."""
+    from apps.attendance.admission import FacePriority, face_request
+    from apps.attendance.face_recognition import generate_face_encoding
+    from apps.attendance.workers import FaceServiceBusy
+
+    # Lowest priority: attendance scans and identify go ahead of bulk enrollment
+    with face_request(FacePriority.ENROLL, school_id):
+        while True:
+            try:
+                return generate_face_encoding(BytesIO(data))
+            except FaceServiceBusy as e:
+                time.sleep(e.wait)
+
+
+def _invalidate_galleries(students):
+    """bulk_create skips signals, so refresh the affected galleries here."""
+    from apps.attendance.gallery import invalidate_route_gallery
+    from apps.attendance.face_index import invalidate_school_index
+
+    for route_id in {student.route_id for student in students}:
+        invalidate_route_gallery(route_id)
+    for school_id in {student.school_id for student in students}:
+        invalidate_school_index(school_id)
+
+
+class EnrollmentRunner:
+    """Processes one FaceEnrollmentJob."""
+
+    def __init__(self, job):
+        self.job = job
+        self.batch_size = getattr(settings, 'FACE_ENROLLMENT_BATCH_SIZE', 100)
+        self.concurrency = getattr(settings, 'FACE_ENROLLMENT_CONCURRENCY', 4)
+        self.pending = []
+        self.enrolled_students = {}
+        self.vectors = defaultdict(list)
+
+    def _flush(self):
+        """Write pending encodings in one bulk_create and record progress."""
+        if self.pending:
+            FaceEncoding.objects.bulk_create(self.pending)
+            students = {face.student_id: face.student for face in self.pending}
+            # Same rule as single uploads: the primary photo becomes the profile photo
+            new_photos = {}
+            for face in self.pending:
+                student = students[face.student_id]
+                if not student.photo or face.is_primary:
+                    student.photo = face.photo.name
+                    new_photos[student.id] = student
+            if new_photos:
+                Student.objects.bulk_update(list(new_photos.values()), ['photo'])
+            self.enrolled_students.update(students)
+            self.pending = []
+
+        # updated_at doubles as the job's heartbeat (see fail_stale_jobs)
+        FaceEnrollmentJob.objects.filter(pk=self.job.pk).update(
+            updated_at=timezone.now(),
+            processed_files=self.job.processed_files,
+            enrolled_count=self.job.enrolled_count,
+            failed_count=self.job.failed_count,
+            errors=self.job.errors,
+        )
+
+    def _fail_file(self, name, admission_number, error):
+        self.job.failed_count += 1
+        self.job.errors.append({'file': name, 'admission_number': admission_number, 'error': error})
+
+    def run(self):
+        job = self.job
+        job.status = 'processing'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'updated_at'])
+
+        with job.archive.open('rb') as stored, zipfile.ZipFile(stored) as archive:
+            entries, skipped = list_photos(archive)
+            job.total_files = len(entries) + len(skipped)
+            job.processed_files = len(skipped)
+            job.failed_count = len(skipped)
+            job.errors = skipped
+            job.save(update_fields=['total_files', 'processed_files', 'failed_count', 'errors'])
+
+            students = {
+                student.admission_number: student
+                for student in Student.objects.filter(school_id=job.school_id, is_active=True)
+            }
+            for student_id, vector_data, legacy_encoding in FaceEncoding.objects.filter(
+                student__school_id=job.school_id
+            ).values_list('student_id', 'encoding_vector', 'encoding'):
+                self.vectors[student_id].append(stored_encoding(vector_data, legacy_encoding))
+
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                # Keep a bounded window of photos in flight
+                window = []
+                for info in entries:
+                    window.append(self._submit(executor, archive, info, students))
+                    if len(window) >= 2 * self.concurrency:
+                        self._collect(*window.pop(0))
+                for item in window:
+                    self._collect(*item)
+
+        self._flush()
+        # Trim to the most diverse encodings and refresh centroids
+        for student_id in self.enrolled_students:
+            compact_student_encodings(student_id)
+        _invalidate_galleries(self.enrolled_students.values())
+
+    def _submit(self, executor, archive, info, students):
+        admission_number = admission_number_for(info.filename)
+        student = students.get(admission_number)
+        if student is None:
+            return info, admission_number, None, None, None
+        data = archive.read(info)
+        return info, admission_number, student, data, executor.submit(_encode_photo, data, self.job.school_id)
+
+    def _collect(self, info, admission_number, student, data, future):
+        job = self.job
+        job.processed_files += 1
+
+        if student is None:
+            self._fail_file(info.filename, admission_number, 'No active student with this admission number')
+        else:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+
+            if not result['success']:
+                self._fail_file(info.filename, admission_number, result['error'])
+            elif is_near_duplicate(result['encoding'], self.vectors[student.id]):
+                self._fail_file(info.filename, admission_number, 'Too similar to an existing face photo')
+            else:
+                is_primary = not self.vectors[student.id]
+                self.vectors[student.id].append(np.asarray(result['encoding'], dtype=np.float32))
+                self.pending.append(FaceEncoding(
+                    student=student,
+                    encoding_vector=result['encoding_bytes'],
+                    photo=ContentFile(data, name=os.path.basename(info.filename)),
+                    is_primary=is_primary,
+                    quality_score=result['confidence'],
+                ))
+                job.enrolled_count += 1
+
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+
+def run_enrollment_job(job_id):
+    """Process a job to completion, recording failure on unexpected errors."""
+    close_old_connections()
+    job = FaceEnrollmentJob.objects.get(pk=job_id)
+    if job.status != 'pending':
+        # Delivered twice, or already given up on
+        return
+    try:
+        EnrollmentRunner(job).run()
+        job.status = 'completed'
+    except Exception as e:
+        logger.error(f"Face enrollment job {job_id} failed: {str(e)}", exc_info=True)
+        job.status = 'failed'
+        job.errors.append({'file': None, 'admission_number': None, 'error': str(e)})
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=[
+            'status', 'finished_at', 'processed_files',
+            'enrolled_count', 'failed_count', 'errors'
+        ])
+        close_old_connections()
+
+
+def start_enrollment_job(job):
+    """Queue a job for a Celery worker once the job row is committed."""
+    from .tasks import run_face_enrollment_job
+
+    transaction.on_commit(lambda: run_face_enrollment_job.delay(str(job.pk)))
+
+
+def fail_stale_jobs():
+    """Mark jobs whose worker stopped reporting progress as failed. Returns the count."""
+    stale_after = getattr(settings, 'FACE_ENROLLMENT_STALE_AFTER', 600)
+    stale = FaceEnrollmentJob.objects.filter(
+        status='processing',
+        updated_at__lt=timezone.now() - timedelta(seconds=stale_after)
+    )
+    count = 0
+    for job in stale:
+        job.status = 'failed'
+        job.finished_at = timezone.now()
+        job.errors.append({'file': None, 'admission_number': None, 'error': 'Job interrupted; please upload again'})
+        job.save(update_fields=['status', 'finished_at', 'errors', 'updated_at'])
+        count += 1
+    if count:
+        logger.warning(f"Marked {count} interrupted face enrollment jobs as failed")
+    return count
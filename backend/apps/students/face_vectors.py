@@ -0,0 +1,55 @@
+"""
+Binary storage for face encoding vectors.
+
+Encodings are stored as a small header followed by packed little-endian
+float32 values, so a stored row is read back with a single np.frombuffer
+instead of JSON decoding 128 Python floats.
+
+Header layout (8 bytes): magic b'FE', format version (uint8),
+reserved (uint8), dimension (uint32).
+"""
+import struct
+
+import numpy as np
+
+ENCODING_MAGIC = b'FE'
+ENCODING_VERSION = 1
+ENCODING_DIM = 128
+
+_HEADER = struct.Struct('<2sBxI')
+_DTYPE = np.dtype('<f4')
+
+
+def pack_encoding(encoding):
+    """Pack a face encoding (list or ndarray) into header + float32 bytes."""
+    vector = np.asarray(encoding, dtype=_DTYPE).reshape(-1)
+    return _HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION, len(vector)) + vector.tobytes()
+
+
+def unpack_encoding(data):
+    """
+    Unpack bytes produced by pack_encoding into a read-only float32 array.
+    
+    Raises:
+        ValueError: if the header is missing, unknown, or truncated.
+    """
+    if data is None or len(data) < _HEADER.size:
+        raise ValueError('Face encoding data is missing or truncated')
+    
+    magic, version, dim = _HEADER.unpack_from(data)
+    if magic != ENCODING_MAGIC or version != ENCODING_VERSION:
+        raise ValueError(f'Unsupported face encoding format (version {version})')
+    if len(data) != _HEADER.size + dim * _DTYPE.itemsize:
+        raise ValueError('Face encoding data length does not match its header')
+    
+    return np.frombuffer(data, dtype=_DTYPE, count=dim, offset=_HEADER.size)
+
+
+def stored_encoding(vector_data, legacy_encoding=None):
+    """
+    Return the encoding of a FaceEncoding row as a float32 array.
+    Falls back to the legacy JSON list for rows not yet migrated.
+    """
+    if vector_data is not None:
+        return unpack_encoding(vector_data)
+    return np.asarray(legacy_encoding, dtype=np.float32)
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from apps.students.face_compaction import compact_student_encodings
+from apps.students.models import Student
+
+
+class Command(BaseCommand):
+    help = 'Keeps at most N diverse face encodings per student and refreshes stored centroids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school-id', help='Only compact students of this school')
+        parser.add_argument(
+            '--max-per-student', type=int,
+            default=getattr(settings, 'FACE_MAX_ENCODINGS_PER_STUDENT', 5)
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report without deleting anything')
+
+    def handle(self, *args, **options):
+        max_count = options['max_per_student']
+        students = Student.objects.annotate(encoding_count=Count('face_encodings')).filter(
+            Q(encoding_count__gt=max_count) | Q(encoding_count__gt=0, face_centroid__isnull=True)
+        )
+        if options['school_id']:
+            students = students.filter(school_id=options['school_id'])
+
+        compacted = 0
+        removed = 0
+        for student in students.only('id', 'first_name', 'last_name').iterator():
+            count = compact_student_encodings(student.id, max_count=max_count, dry_run=options['dry_run'])
+            compacted += 1
+            removed += count
+            if count:
+                self.stdout.write(f'{student.first_name} {student.last_name}: {count} encodings removed')
+
+        action = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {removed} encodings across {compacted} students'
+        ))
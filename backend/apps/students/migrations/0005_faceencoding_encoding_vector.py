@@ -0,0 +1,69 @@
+# Generated by Django 5.0.14 on 2026-10-16 18:42
+
+import struct
+
+from django.db import migrations, models
+import numpy as np
+
+
+# Frozen copy of apps.students.face_vectors format version 1
+HEADER = struct.Struct('<2sBxI')
+
+
+def pack_json_encodings(apps, schema_editor):
+    FaceEncoding = apps.get_model('students', 'FaceEncoding')
+    batch = []
+    queryset = FaceEncoding.objects.filter(
+        encoding_vector__isnull=True,
+        encoding__isnull=False
+    ).only('id', 'encoding')
+    for face in queryset.iterator(chunk_size=500):
+        vector = np.asarray(face.encoding, dtype='<f4').reshape(-1)
+        face.encoding_vector = HEADER.pack(b'FE', 1, len(vector)) + vector.tobytes()
+        face.encoding = None
+        batch.append(face)
+        if len(batch) >= 500:
+            FaceEncoding.objects.bulk_update(batch, ['encoding_vector', 'encoding'])
+            batch = []
+    if batch:
+        FaceEncoding.objects.bulk_update(batch, ['encoding_vector', 'encoding'])
+
+
+def unpack_binary_encodings(apps, schema_editor):
+    FaceEncoding = apps.get_model('students', 'FaceEncoding')
+    batch = []
+    queryset = FaceEncoding.objects.filter(
+        encoding_vector__isnull=False
+    ).only('id', 'encoding_vector')
+    for face in queryset.iterator(chunk_size=500):
+        data = bytes(face.encoding_vector)
+        _, _, dim = HEADER.unpack_from(data)
+        face.encoding = np.frombuffer(data, dtype='<f4', count=dim, offset=HEADER.size).tolist()
+        face.encoding_vector = None
+        batch.append(face)
+        if len(batch) >= 500:
+            FaceEncoding.objects.bulk_update(batch, ['encoding_vector', 'encoding'])
+            batch = []
+    if batch:
+        FaceEncoding.objects.bulk_update(batch, ['encoding_vector', 'encoding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0004_parent_has_legal_restraining_order_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faceencoding',
+            name='encoding_vector',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='faceencoding',
+            name='encoding',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_json_encodings, unpack_binary_encodings),
+    ]
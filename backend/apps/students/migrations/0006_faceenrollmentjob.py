@@ -0,0 +1,85 @@
+# Generated by Django 5.0.14 on 2026-10-16 18:48
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0007_alter_school_code'),
+        ('students', '0005_faceencoding_encoding_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceEnrollmentJob',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                (
+                    'id',
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ('archive', models.FileField(upload_to='students/face_enrollment/')),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('pending', 'Pending'),
+                            ('processing', 'Processing'),
+                            ('completed', 'Completed'),
+                            ('failed', 'Failed'),
+                        ],
+                        default='pending',
+                        max_length=20,
+                    ),
+                ),
+                ('total_files', models.PositiveIntegerField(default=0)),
+                ('processed_files', models.PositiveIntegerField(default=0)),
+                ('enrolled_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                (
+                    'errors',
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text='[{file, admission_number, error}]',
+                    ),
+                ),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                (
+                    'created_by',
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name='face_enrollment_jobs',
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    'school',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='face_enrollment_jobs',
+                        to='schools.school',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Face Enrollment Job',
+                'verbose_name_plural': 'Face Enrollment Jobs',
+                'db_table': 'face_enrollment_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0006_faceenrollmentjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='face_centroid',
+            field=models.BinaryField(null=True),
+        ),
+    ]
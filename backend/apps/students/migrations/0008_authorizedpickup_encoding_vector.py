@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0007_student_face_centroid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorizedpickup',
+            name='encoding_vector',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -4,6 +4,7 @@ All models use UUID primary keys (via BaseModel) and link to School UUID.
 """
 from django.db import models
 from core.models import BaseModel
+from .face_vectors import pack_encoding, stored_encoding
 
 
 # ========== CHOICES ==========
@@ -116,6 +117,9 @@ class Student(BaseModel):
     # Photo
     photo = models.ImageField(upload_to='students/photos/', null=True, blank=True)
     
+    # Mean of the student's face encodings, packed float32 (see face_vectors)
+    face_centroid = models.BinaryField(null=True, editable=False)
+    
     # ========== SECTION 3: ADDRESS (DUAL) ==========
     # Current/Correspondence Address
     current_house_number = models.CharField(max_length=50, blank=True)
@@ -377,8 +381,11 @@ class FaceEncoding(BaseModel):
         related_name='face_encodings'
     )
     
-    # Face encoding as JSON (128-dimensional vector)
-    encoding = models.JSONField()
+    # Face encoding as packed float32 (see face_vectors.pack_encoding)
+    encoding_vector = models.BinaryField(null=True, editable=False)
+    
+    # Legacy JSON encoding (128 floats), kept only for unmigrated rows
+    encoding = models.JSONField(null=True, blank=True)
     
     # Original photo used for this encoding
     photo = models.ImageField(upload_to='students/face_photos/')
@@ -394,6 +401,69 @@ class FaceEncoding(BaseModel):
     
     def __str__(self):
         return f"Face encoding for {self.student.full_name}"
+    
+    @property
+    def vector(self):
+        """Return the encoding as a float32 numpy array."""
+        return stored_encoding(self.encoding_vector, self.encoding)
+    
+    def set_vector(self, encoding):
+        """Store an encoding (list or ndarray) in the binary column."""
+        self.encoding_vector = pack_encoding(encoding)
+        self.encoding = None
+
+
+class FaceEnrollmentJob(BaseModel):
+    """
+    Bulk face enrollment from an archive of photos keyed by admission number.
+    Processed in the background; progress and per-file errors are tracked here.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    school = models.ForeignKey(
+        'schools.School',
+        on_delete=models.CASCADE,
+        related_name='face_enrollment_jobs'
+    )
+    created_by = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='face_enrollment_jobs'
+    )
+    archive = models.FileField(upload_to='students/face_enrollment/')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    # Progress
+    total_files = models.PositiveIntegerField(default=0)
+    processed_files = models.PositiveIntegerField(default=0)
+    enrolled_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True, help_text='[{file, admission_number, error}]')
+    
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'face_enrollment_jobs'
+        verbose_name = 'Face Enrollment Job'
+        verbose_name_plural = 'Face Enrollment Jobs'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Face enrollment {self.status} ({self.processed_files}/{self.total_files})"
+    
+    @property
+    def progress(self):
+        """Return progress as a percentage."""
+        if not self.total_files:
+            return 100.0 if self.status == 'completed' else 0.0
+        return round(100.0 * self.processed_files / self.total_files, 1)
 
 
 # ========== SECTION 5: STUDENT HEALTH MODEL ==========
@@ -467,6 +537,9 @@ class AuthorizedPickup(BaseModel):
     secret_password = models.CharField(max_length=50, blank=True, help_text='Verbal verification password')
     is_active = models.BooleanField(default=True)
     
+    # Face encoding of `photo`, packed float32 (see face_vectors); computed once per photo
+    encoding_vector = models.BinaryField(null=True, editable=False)
+    
     class Meta:
         db_table = 'authorized_pickups'
         verbose_name = 'Authorized Pickup Person'
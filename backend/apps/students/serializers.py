@@ -3,7 +3,7 @@ Serializers for students app - Comprehensive Admission System.
 """
 from rest_framework import serializers
 from .models import (
-    Student, Parent, FaceEncoding, 
+    Student, Parent, FaceEncoding, FaceEnrollmentJob,
     StudentHealth, AuthorizedPickup, StudentDocument,
     BLOOD_GROUP_CHOICES, SOCIAL_CATEGORY_CHOICES, RELIGION_CHOICES,
     DISABILITY_TYPE_CHOICES, BOARD_CHOICES, MEDIUM_CHOICES,
@@ -40,15 +40,19 @@ class StudentHealthSerializer(serializers.ModelSerializer):
 
 class AuthorizedPickupSerializer(serializers.ModelSerializer):
     """Serializer for AuthorizedPickup model."""
+    has_face_encoding = serializers.SerializerMethodField()
     
     class Meta:
         model = AuthorizedPickup
         fields = [
             'id', 'student', 'name', 'relationship', 'phone',
-            'photo', 'secret_password', 'is_active',
+            'photo', 'secret_password', 'is_active', 'has_face_encoding',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def get_has_face_encoding(self, obj):
+        return obj.encoding_vector is not None
 
 
 class StudentDocumentSerializer(serializers.ModelSerializer):
@@ -88,6 +92,19 @@ class FaceEncodingSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'quality_score', 'created_at']
 
 
+class FaceEnrollmentJobSerializer(serializers.ModelSerializer):
+    """Serializer for bulk face enrollment job status."""
+    progress = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = FaceEnrollmentJob
+        fields = [
+            'id', 'school', 'status', 'progress', 'total_files', 'processed_files',
+            'enrolled_count', 'failed_count', 'errors', 'started_at', 'finished_at', 'created_at'
+        ]
+        read_only_fields = fields
+
+
 class ParentSerializer(serializers.ModelSerializer):
     """Serializer for Parent model."""
     user = UserSerializer(read_only=True)
@@ -0,0 +1,21 @@
+"""
+Celery tasks for students app.
+"""
+from celery import shared_task
+from celery.signals import worker_ready
+
+
+@shared_task(name='students.run_face_enrollment_job', ignore_result=True)
+def run_face_enrollment_job(job_id):
+    """Process a bulk face enrollment job (see face_enrollment)."""
+    from .face_enrollment import run_enrollment_job
+
+    run_enrollment_job(job_id)
+
+
+@worker_ready.connect
+def fail_orphaned_enrollment_jobs(**kwargs):
+    """Jobs left processing by a worker that went away are marked failed."""
+    from .face_enrollment import fail_stale_jobs
+
+    fail_stale_jobs()
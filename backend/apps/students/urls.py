@@ -7,6 +7,8 @@ from .views import (
     StudentDetailView,
     StudentParentsView,
     StudentFaceEncodingsView,
+    FaceEnrollmentJobListCreateView,
+    FaceEnrollmentJobDetailView,
     ParentChildrenView,
     ParentListView,
     ConductorStudentListView,
@@ -40,6 +42,8 @@ urlpatterns = [
     
     # Face encodings
     path('<uuid:pk>/faces/', StudentFaceEncodingsView.as_view(), name='student-faces'),
+    path('faces/bulk/', FaceEnrollmentJobListCreateView.as_view(), name='face-enrollment-jobs'),
+    path('faces/bulk/<uuid:pk>/', FaceEnrollmentJobDetailView.as_view(), name='face-enrollment-job-detail'),
     
     # Health records
     path('<uuid:pk>/health/', StudentHealthView.as_view(), name='student-health'),
@@ -8,7 +8,7 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.db.models import Q
 from django.utils import timezone
 
-from .models import Student, Parent, FaceEncoding, StudentHealth, AuthorizedPickup, StudentDocument
+from .models import Student, Parent, FaceEncoding, FaceEnrollmentJob, StudentHealth, AuthorizedPickup, StudentDocument
 from .serializers import (
     StudentSerializer,
     StudentListSerializer,
@@ -17,6 +17,7 @@ from .serializers import (
     ParentListSerializer,
     AddParentSerializer,
     FaceEncodingSerializer,
+    FaceEnrollmentJobSerializer,
     ParentChildrenSerializer,
     # New comprehensive serializers
     StudentHealthSerializer,
@@ -203,7 +204,10 @@ class StudentFaceEncodingsView(generics.ListCreateAPIView):
     
     def create(self, request, *args, **kwargs):
         """Upload photo and generate face encoding."""
+        from apps.attendance.admission import FacePriority, face_request
         from apps.attendance.face_recognition import generate_face_encoding
+        from apps.attendance.imaging import parse_face_box
+        from .face_compaction import compact_student_encodings, is_near_duplicate, student_vectors
         
         student_id = self.kwargs['pk']
         
@@ -222,8 +226,19 @@ class StudentFaceEncodingsView(generics.ListCreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        face_box = request.data.get('face_box')
+        if face_box:
+            try:
+                face_box = parse_face_box(face_box)
+            except ValueError as e:
+                return Response(
+                    {'error': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
         # Generate face encoding
-        result = generate_face_encoding(photo)
+        with face_request(FacePriority.ENROLL, student.school_id):
+            result = generate_face_encoding(photo, face_box=face_box or None)
         
         if not result['success']:
             return Response(
@@ -231,13 +246,21 @@ class StudentFaceEncodingsView(generics.ListCreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Reject photos that add nothing over the encodings already stored
+        existing = student_vectors(student.id)
+        if is_near_duplicate(result['encoding'], existing):
+            return Response(
+                {'error': 'This photo is too similar to an existing face photo of the student'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Check if this is the first encoding
-        is_primary = not FaceEncoding.objects.filter(student=student).exists()
+        is_primary = not existing
         
         # Create face encoding record
         face_encoding = FaceEncoding.objects.create(
             student=student,
-            encoding=result['encoding'],
+            encoding_vector=result['encoding_bytes'],
             photo=photo,
             is_primary=is_primary,
             quality_score=result['confidence']
@@ -251,12 +274,129 @@ class StudentFaceEncodingsView(generics.ListCreateAPIView):
             student.photo = photo
             student.save(update_fields=['photo'])
         
+        # Keep at most FACE_MAX_ENCODINGS_PER_STUDENT diverse encodings
+        compact_student_encodings(student.id, keep_ids=[face_encoding.id])
+        
         return Response(
             FaceEncodingSerializer(face_encoding).data,
             status=status.HTTP_201_CREATED
         )
 
 
+class FaceEnrollmentJobListCreateView(generics.ListCreateAPIView):
+    """
+    Start a bulk face enrollment or list previous jobs.
+    
+    POST accepts either `archive` (a zip of photos) or several `photos`.
+    Photos are matched by admission number: `ADM123.jpg` or `ADM123/*.jpg`.
+    The job runs on a Celery worker; poll the detail endpoint for progress.
+    """
+    serializer_class = FaceEnrollmentJobSerializer
+    permission_classes = [IsStaff]
+    parser_classes = [MultiPartParser, FormParser]
+    
+    def _school_ids(self):
+        user = self.request.user
+        if user.role == UserRole.ROOT_ADMIN:
+            return None
+        return set(SchoolMembership.objects.filter(
+            user=user,
+            is_active=True
+        ).values_list('school_id', flat=True))
+    
+    def get_queryset(self):
+        queryset = FaceEnrollmentJob.objects.select_related('school')
+        school_ids = self._school_ids()
+        if school_ids is not None:
+            queryset = queryset.filter(school_id__in=school_ids)
+        
+        school_id = self.request.query_params.get('school_id')
+        if school_id:
+            queryset = queryset.filter(school_id=school_id)
+        return queryset
+    
+    def list(self, request, *args, **kwargs):
+        from .face_enrollment import fail_stale_jobs
+        
+        # Surface jobs orphaned by a lost worker instead of showing them processing forever
+        fail_stale_jobs()
+        return super().list(request, *args, **kwargs)
+    
+    def create(self, request, *args, **kwargs):
+        import zipfile
+        from django.core.exceptions import ValidationError
+        from apps.schools.models import School
+        from .face_enrollment import build_archive, start_enrollment_job
+        
+        school_id = request.data.get('school_id')
+        if not school_id:
+            return Response(
+                {'error': 'school_id is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            school = School.objects.get(pk=school_id)
+        except (School.DoesNotExist, ValidationError):
+            return Response(
+                {'error': 'School not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        school_ids = self._school_ids()
+        if school_ids is not None and school.id not in school_ids:
+            return Response(
+                {'error': 'You do not have access to this school'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        archive = request.FILES.get('archive')
+        photos = request.FILES.getlist('photos')
+        if archive:
+            if not zipfile.is_zipfile(archive):
+                return Response(
+                    {'error': 'archive must be a zip file'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            archive.seek(0)
+        elif photos:
+            archive = build_archive(photos)
+        else:
+            return Response(
+                {'error': 'Upload an archive or one or more photos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job = FaceEnrollmentJob.objects.create(
+            school=school,
+            created_by=request.user,
+            archive=archive
+        )
+        start_enrollment_job(job)
+        
+        return Response(
+            FaceEnrollmentJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class FaceEnrollmentJobDetailView(generics.RetrieveAPIView):
+    """Progress and per-file errors of a bulk face enrollment job."""
+    serializer_class = FaceEnrollmentJobSerializer
+    permission_classes = [IsStaff]
+    
+    def get_queryset(self):
+        user = self.request.user
+        queryset = FaceEnrollmentJob.objects.all()
+        if user.role != UserRole.ROOT_ADMIN:
+            school_ids = SchoolMembership.objects.filter(
+                user=user,
+                is_active=True
+            ).values_list('school_id', flat=True)
+            queryset = queryset.filter(school_id__in=school_ids)
+        return queryset
+
+
 class ParentChildrenView(generics.ListAPIView):
     """List children for the logged-in parent."""
     serializer_class = ParentChildrenSerializer
@@ -335,7 +475,11 @@ class StudentIdentifyView(APIView):
     parser_classes = [MultiPartParser, FormParser]
     
     def post(self, request, *args, **kwargs):
+        import uuid
+        from apps.attendance.admission import FacePriority, face_request
         from apps.attendance.face_recognition import match_face
+        from apps.attendance.face_index import get_school_indexes
+        from apps.attendance.imaging import parse_face_box
         
         photo = request.FILES.get('photo')
         if not photo:
@@ -343,18 +487,60 @@ class StudentIdentifyView(APIView):
                 {'error': 'Photo is required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
-        # Get all student encodings
-        encodings = list(FaceEncoding.objects.values('student_id', 'encoding'))
         
-        if not encodings:
+        face_box = request.data.get('face_box')
+        if face_box:
+            try:
+                face_box = parse_face_box(face_box)
+            except ValueError as e:
+                return Response(
+                    {'error': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # Scope identification to the caller's schools
+        user = request.user
+        school_id = request.data.get('school_id')
+        if school_id:
+            try:
+                school_id = str(uuid.UUID(str(school_id)))
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid school_id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        if user.role == UserRole.ROOT_ADMIN:
+            if school_id:
+                school_ids = [school_id]
+            else:
+                school_ids = list(FaceEncoding.objects.values_list(
+                    'student__school_id', flat=True
+                ).distinct())
+        else:
+            school_ids = [str(pk) for pk in SchoolMembership.objects.filter(
+                user=user,
+                is_active=True
+            ).values_list('school_id', flat=True)]
+            if school_id:
+                if school_id not in school_ids:
+                    return Response(
+                        {'error': 'Access denied'},
+                        status=status.HTTP_403_FORBIDDEN
+                    )
+                school_ids = [school_id]
+        
+        # Per-school approximate nearest-neighbour indexes
+        gallery = get_school_indexes(school_ids)
+        
+        if not len(gallery):
             return Response(
                 {'error': 'No registered faces found'},
                 status=status.HTTP_404_NOT_FOUND
             )
             
         # Match face
-        result = match_face(photo, encodings)
+        with face_request(FacePriority.IDENTIFY, school_ids[0] if len(school_ids) == 1 else None):
+            result = match_face(photo, gallery, face_box=face_box or None)
         
         if not result['success']:
             return Response(
@@ -374,7 +560,12 @@ class StudentIdentifyView(APIView):
                     'section': student.section,
                     'photo': request.build_absolute_uri(student.photo.url) if student.photo else None
                 },
-                'confidence': result['confidence']
+                'confidence': result['confidence'],
+                'ambiguous': result['ambiguous'],
+                'candidates': [
+                    {'id': candidate['student_id'], 'confidence': candidate['confidence']}
+                    for candidate in result['candidates']
+                ]
             })
             
         return Response(
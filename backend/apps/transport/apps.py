@@ -8,3 +8,6 @@ class TransportConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.transport'
     verbose_name = 'Transport'
+
+    def ready(self):
+        import apps.transport.signals
@@ -1,8 +1,10 @@
 """
 WebSocket consumers for real-time updates.
 """
+import asyncio
 import json
 import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.serializers.json import DjangoJSONEncoder
@@ -115,8 +117,10 @@ class TripTrackingConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_trip_data(self):
         """Get current trip data."""
+        from .geometry import get_route_geometry
         from .models import Trip, TripStatus
-        from .serializers import TripSerializer, LocationUpdateSerializer
+        from .positions import get_position
+        from .serializers import TripSerializer
         from django.core.exceptions import ValidationError
         
         try:
@@ -128,40 +132,20 @@ class TripTrackingConsumer(AsyncWebsocketConsumer):
                 'bus', 'route', 'driver', 'conductor'
             ).get(pk=self.trip_id)
             
-            latest_location = trip.location_updates.first()
+            latest_location = get_position(trip.id)
 
-            # Calculate nearest stop if location exists
+            # Next stop along the route, from the last known position
             next_stop_data = None
-            if latest_location and trip.route:
-                 from math import radians, cos, sin, asin, sqrt
-                 def haversine(lon1, lat1, lon2, lat2):
-                    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-                    dlon = lon2 - lon1
-                    dlat = lat2 - lat1
-                    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                    c = 2 * asin(sqrt(a))
-                    return c * 6371
-
-                 min_dist = float('inf')
-                 bus_lat = float(latest_location.latitude)
-                 bus_lng = float(latest_location.longitude)
-
-                 for stop in trip.route.stops.all():
-                    dist = haversine(bus_lng, bus_lat, float(stop.longitude), float(stop.latitude))
-                    if dist < min_dist:
-                        min_dist = dist
-                        next_stop_data = {
-                            'id': stop.id,
-                            'name': stop.name,
-                            'sequence': stop.sequence,
-                            'distance_km': round(dist, 2),
-                            'eta_mins': round((dist / 30) * 60)
-                        }
+            geometry = get_route_geometry(trip.route)
+            if latest_location and geometry is not None:
+                next_stop_data = geometry.next_stop(
+                    latest_location['location']['latitude'],
+                    latest_location['location']['longitude']
+                )
             
             latest_location_data = None
             if latest_location:
-                latest_location_data = LocationUpdateSerializer(latest_location).data
-                latest_location_data['next_stop'] = next_stop_data
+                latest_location_data = dict(latest_location, next_stop=next_stop_data)
 
             return {
                 'trip': TripSerializer(trip).data,
@@ -181,12 +165,20 @@ class TripTrackingConsumer(AsyncWebsocketConsumer):
 class BusLocationConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for conductor/driver to send location updates.
+    
+    The bus's active trip, its route geometry and its progress along the
+    stops are cached on the connection, so a fix is broadcast without
+    touching the database; the fix itself is written behind by the
+    location buffer (see location_buffer).
     """
     
     async def connect(self):
         """Handle WebSocket connection."""
         self.bus_id = self.scope['url_route']['kwargs']['bus_id']
         self.room_group_name = f'bus_{self.bus_id}'
+        self.trip = None
+        self.trip_checked_at = 0.0
+        self.trip_refresh = None
         
         user = self.scope.get('user')
         if not user or not user.is_authenticated:
@@ -204,6 +196,7 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await self.refresh_trip()
     
     async def disconnect(self, close_code):
         """Handle disconnection."""
@@ -224,25 +217,60 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
         except json.JSONDecodeError:
             pass
     
+    async def trip_status(self, event):
+        """A trip of this bus started or ended: reload the active trip."""
+        await self.refresh_trip()
+    
+    async def refresh_trip(self):
+        trip = await self.load_active_trip()
+        previous = self.trip
+        if trip and previous and trip['id'] == previous['id'] and trip['geometry'] is previous['geometry']:
+            # Same trip on the same route version: keep its progress
+            trip['progress'] = previous['progress']
+        self.trip = trip
+        self.trip_checked_at = time.monotonic()
+    
+    def schedule_trip_refresh(self):
+        """Re-check the active trip in the background once the cached answer is old."""
+        from django.conf import settings
+        
+        interval = getattr(settings, 'LOCATION_TRIP_REFRESH_INTERVAL', 30)
+        if self.trip is None:
+            # No trip yet: look again sooner so the first fixes of a trip are kept
+            interval = min(interval, 5)
+        if time.monotonic() - self.trip_checked_at < interval:
+            return
+        if self.trip_refresh is None or self.trip_refresh.done():
+            self.trip_refresh = asyncio.ensure_future(self.refresh_trip())
+    
     @database_sync_to_async
-    def save_and_broadcast_location(self, data):
-        """Save location update and broadcast to subscribers."""
-        from .models import Trip, LocationUpdate, TripStatus
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
+    def load_active_trip(self):
+        """Active trip of this bus with its route geometry, or None."""
+        from .geometry import TripProgress, get_route_geometry
+        from .models import Trip, TripStatus
         
-        # Find active trip for this bus
         trip = Trip.objects.filter(
             bus_id=self.bus_id,
             status=TripStatus.IN_PROGRESS
-        ).first()
-        
+        ).select_related('route').first()
         if not trip:
-            return
+            return None
+        
+        return {
+            'id': trip.id,
+            'route_id': trip.route_id,
+            'geometry': get_route_geometry(trip.route),
+            'progress': TripProgress(),
+        }
+    
+    @database_sync_to_async
+    def save_location(self, trip, data):
+        """Write one fix immediately (LOCATION_WRITE_BEHIND off)."""
+        from .models import LocationUpdate
+        from .positions import record_position
         
-        # Create location update
         location = LocationUpdate.objects.create(
-            trip=trip,
+            trip_id=trip['id'],
             bus_id=self.bus_id,
             latitude=data.get('latitude'),
             longitude=data.get('longitude'),
@@ -250,57 +278,59 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
             heading=data.get('heading'),
             accuracy=data.get('accuracy'),
         )
+        record_position(location)
+        return {
+            'latitude': location.latitude,
+            'longitude': location.longitude,
+            'speed': location.speed,
+            'heading': location.heading,
+            'recorded_at': location.created_at,
+        }
+    
+    async def save_and_broadcast_location(self, data):
+        """Queue the location for writing and broadcast it to subscribers."""
+        from .location_buffer import get_location_buffer
+        from .positions import record_position
         
-        # Broadcast to trip subscribers
-        channel_layer = get_channel_layer()
-
-        # Calculate nearest stop
-        from math import radians, cos, sin, asin, sqrt
-        def haversine(lon1, lat1, lon2, lat2):
-            # Convert decimal degrees to radians
-            lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-            # Haversine formula
-            dlon = lon2 - lon1
-            dlat = lat2 - lat1
-            a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-            c = 2 * asin(sqrt(a))
-            r = 6371 # Radius of earth in kilometers
-            return c * r
-
-        next_stop_data = None
-        min_dist = float('inf')
+        self.schedule_trip_refresh()
+        trip = self.trip
+        if not trip:
+            return
         
-        bus_lat = float(location.latitude)
-        bus_lng = float(location.longitude)
+        buffer = get_location_buffer()
+        if buffer is not None:
+            location = buffer.add(trip['id'], self.bus_id, data)
+            if location is None:
+                return
+            # Last known position is stored off the event loop (it may go to Redis)
+            asyncio.get_running_loop().run_in_executor(None, record_position, location)
+        else:
+            location = await self.save_location(trip, data)
 
-        # Get all stops for the route
-        if trip.route:
-            stops = trip.route.stops.all()
-            for stop in stops:
-                dist = haversine(bus_lng, bus_lat, float(stop.longitude), float(stop.latitude))
-                if dist < min_dist:
-                    min_dist = dist
-                    next_stop_data = {
-                        'id': stop.id,
-                        'name': stop.name,
-                        'sequence': stop.sequence,
-                        'distance_km': round(dist, 2),
-                        'eta_mins': round((dist / 30) * 60) # Rough estimate assuming 30km/h average speed in city
-                    }
+        bus_lat = float(location['latitude'])
+        bus_lng = float(location['longitude'])
+        
+        # Along-route distance and ETA to the stops ahead; progress is kept with the trip
+        upcoming_stops = []
+        if trip['geometry'] is not None:
+            upcoming_stops = trip['geometry'].upcoming_stops(
+                bus_lat, bus_lng, trip['progress'], location['recorded_at'].timestamp()
+            )
 
         broadcast_data = {
-            'trip_id': str(trip.id),
+            'trip_id': str(trip['id']),
             'bus_id': str(self.bus_id),
-            'latitude': float(location.latitude),
-            'longitude': float(location.longitude),
-            'speed': location.speed,
-            'heading': location.heading,
-            'timestamp': location.created_at.isoformat(),
-            'next_stop': next_stop_data # Include calculated next stop info
+            'latitude': bus_lat,
+            'longitude': bus_lng,
+            'speed': location['speed'],
+            'heading': location['heading'],
+            'timestamp': location['recorded_at'].isoformat(),
+            'next_stop': upcoming_stops[0] if upcoming_stops else None,
+            'upcoming_stops': upcoming_stops,
         }
 
-        async_to_sync(channel_layer.group_send)(
-            f"trip_{trip.id}",
+        await self.channel_layer.group_send(
+            f"trip_{trip['id']}",
             {
                 'type': 'location_update',
                 'data': broadcast_data
@@ -308,7 +338,7 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
         )
         
         # Also broadcast to bus profile subscribers
-        async_to_sync(channel_layer.group_send)(
+        await self.channel_layer.group_send(
             f"bus_profile_{self.bus_id}",
             {
                 'type': 'location_update',
@@ -410,8 +440,9 @@ class BusProfileConsumer(AsyncWebsocketConsumer):
                 'students': [],
             }
         
-        # Get latest location
-        latest_loc = active_trip.location_updates.first()
+        # Get last known position
+        from .positions import get_position
+        latest_loc = get_position(active_trip.id)
         
         # Get students on trip with attendance status
         attendances = Attendance.objects.filter(trip=active_trip).select_related('student')
@@ -439,11 +470,11 @@ class BusProfileConsumer(AsyncWebsocketConsumer):
                 'students_dropped': active_trip.students_dropped,
             },
             'location': {
-                'latitude': float(latest_loc.latitude),
-                'longitude': float(latest_loc.longitude),
-                'speed': latest_loc.speed,
-                'heading': latest_loc.heading,
-                'timestamp': latest_loc.created_at.isoformat(),
+                'latitude': latest_loc['location']['latitude'],
+                'longitude': latest_loc['location']['longitude'],
+                'speed': latest_loc['speed'],
+                'heading': latest_loc['heading'],
+                'timestamp': latest_loc['created_at'],
             } if latest_loc else None,
             'students': students_data,
         }
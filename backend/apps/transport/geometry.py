@@ -0,0 +1,285 @@
+"""
+Route geometry for locating buses along their routes.
+
+Each route is loaded once into NumPy arrays and cached per process, keyed
+by route id and the route's `updated_at`; stop changes touch the route
+(see signals), so an edited route is reloaded on its next use. The route
+path is its decoded `route_polyline` (straight lines between the stops
+when it has none), with the cumulative distance at every vertex and the
+along-path offset of every active stop.
+
+Each fix is projected onto the path, searching forward from the bus's
+last offset, so locating a bus is a few vectorized operations with no
+database access:
+
+- A stop counts as reached once the bus is within LOCATION_STOP_ARRIVAL_KM
+  of its offset; the next stop follows the stop sequence, and progress
+  never goes backwards for callers that keep a TripProgress between fixes.
+- Remaining distance to every downstream stop is the along-path distance
+  (straight-line distance while the bus is more than
+  LOCATION_ROUTE_CORRIDOR_KM off the path).
+- ETAs use the bus's recent along-route speed, blended with the default
+  city speed by LOCATION_ETA_SPEED_WEIGHT.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .utils import calculate_distances
+
+EARTH_RADIUS_KM = 6371
+# Rough estimate assuming 30km/h average speed in city
+AVERAGE_SPEED_KMH = 30
+
+
+def decode_polyline(encoded, precision=5):
+    """Decode a Google Maps encoded polyline into (latitude, longitude) pairs."""
+    points = []
+    index = latitude = longitude = 0
+    factor = 10 ** precision
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= length:
+                    raise ValueError('Truncated polyline')
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        latitude += deltas[0]
+        longitude += deltas[1]
+        points.append((latitude / factor, longitude / factor))
+    return points
+
+
+class TripProgress:
+    """Where a bus is along its route, kept by the caller between fixes of a trip."""
+
+    __slots__ = ('reached', 'segment', 'offset', 'timestamp', 'speed_kmh')
+
+    def __init__(self):
+        # Index of the last stop reached (-1 for none)
+        self.reached = -1
+        self.segment = 0
+        self.offset = 0.0
+        self.timestamp = None
+        self.speed_kmh = None
+
+
+class RouteGeometry:
+    """A route's path and stops as arrays, in sequence order."""
+
+    def __init__(self, stops, polyline=''):
+        """
+        Args:
+            stops: (id, name, sequence, latitude, longitude) tuples, in sequence order
+            polyline: Encoded route polyline; the stops are joined by straight lines without one
+        """
+        self.stops = [
+            {'id': str(stop_id), 'name': name, 'sequence': sequence}
+            for stop_id, name, sequence, _, _ in stops
+        ]
+        self.latitudes = np.array([float(stop[3]) for stop in stops], dtype=np.float64)
+        self.longitudes = np.array([float(stop[4]) for stop in stops], dtype=np.float64)
+
+        self.arrival_km = getattr(settings, 'LOCATION_STOP_ARRIVAL_KM', 0.05)
+        self.corridor_km = getattr(settings, 'LOCATION_ROUTE_CORRIDOR_KM', 0.3)
+        self.lookahead_km = getattr(settings, 'LOCATION_ROUTE_LOOKAHEAD_KM', 2.0)
+        self.speed_weight = getattr(settings, 'LOCATION_ETA_SPEED_WEIGHT', 0.6)
+        self.min_speed_kmh = getattr(settings, 'LOCATION_ETA_MIN_SPEED_KMH', 5)
+
+        path = []
+        if polyline:
+            try:
+                path = decode_polyline(polyline)
+            except (ValueError, IndexError):
+                path = []
+        if len(path) < 2:
+            path = list(zip(self.latitudes, self.longitudes))
+        path = np.array(path, dtype=np.float64).reshape(-1, 2)
+
+        # Local flat projection (km); fine at city scale
+        mean_latitude = float(path[:, 0].mean()) if len(path) else 0.0
+        self._x_scale = math.radians(EARTH_RADIUS_KM) * math.cos(math.radians(mean_latitude))
+        self._y_scale = math.radians(EARTH_RADIUS_KM)
+        self.path_x = path[:, 1] * self._x_scale
+        self.path_y = path[:, 0] * self._y_scale
+        self.segment_x = np.diff(self.path_x)
+        self.segment_y = np.diff(self.path_y)
+        self.segment_length = np.hypot(self.segment_x, self.segment_y)
+        self.segment_length_sq = np.maximum(self.segment_length ** 2, 1e-12)
+        # Distance along the path at each vertex
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.segment_length)))
+
+        # Stops in sequence order, each projected no earlier than the previous one
+        self.stop_offsets = np.zeros(len(self.stops), dtype=np.float64)
+        segment = 0
+        for index in range(len(self.stops)):
+            if len(self.segment_x):
+                segment, self.stop_offsets[index], _ = self._project(
+                    self.longitudes[index] * self._x_scale, self.latitudes[index] * self._y_scale,
+                    segment, len(self.segment_x)
+                )
+        self.stop_offsets = np.maximum.accumulate(self.stop_offsets) if len(self.stops) else self.stop_offsets
+
+    def __len__(self):
+        return len(self.stops)
+
+    def _project(self, x, y, start, end):
+        """Closest point on segments [start, end): (segment, path offset, distance off the path)."""
+        segment_x = self.segment_x[start:end]
+        segment_y = self.segment_y[start:end]
+        dx = x - self.path_x[start:end]
+        dy = y - self.path_y[start:end]
+        t = np.clip((dx * segment_x + dy * segment_y) / self.segment_length_sq[start:end], 0.0, 1.0)
+        off_path = np.hypot(dx - t * segment_x, dy - t * segment_y)
+        closest = int(off_path.argmin())
+        segment = start + closest
+        offset = self.cumulative[segment] + t[closest] * self.segment_length[segment]
+        return segment, float(offset), float(off_path[closest])
+
+    def locate(self, latitude, longitude, progress):
+        """
+        Project a fix onto the path and update `progress`.
+
+        Returns:
+            bool: True if the bus is on the path (within LOCATION_ROUTE_CORRIDOR_KM)
+        """
+        if not len(self.segment_x):
+            return False
+
+        x = longitude * self._x_scale
+        y = latitude * self._y_scale
+        segments = len(self.segment_x)
+        # The stretch just ahead of the bus first, so overlapping parts of a route do not skip ahead
+        end = int(np.searchsorted(self.cumulative, progress.offset + self.lookahead_km, side='right'))
+        segment, offset, off_path = self._project(x, y, progress.segment, min(max(end, progress.segment + 1), segments))
+        if off_path > self.corridor_km and end < segments:
+            segment, offset, off_path = self._project(x, y, progress.segment, segments)
+        if off_path > self.corridor_km:
+            return False
+
+        # GPS jitter may project slightly behind the last position
+        if offset >= progress.offset:
+            progress.segment = segment
+            progress.offset = offset
+        # A bus waiting before the start of the path projects onto it without being there
+        if progress.offset > 0 or off_path <= self.arrival_km:
+            reached = int(np.searchsorted(self.stop_offsets, progress.offset + self.arrival_km, side='right')) - 1
+            progress.reached = max(progress.reached, reached)
+        return True
+
+    def _update_speed(self, progress, previous_offset, timestamp):
+        """Fold the along-route speed since the previous fix into the trip's recent speed."""
+        if timestamp is None:
+            return
+        if progress.timestamp is not None:
+            elapsed = timestamp - progress.timestamp
+            if 0 < elapsed <= getattr(settings, 'LOCATION_ETA_SPEED_WINDOW', 120):
+                speed = (progress.offset - previous_offset) / elapsed * 3600
+                # A jump beyond any bus speed is a GPS glitch
+                if speed <= 120:
+                    if progress.speed_kmh is None:
+                        progress.speed_kmh = speed
+                    else:
+                        progress.speed_kmh += 0.3 * (speed - progress.speed_kmh)
+        progress.timestamp = timestamp
+
+    def eta_speed(self, progress):
+        """Speed (km/h) for ETAs: recent speed blended with the default city speed."""
+        if progress.speed_kmh is None:
+            return AVERAGE_SPEED_KMH
+        recent = max(progress.speed_kmh, self.min_speed_kmh)
+        return self.speed_weight * recent + (1 - self.speed_weight) * AVERAGE_SPEED_KMH
+
+    def upcoming_stops(self, latitude, longitude, progress=None, timestamp=None):
+        """
+        Remaining distance and ETA to every stop after the last one reached.
+
+        Args:
+            latitude, longitude: Position of the bus
+            progress: The trip's TripProgress, updated in place; None to
+                infer progress from this fix alone
+            timestamp: Time of the fix (epoch seconds), for the recent speed
+
+        Returns:
+            list: downstream stop dicts with distance_km and eta_mins, next stop first
+        """
+        if not len(self.stops):
+            return []
+        if progress is None:
+            progress = TripProgress()
+
+        previous_offset = progress.offset
+        on_path = self.locate(latitude, longitude, progress)
+        downstream = slice(progress.reached + 1, None)
+        if on_path:
+            self._update_speed(progress, previous_offset, timestamp)
+            remaining = np.maximum(self.stop_offsets[downstream] - progress.offset, 0.0)
+        else:
+            remaining = calculate_distances(
+                latitude, longitude, self.latitudes[downstream], self.longitudes[downstream]
+            )
+
+        minutes = remaining / self.eta_speed(progress) * 60
+        return [
+            {**stop, 'distance_km': round(distance, 2), 'eta_mins': round(eta)}
+            for stop, distance, eta in zip(self.stops[downstream], remaining.tolist(), minutes.tolist())
+        ]
+
+    def next_stop(self, latitude, longitude, progress=None, timestamp=None):
+        """Next stop of a bus along the route with its distance and ETA, or None at the end."""
+        upcoming = self.upcoming_stops(latitude, longitude, progress, timestamp)
+        return upcoming[0] if upcoming else None
+
+
+def load_route_geometry(route):
+    from .models import Stop
+
+    stops = Stop.objects.filter(route_id=route.pk, is_active=True).order_by('sequence').values_list(
+        'id', 'name', 'sequence', 'latitude', 'longitude'
+    )
+    return RouteGeometry(list(stops), route.route_polyline)
+
+
+_geometries = OrderedDict()
+_geometries_lock = threading.Lock()
+
+
+def get_route_geometry(route):
+    """
+    Cached geometry of a route.
+
+    Args:
+        route: Route instance; its id and updated_at select the cached version
+
+    Returns:
+        RouteGeometry, or None without a route
+    """
+    if route is None:
+        return None
+
+    with _geometries_lock:
+        entry = _geometries.get(route.pk)
+        if entry is not None and entry[0] == route.updated_at:
+            _geometries.move_to_end(route.pk)
+            return entry[1]
+
+    geometry = load_route_geometry(route)
+
+    with _geometries_lock:
+        _geometries[route.pk] = (route.updated_at, geometry)
+        _geometries.move_to_end(route.pk)
+        while len(_geometries) > getattr(settings, 'LOCATION_ROUTE_CACHE_SIZE', 1024):
+            _geometries.popitem(last=False)
+
+    return geometry
@@ -0,0 +1,305 @@
+"""
+Write-behind buffer for bus GPS fixes received over WebSocket.
+
+BusLocationConsumer broadcasts each fix straight from memory and hands it
+to this buffer; a background thread writes the accumulated fixes with one
+bulk_create when LOCATION_BUFFER_FLUSH_SIZE fixes are waiting or every
+LOCATION_BUFFER_FLUSH_INTERVAL seconds. A batch refused by a constraint
+(e.g. its trip was deleted) is split in halves until only the offending
+fixes are left, and those are dropped. Any other failure keeps the unwritten
+fixes for the next attempt, up to LOCATION_BUFFER_MAX_SIZE (oldest dropped
+first).
+
+On interpreter shutdown the buffer is flushed once more, and whatever
+cannot be written is spilled to a JSON-lines file in
+LOCATION_BUFFER_SPILL_DIR. Spill files are loaded back into the buffer
+when a process next starts one. The buffer is per process.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_PLACES = Decimal('0.0000001')
+
+
+def _coordinate(value, limit):
+    """Decimal coordinate with LocationUpdate's precision, or None if invalid."""
+    try:
+        number = Decimal(str(value)).quantize(COORDINATE_PLACES)
+    except (ArithmeticError, TypeError, ValueError):
+        return None
+    return number if number.is_finite() and abs(number) <= limit else None
+
+
+def _optional_float(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LocationBuffer:
+    """Per-process write-behind queue of LocationUpdate rows."""
+
+    def __init__(self, flush_size, flush_interval, max_size, spill_dir):
+        from apps.attendance.metrics import LatencyRecorder
+
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.spill_dir = str(spill_dir) if spill_dir else ''
+        self.flush_latency = LatencyRecorder(getattr(settings, 'LOCATION_BUFFER_LATENCY_SAMPLES', 500))
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._counters = {
+            'buffered': 0, 'written': 0, 'flushes': 0, 'failed_flushes': 0,
+            'dropped': 0, 'rejected': 0, 'spilled': 0, 'recovered': 0,
+        }
+        self._max_depth = 0
+
+    def start(self):
+        """Load spilled fixes and start the flush thread."""
+        self._recover_spills()
+        self._thread = threading.Thread(target=self._run, name='location-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def add(self, trip_id, bus_id, data):
+        """
+        Queue one fix from a device message.
+
+        Returns:
+            dict: the stored fields (with 'recorded_at'), or None when the
+            message has no valid latitude/longitude
+        """
+        latitude = _coordinate(data.get('latitude'), 90)
+        longitude = _coordinate(data.get('longitude'), 180)
+        if latitude is None or longitude is None:
+            return None
+
+        fix = {
+            'id': uuid.uuid4(),
+            'trip_id': trip_id,
+            'bus_id': bus_id,
+            'latitude': latitude,
+            'longitude': longitude,
+            'speed': _optional_float(data.get('speed')),
+            'heading': _optional_float(data.get('heading')),
+            'accuracy': _optional_float(data.get('accuracy')),
+            'recorded_at': timezone.now(),
+        }
+        self._append([fix])
+        return fix
+
+    def _append(self, fixes, front=False):
+        with self._lock:
+            if front:
+                self._pending.extendleft(reversed(fixes))
+            else:
+                self._pending.extend(fixes)
+                self._counters['buffered'] += len(fixes)
+            overflow = len(self._pending) - self.max_size
+            for _ in range(max(overflow, 0)):
+                self._pending.popleft()
+            if overflow > 0:
+                self._counters['dropped'] += overflow
+                logger.warning(f"Location buffer full: dropped {overflow} oldest fixes")
+            depth = len(self._pending)
+            self._max_depth = max(self._max_depth, depth)
+        if depth >= self.flush_size:
+            self._wakeup.set()
+
+    def _take(self):
+        with self._lock:
+            fixes = list(self._pending)
+            self._pending.clear()
+        return fixes
+
+    def _write(self, fixes):
+        """
+        Write fixes in one transaction per batch, halving batches refused by a
+        constraint until each offending fix is rejected on its own.
+
+        Returns:
+            tuple: (written, rejected); on any other error the unwritten fixes
+            are put back at the front of the buffer before it is re-raised
+        """
+        from .models import LocationUpdate
+
+        batch_size = getattr(settings, 'LOCATION_BUFFER_BATCH_SIZE', 500)
+        written = rejected = 0
+        # Stack of batches, oldest on top
+        batches = [fixes]
+        while batches:
+            batch = batches.pop()
+            try:
+                with transaction.atomic():
+                    LocationUpdate.objects.bulk_create(
+                        [LocationUpdate(**fix) for fix in batch],
+                        batch_size=batch_size
+                    )
+                written += len(batch)
+            except (IntegrityError, DataError) as e:
+                if len(batch) > 1:
+                    middle = len(batch) // 2
+                    batches.extend((batch[middle:], batch[:middle]))
+                    continue
+                rejected += 1
+                logger.warning(
+                    f"Dropped bus location {batch[0]['id']} of trip {batch[0]['trip_id']}: {str(e)}"
+                )
+            except Exception:
+                # Keep them, ahead of newer fixes, for the next flush
+                self._append(batch + [fix for rest in reversed(batches) for fix in rest], front=True)
+                with self._lock:
+                    self._counters['written'] += written
+                    self._counters['rejected'] += rejected
+                raise
+        return written, rejected
+
+    def flush(self):
+        """Write every buffered fix now. Returns the number written."""
+        with self._flush_lock:
+            fixes = self._take()
+            if not fixes:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                written, rejected = self._write(fixes)
+            except Exception as e:
+                with self._lock:
+                    self._counters['failed_flushes'] += 1
+                logger.error(f"Location buffer flush of {len(fixes)} fixes failed: {str(e)}")
+                raise
+            finally:
+                close_old_connections()
+
+            self.flush_latency.record('flush', (time.perf_counter() - start) * 1000)
+            with self._lock:
+                self._counters['written'] += written
+                self._counters['rejected'] += rejected
+                self._counters['flushes'] += 1
+            return written
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Logged in flush(); wait before retrying
+                time.sleep(self.flush_interval)
+
+    def shutdown(self):
+        """Final flush; spill what cannot be written to disk."""
+        self._stopped = True
+        self._wakeup.set()
+        try:
+            self.flush()
+        except Exception:
+            pass
+        self._spill(self._take())
+
+    def _spill(self, fixes):
+        if not fixes:
+            return
+        if not self.spill_dir:
+            logger.error(f"Lost {len(fixes)} buffered bus locations (LOCATION_BUFFER_SPILL_DIR not set)")
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f'spill-{os.getpid()}-{uuid.uuid4().hex}.jsonl')
+        with open(path + '.tmp', 'w') as handle:
+            for fix in fixes:
+                handle.write(json.dumps({
+                    **fix,
+                    'id': str(fix['id']),
+                    'trip_id': str(fix['trip_id']),
+                    'bus_id': str(fix['bus_id']),
+                    'latitude': str(fix['latitude']),
+                    'longitude': str(fix['longitude']),
+                    'recorded_at': fix['recorded_at'].isoformat(),
+                }) + '\n')
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            self._counters['spilled'] += len(fixes)
+        logger.warning(f"Spilled {len(fixes)} buffered bus locations to {path}")
+
+    def _recover_spills(self):
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return
+        for name in sorted(os.listdir(self.spill_dir)):
+            if not (name.startswith('spill-') and name.endswith('.jsonl')):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            claimed = f'{path}.{os.getpid()}.loading'
+            try:
+                # Only one process gets to load each file
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            fixes = []
+            with open(claimed) as handle:
+                for line in handle:
+                    fix = json.loads(line)
+                    fix['latitude'] = Decimal(fix['latitude'])
+                    fix['longitude'] = Decimal(fix['longitude'])
+                    fix['recorded_at'] = parse_datetime(fix['recorded_at'])
+                    fixes.append(fix)
+            self._append(fixes, front=True)
+            os.remove(claimed)
+            with self._lock:
+                self._counters['recovered'] += len(fixes)
+            logger.info(f"Recovered {len(fixes)} spilled bus locations from {name}")
+
+    def snapshot(self):
+        """Buffer depth, counters and flush latency."""
+        with self._lock:
+            report = {
+                'depth': len(self._pending),
+                'max_depth': self._max_depth,
+                'flush_size': self.flush_size,
+                'flush_interval_s': self.flush_interval,
+                **self._counters,
+            }
+        report['flush_latency'] = self.flush_latency.snapshot().get('flush')
+        return report
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_location_buffer():
+    """Return the process-wide buffer (started on first use), or None when disabled."""
+    global _buffer
+    if not getattr(settings, 'LOCATION_WRITE_BEHIND', True):
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = LocationBuffer(
+                getattr(settings, 'LOCATION_BUFFER_FLUSH_SIZE', 200),
+                getattr(settings, 'LOCATION_BUFFER_FLUSH_INTERVAL', 2.0),
+                getattr(settings, 'LOCATION_BUFFER_MAX_SIZE', 20000),
+                getattr(settings, 'LOCATION_BUFFER_SPILL_DIR', ''),
+            )
+            _buffer.start()
+        return _buffer
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0005_studenttransporthistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationupdate',
+            name='recorded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
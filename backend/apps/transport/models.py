@@ -320,7 +320,8 @@ class LocationUpdate(BaseModel):
     heading = models.FloatField(null=True, blank=True)  # degrees
     accuracy = models.FloatField(null=True, blank=True)  # meters
     
-    # Timestamp (using created_at from BaseModel)
+    # Timestamp (using created_at from BaseModel); device time for batched fixes
+    recorded_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         db_table = 'location_updates'
@@ -0,0 +1,226 @@
+"""
+Last known position of each trip.
+
+Every location ingest (HTTP, batch upload or WebSocket) records the trip's
+newest fix here, so serializers, views and consumers read it without the
+ordered `trip.location_updates.first()` query against the largest table.
+
+Positions are kept as LocationUpdateSerializer data, in a Redis hash per
+trip (`trip_position:<id>`, expiring after LOCATION_POSITION_TTL) when
+LOCATION_POSITION_REDIS_URL is set, and in a short-lived per-process cache
+in front of it (or instead of it). Trips missing from both, e.g. finished
+trips, are loaded for a whole list in one query and cached per process.
+Ingest reads the previous fix with get_latest_position, which skips the
+per-process cache.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# Cached for trips without any location, so they are not queried again
+NO_POSITION = object()
+
+
+class LocalPositions:
+    """Bounded per-process map of trip id -> position, each entry expiring after `ttl`."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    found[key] = entry[1]
+        return found
+
+    def set_many(self, positions):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, position in positions.items():
+                self._entries[key] = (expires, position)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisPositions:
+    """Positions as one Redis hash per trip, fields JSON-encoded."""
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def _key(self, trip_id):
+        return f'trip_position:{trip_id}'
+
+    def get_many(self, keys):
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hgetall(self._key(key))
+        found = {}
+        for key, fields in zip(keys, pipeline.execute()):
+            if fields:
+                found[key] = {field.decode(): json.loads(value) for field, value in fields.items()}
+        return found
+
+    def set_many(self, positions):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, position in positions.items():
+            pipeline.hset(self._key(key), mapping={
+                field: json.dumps(value, cls=DjangoJSONEncoder) for field, value in position.items()
+            })
+            pipeline.expire(self._key(key), self.ttl)
+        pipeline.execute()
+
+
+local_positions = LocalPositions(
+    getattr(settings, 'LOCATION_POSITION_CACHE_SIZE', 10000),
+    getattr(settings, 'LOCATION_POSITION_LOCAL_TTL', 10),
+)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def _shared_positions():
+    """The Redis store, or None when not configured (or redis is not installed)."""
+    global _shared
+    url = getattr(settings, 'LOCATION_POSITION_REDIS_URL', '')
+    if not url:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            try:
+                _shared = RedisPositions(url, getattr(settings, 'LOCATION_POSITION_TTL', 24 * 3600))
+            except ImportError:
+                logger.warning("redis not installed; last known positions are cached per process only")
+                _shared = False
+        return _shared or None
+
+
+def position_data(location):
+    """
+    Position record of a LocationUpdate, or of a write-behind buffer fix
+    (see location_buffer), which is not saved yet.
+    """
+    from .models import LocationUpdate
+    from .serializers import LocationUpdateSerializer
+
+    if isinstance(location, dict):
+        location = LocationUpdate(**location)
+        location.created_at = location.recorded_at
+    # Round-trip through JSON so cached records match what Redis returns
+    return json.loads(json.dumps(LocationUpdateSerializer(location).data, cls=DjangoJSONEncoder))
+
+
+def position_time(position):
+    """When a position was recorded (device time if known), as a datetime."""
+    from django.utils.dateparse import parse_datetime
+
+    return parse_datetime(position['recorded_at'] or position['created_at'])
+
+
+def record_position(location):
+    """Make `location` (LocationUpdate or buffer fix) its trip's last known position."""
+    position = position_data(location)
+    positions = {position['trip']: position}
+    local_positions.set_many(positions)
+    shared = _shared_positions()
+    if shared is not None:
+        try:
+            shared.set_many(positions)
+        except Exception as e:
+            logger.warning(f"Could not store last known position in Redis: {str(e)}")
+    return position
+
+
+def _load_positions(trip_ids):
+    """Newest stored location of each trip, in one query."""
+    from django.db.models import OuterRef, Subquery
+    from .models import LocationUpdate, Trip
+
+    newest = LocationUpdate.objects.filter(trip_id=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+    locations = LocationUpdate.objects.filter(
+        pk__in=Trip.objects.filter(pk__in=trip_ids).annotate(newest_id=Subquery(newest)).values('newest_id')
+    )
+    return {str(location.trip_id): position_data(location) for location in locations}
+
+
+def get_positions(trip_ids):
+    """
+    Last known positions of several trips.
+
+    Returns:
+        dict: trip id (as given) -> position record (LocationUpdateSerializer
+        data) or None for trips without any location
+    """
+    keys = {str(trip_id): trip_id for trip_id in trip_ids}
+    found = local_positions.get_many(list(keys))
+
+    missing = [key for key in keys if key not in found]
+    shared = _shared_positions()
+    if missing and shared is not None:
+        try:
+            from_shared = shared.get_many(missing)
+        except Exception as e:
+            logger.warning(f"Could not read last known positions from Redis: {str(e)}")
+            from_shared = {}
+        local_positions.set_many(from_shared)
+        found.update(from_shared)
+        missing = [key for key in missing if key not in from_shared]
+
+    if missing:
+        loaded = _load_positions(missing)
+        loaded.update({key: NO_POSITION for key in missing if key not in loaded})
+        # Only cached in this process: a concurrent ingest owns the shared entry
+        local_positions.set_many(loaded)
+        found.update(loaded)
+
+    return {
+        trip_id: None if found[key] is NO_POSITION else found[key]
+        for key, trip_id in keys.items()
+    }
+
+
+def get_position(trip_id):
+    """Last known position of one trip, or None."""
+    return get_positions([trip_id])[trip_id]
+
+
+def get_latest_position(trip_id):
+    """
+    Last known position of one trip from Redis, else from the database, or
+    None. For location ingest: the per-process cache may still hold a fix
+    older than one another worker has recorded since.
+    """
+    key = str(trip_id)
+    shared = _shared_positions()
+    if shared is not None:
+        try:
+            position = shared.get_many([key]).get(key)
+        except Exception as e:
+            logger.warning(f"Could not read last known position from Redis: {str(e)}")
+            position = None
+        if position is not None:
+            return position
+    return _load_positions([key]).get(key)
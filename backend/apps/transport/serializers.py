@@ -228,11 +228,22 @@ class LocationUpdateSerializer(serializers.ModelSerializer):
         model = LocationUpdate
         fields = [
             'id', 'trip', 'bus', 'latitude', 'longitude', 'location',
-            'speed', 'heading', 'accuracy', 'created_at'
+            'speed', 'heading', 'accuracy', 'recorded_at', 'created_at'
         ]
         read_only_fields = ['id', 'created_at']
 
 
+class TripListSerializer(serializers.ListSerializer):
+    """Looks up the last known positions of all listed trips at once."""
+    
+    def to_representation(self, data):
+        from .positions import get_positions
+        
+        trips = list(data.all() if hasattr(data, 'all') else data)
+        self.child.positions = get_positions([trip.id for trip in trips])
+        return super().to_representation(trips)
+
+
 class TripSerializer(serializers.ModelSerializer):
     """Serializer for Trip model."""
     bus_number = serializers.CharField(source='bus.number', read_only=True)
@@ -251,6 +262,7 @@ class TripSerializer(serializers.ModelSerializer):
             'latest_location', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = TripListSerializer
     
     def get_driver_name(self, obj):
         return obj.driver.full_name if obj.driver else None
@@ -259,15 +271,18 @@ class TripSerializer(serializers.ModelSerializer):
         return obj.conductor.full_name if obj.conductor else None
     
     def get_latest_location(self, obj):
-        """Get the latest location update for this trip."""
-        latest = obj.location_updates.first()
+        """Get the last known position of this trip (bulk-loaded for lists)."""
+        from .positions import get_position
+        
+        positions = getattr(self, 'positions', None)
+        latest = positions.get(obj.id) if positions is not None else get_position(obj.id)
         if latest:
             return {
-                'latitude': float(latest.latitude),
-                'longitude': float(latest.longitude),
-                'speed': latest.speed,
-                'heading': latest.heading,
-                'timestamp': latest.created_at,
+                'latitude': latest['location']['latitude'],
+                'longitude': latest['location']['longitude'],
+                'speed': latest['speed'],
+                'heading': latest['heading'],
+                'timestamp': latest['created_at'],
             }
         return None
 
@@ -316,6 +331,30 @@ class StartTripSerializer(serializers.Serializer):
         return trip
 
 
+class LocationFixSerializer(serializers.Serializer):
+    """One device-timestamped GPS fix of a batch upload."""
+    latitude = serializers.DecimalField(max_digits=20, decimal_places=7)
+    longitude = serializers.DecimalField(max_digits=20, decimal_places=7)
+    speed = serializers.FloatField(required=False)
+    heading = serializers.FloatField(required=False)
+    accuracy = serializers.FloatField(required=False)
+    recorded_at = serializers.DateTimeField()
+
+
+class UpdateLocationBatchSerializer(serializers.Serializer):
+    """Serializer for uploading the GPS fixes a device buffered since its last upload."""
+    fixes = serializers.ListField(child=LocationFixSerializer(), allow_empty=False)
+    
+    def validate_fixes(self, value):
+        from django.conf import settings
+        
+        max_fixes = getattr(settings, 'LOCATION_BATCH_MAX_FIXES', 500)
+        if len(value) > max_fixes:
+            raise serializers.ValidationError(f"At most {max_fixes} fixes per batch.")
+        # Devices send them in order, but a retried upload may interleave
+        return sorted(value, key=lambda fix: fix['recorded_at'])
+
+
 class EndTripSerializer(serializers.Serializer):
     """Serializer for ending a trip."""
     
@@ -345,6 +384,9 @@ class UpdateLocationSerializer(serializers.Serializer):
             **validated_data
         )
         
+        from .positions import record_position
+        record_position(location)
+        
         # Broadcast to WebSocket channel
         from channels.layers import get_channel_layer
         from asgiref.sync import async_to_sync
@@ -530,15 +572,17 @@ class TripTrackingSerializer(serializers.ModelSerializer):
         ]
         
     def get_latest_location(self, obj):
-        """Get the latest location update."""
-        latest = obj.location_updates.first()
+        """Get the last known position."""
+        from .positions import get_position
+        
+        latest = get_position(obj.id)
         if latest:
             return {
-                'latitude': float(latest.latitude),
-                'longitude': float(latest.longitude),
-                'speed': latest.speed,
-                'heading': latest.heading,
-                'created_at': latest.created_at
+                'latitude': latest['location']['latitude'],
+                'longitude': latest['location']['longitude'],
+                'speed': latest['speed'],
+                'heading': latest['heading'],
+                'created_at': latest['created_at']
             }
         return None
         
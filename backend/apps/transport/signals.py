@@ -0,0 +1,24 @@
+"""
+Signals for transport app.
+Touch a route when its stops change, so cached route geometry (keyed by
+the route's updated_at) is reloaded.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Route, Stop
+
+
+def touch_route(route_id):
+    Route.objects.filter(pk=route_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Stop)
+def touch_route_on_stop_save(sender, instance, **kwargs):
+    touch_route(instance.route_id)
+
+
+@receiver(post_delete, sender=Stop)
+def touch_route_on_stop_delete(sender, instance, **kwargs):
+    touch_route(instance.route_id)
@@ -0,0 +1,69 @@
+"""Spill and replay of the location write-behind buffer after failed flushes."""
+import os
+from unittest import mock
+
+import pytest
+from django.db import OperationalError
+from django.utils import timezone
+
+from apps.schools.models import School
+from apps.transport.location_buffer import LocationBuffer
+from apps.transport.models import Bus, LocationUpdate, Route, Trip
+
+
+@pytest.fixture
+def trip(db):
+    school = School.objects.create(name='Test School', address='1 Road', city='City', state='State', pincode='000000')
+    bus = Bus.objects.create(school=school, number='Bus 1', registration_number='AB 01 1234')
+    route = Route.objects.create(school=school, bus=bus, name='Route A')
+    return Trip.objects.create(bus=bus, route=route, scheduled_start=timezone.now())
+
+
+def add_fixes(buffer, trip, count):
+    return [
+        buffer.add(trip.id, trip.bus_id, {'latitude': 26.1 + number / 1000, 'longitude': 94.5})
+        for number in range(count)
+    ]
+
+
+def spill_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.jsonl'))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spilled_fixes_are_replayed_after_a_partial_constraint_failure(trip, tmp_path):
+    buffer = LocationBuffer(1000, 60, 1000, str(tmp_path))
+    fixes = add_fixes(buffer, trip, 6)
+    # Refused by the primary key once the first half is written
+    fixes[3]['id'] = fixes[2]['id']
+
+    bulk_create = LocationUpdate.objects.bulk_create
+    calls = []
+
+    def database_goes_down(objs, **kwargs):
+        # Whole batch (refused), first half (written), then the database is gone
+        calls.append(len(objs))
+        if len(calls) > 2:
+            raise OperationalError('database is down')
+        return bulk_create(objs, **kwargs)
+
+    with mock.patch.object(LocationUpdate.objects, 'bulk_create', side_effect=database_goes_down):
+        with pytest.raises(OperationalError):
+            buffer.flush()
+        assert buffer.snapshot()['depth'] == 3
+        buffer.shutdown()
+
+    assert calls[:2] == [6, 3]
+    assert LocationUpdate.objects.count() == 3
+    assert len(spill_files(tmp_path)) == 1
+    assert buffer.snapshot()['spilled'] == 3
+
+    # The next process loads the spill file and writes what is left
+    replay = LocationBuffer(1000, 60, 1000, str(tmp_path))
+    replay._recover_spills()
+    assert spill_files(tmp_path) == []
+    assert replay.flush() == 2
+
+    report = replay.snapshot()
+    assert (report['recovered'], report['written'], report['rejected'], report['depth']) == (3, 2, 1, 0)
+    assert set(LocationUpdate.objects.values_list('id', flat=True)) == {fix['id'] for fix in fixes}
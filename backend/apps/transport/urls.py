@@ -17,6 +17,8 @@ from .views import (
     StartTripView,
     EndTripView,
     UpdateLocationView,
+    UpdateLocationBatchView,
+    LocationBufferView,
     TripTrackingView,
     ChildTripView,
     # Bus Profile Views
@@ -71,7 +73,9 @@ urlpatterns = [
     path('trips/start/', StartTripView.as_view(), name='start-trip'),
     path('trips/<uuid:pk>/end/', EndTripView.as_view(), name='end-trip'),
     path('trips/<uuid:pk>/location/', UpdateLocationView.as_view(), name='update-location'),
+    path('trips/<uuid:pk>/location/batch/', UpdateLocationBatchView.as_view(), name='update-location-batch'),
     path('trips/<uuid:pk>/tracking/', TripTrackingView.as_view(), name='trip-tracking'),
+    path('metrics/location-buffer/', LocationBufferView.as_view(), name='location-buffer'),
     
     # Parent tracking
     path('track/child/<uuid:student_id>/', ChildTripView.as_view(), name='child-trip'),
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Calculate the great circle distance between two points 
@@ -20,3 +22,17 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.asin(math.sqrt(a))
     r = 6371 # Radius of earth in kilometers
     return c * r
+
+
+def calculate_distances(lat1, lon1, lat2, lon2):
+    """
+    Vectorized calculate_distance: Haversine distance in kilometers between
+    arrays (or scalars) of points in decimal degrees, broadcast NumPy-style.
+    """
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2)
+    )
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -1,6 +1,8 @@
 """
 Views for transport app.
 """
+import logging
+
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -22,6 +24,7 @@ from .serializers import (
     StartTripSerializer,
     EndTripSerializer,
     UpdateLocationSerializer,
+    UpdateLocationBatchSerializer,
     LocationUpdateSerializer,
 )
 from .models import Bus, BusStaff, Route, Stop, Trip, LocationUpdate, TripStatus, StudentTransportHistory
@@ -29,6 +32,8 @@ from core.permissions import IsSchoolAdmin, IsStaff, IsConductorOrDriver, IsPare
 from apps.accounts.models import SchoolMembership, UserRole
 from apps.students.models import Student
 
+logger = logging.getLogger(__name__)
+
 
 class BusListCreateView(generics.ListCreateAPIView):
     """List buses or create a new bus."""
@@ -206,6 +211,9 @@ class RouteUpdateStopsView(APIView):
                 else:
                     new_stop = Stop.objects.create(route=route, **defaults)
                     print(f"➕ Created stop #{index+1}: {stop_data['name']} (ID: {new_stop.id})")
+            
+            # Stop updates above skip signals; touch the route for its cached geometry
+            route.save(update_fields=['updated_at'])
         
         final_count = Stop.objects.filter(route=route).count()
         print(f"✅ Save complete! Route now has {final_count} stops")
@@ -348,6 +356,10 @@ class StartTripView(APIView):
         serializer.is_valid(raise_exception=True)
         trip = serializer.save()
         
+        # Preload face gallery and roster for the first scans
+        from apps.attendance.warmup import start_trip_warmup
+        start_trip_warmup(trip)
+        
         # Broadcast "trip_started" to all parents of students on this route
         from apps.students.models import Student
         from channels.layers import get_channel_layer
@@ -381,6 +393,15 @@ class StartTripView(APIView):
                 }
             )
         
+        # Location senders on this bus start recording to the new trip
+        async_to_sync(channel_layer.group_send)(
+            f"bus_{trip.bus_id}",
+            {
+                'type': 'trip_status',
+                'data': {'trip_id': str(trip.id), 'status': trip.status}
+            }
+        )
+        
         return Response(
             TripSerializer(trip).data,
             status=status.HTTP_201_CREATED
@@ -451,6 +472,15 @@ class EndTripView(APIView):
                 }
             )
         
+        # Location senders on this bus stop recording to the ended trip
+        async_to_sync(channel_layer.group_send)(
+            f"bus_{trip.bus_id}",
+            {
+                'type': 'trip_status',
+                'data': {'trip_id': str(trip.id), 'status': trip.status}
+            }
+        )
+        
         return Response(TripSerializer(trip).data)
 
 
@@ -473,8 +503,9 @@ class UpdateLocationView(APIView):
         )
         serializer.is_valid(raise_exception=True)
         
-        # Get previous location before saving new one
-        previous_location = trip.location_updates.first()
+        # Get previous position before saving (and recording) the new one
+        from .positions import get_latest_position, position_time
+        previous_location = get_latest_position(trip.id)
         
         location = serializer.save()
         
@@ -483,7 +514,7 @@ class UpdateLocationView(APIView):
             if previous_location:
                 from .utils import calculate_distance
                 dist = calculate_distance(
-                    previous_location.latitude, previous_location.longitude,
+                    previous_location['location']['latitude'], previous_location['location']['longitude'],
                     location.latitude, location.longitude
                 )
                 
@@ -502,7 +533,7 @@ class UpdateLocationView(APIView):
                     # Update Bus stats
                     trip.bus.total_distance_km += dist_decimal
                     # Approximate duration addition (time since last update)
-                    time_diff = (location.created_at - previous_location.created_at).total_seconds() / 3600
+                    time_diff = (location.created_at - position_time(previous_location)).total_seconds() / 3600
                     if time_diff > 0 and time_diff < 1: # Ignore large jumps/pauses > 1 hour
                         trip.bus.total_duration_hours += Decimal(str(time_diff))
                     
@@ -538,6 +569,151 @@ class UpdateLocationView(APIView):
         })
 
 
+class UpdateLocationBatchView(APIView):
+    """
+    Upload the GPS fixes a device buffered since its last upload.
+    
+    Fixes are inserted with one bulk_create, trip and bus telemetry is
+    updated once from the whole batch, and only the newest position is
+    broadcast. Fixes already stored for the trip (a retried upload) are
+    dropped and counted. Fixes older than the last known position are
+    stored but neither move it nor add to the telemetry; that position's
+    device time is the only one they are compared with, never the server's.
+    """
+    permission_classes = [IsConductorOrDriver]
+    
+    def post(self, request, pk):
+        import numpy as np
+        from .positions import get_latest_position, position_time, record_position
+        from .utils import calculate_distances
+        
+        try:
+            trip = Trip.objects.select_related('bus').get(pk=pk, status=TripStatus.IN_PROGRESS)
+        except Trip.DoesNotExist:
+            return Response(
+                {'error': 'Active trip not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        serializer = UpdateLocationBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fixes = serializer.validated_data['fixes']
+        received = len(fixes)
+        
+        # A retried upload resends fixes with the same device timestamps
+        stored = set(LocationUpdate.objects.filter(
+            trip=trip,
+            recorded_at__in=[fix['recorded_at'] for fix in fixes]
+        ).values_list('recorded_at', flat=True))
+        fixes = [fix for fix in fixes if fix['recorded_at'] not in stored]
+        dropped = received - len(fixes)
+        if not fixes:
+            return Response({'message': 'No new locations', 'count': 0, 'dropped': dropped, 'location': None})
+        
+        previous_location = get_latest_position(trip.id)
+        locations = LocationUpdate.objects.bulk_create([
+            LocationUpdate(trip=trip, bus=trip.bus, **fix)
+            for fix in fixes
+        ])
+        
+        # Only fixes after the last known position's device time move it
+        last_time = None
+        if previous_location and previous_location['recorded_at']:
+            last_time = position_time(previous_location)
+            locations = [location for location in locations if location.recorded_at > last_time]
+        if not locations:
+            return Response({
+                'message': 'Locations stored',
+                'count': len(fixes),
+                'dropped': dropped,
+                'location': None
+            })
+        location = locations[-1]
+        record_position(location)
+        
+        # Telemetry for the new fixes in one pass, continuing from the last known position
+        try:
+            points = [(update.latitude, update.longitude, update.recorded_at.timestamp()) for update in locations]
+            if previous_location:
+                points.insert(0, (
+                    previous_location['location']['latitude'],
+                    previous_location['location']['longitude'],
+                    last_time.timestamp() if last_time else np.nan
+                ))
+            
+            if len(points) > 1:
+                lats = np.array([point[0] for point in points], dtype=np.float64)
+                lons = np.array([point[1] for point in points], dtype=np.float64)
+                seconds = np.array([point[2] for point in points])
+                
+                dist = float(calculate_distances(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum())
+                # Approximate duration: gaps between fixes, ignoring pauses > 1 hour
+                # (and the gap from a position without device time)
+                hours = np.diff(seconds) / 3600
+                moving_hours = float(hours[(hours > 0) & (hours < 1)].sum())
+                
+                if dist > 0:
+                    dist_decimal = Decimal(str(round(dist, 6)))
+                    
+                    # Update Trip stats
+                    trip.distance_traveled += dist_decimal
+                    
+                    if trip.started_at:
+                        duration = (timezone.now() - trip.started_at).total_seconds() / 60
+                        trip.duration_minutes = int(duration)
+                    
+                    trip.save(update_fields=['distance_traveled', 'duration_minutes', 'updated_at'])
+                    
+                    # Update Bus stats
+                    trip.bus.total_distance_km += dist_decimal
+                    if moving_hours > 0:
+                        trip.bus.total_duration_hours += Decimal(str(round(moving_hours, 6)))
+                    
+                    trip.bus.save(update_fields=['total_distance_km', 'total_duration_hours', 'updated_at'])
+        
+        except Exception:
+            logger.exception(f"Telemetry update failed for trip {trip.id}")
+        
+        # Broadcast only the newest position to trip subscribers
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+        
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f"trip_{trip.id}",
+            {
+                'type': 'location_update',
+                'data': {
+                    'trip_id': str(trip.id),
+                    'bus_id': str(location.bus_id),
+                    'latitude': float(location.latitude),
+                    'longitude': float(location.longitude),
+                    'speed': location.speed,
+                    'heading': location.heading,
+                    'timestamp': location.recorded_at.isoformat(),
+                }
+            }
+        )
+        
+        return Response({
+            'message': 'Locations updated',
+            'count': len(fixes),
+            'dropped': dropped,
+            'location': LocationUpdateSerializer(location).data
+        })
+
+
+class LocationBufferView(APIView):
+    """Depth and flush latency of this worker process's location write-behind buffer."""
+    permission_classes = [IsStaff]
+    
+    def get(self, request):
+        from .location_buffer import get_location_buffer
+        
+        buffer = get_location_buffer()
+        return Response({'location_buffer': buffer.snapshot() if buffer else None})
+
+
 class TripTrackingView(APIView):
     """Get tracking data for a trip (for parents)."""
     permission_classes = [IsParent]
@@ -602,12 +778,13 @@ class ChildTripView(APIView):
                 'trip': None
             })
         
-        # Get latest location
-        latest_location = active_trip.location_updates.first()
+        # Get last known position
+        from .positions import get_position
+        latest_location = get_position(active_trip.id)
         
         return Response({
             'trip': TripSerializer(active_trip).data,
-            'latest_location': LocationUpdateSerializer(latest_location).data if latest_location else None,
+            'latest_location': latest_location,
             'student_stop': StopSerializer(student.stop).data if student.stop else None,
         })
 
@@ -779,8 +956,9 @@ class BusLiveStatusView(APIView):
                 'students': [],
             })
         
-        # Get latest location
-        latest_loc = active_trip.location_updates.first()
+        # Get last known position
+        from .positions import get_position
+        latest_loc = get_position(active_trip.id)
         
         # Get students on trip with attendance status
         from apps.attendance.models import Attendance
@@ -810,11 +988,11 @@ class BusLiveStatusView(APIView):
                 'students_dropped': active_trip.students_dropped,
             },
             'location': {
-                'latitude': float(latest_loc.latitude),
-                'longitude': float(latest_loc.longitude),
-                'speed': latest_loc.speed,
-                'heading': latest_loc.heading,
-                'timestamp': latest_loc.created_at.isoformat(),
+                'latitude': latest_loc['location']['latitude'],
+                'longitude': latest_loc['location']['longitude'],
+                'speed': latest_loc['speed'],
+                'heading': latest_loc['heading'],
+                'timestamp': latest_loc['created_at'],
             } if latest_loc else None,
             'students': students_data,
         })
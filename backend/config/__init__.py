@@ -1,3 +1,6 @@
 """
 Config package initialization.
 """
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,12 @@
+"""
+Celery application for ThreeSixty background tasks.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+app = Celery('threesixty')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
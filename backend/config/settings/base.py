@@ -161,6 +161,16 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache, shared by all worker processes: cached face galleries and indexes
+# are invalidated through generation counters kept here
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env('REDIS_URL', default='redis://localhost:6379/0'),
+        'KEY_PREFIX': 'threesixty',
+    },
+}
+
 # Celery Configuration
 CELERY_BROKER_URL = env('REDIS_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = env('REDIS_URL', default='redis://localhost:6379/0')
@@ -190,7 +200,92 @@ FIREBASE_CREDENTIALS_PATH = env('FIREBASE_CREDENTIALS_PATH', default='firebase-c
 
 # Face Recognition Settings
 FACE_RECOGNITION_TOLERANCE = 0.6  # Lower = more strict
+FACE_PICKUP_TOLERANCE = 0.5  # Stricter match distance for handing a student to an authorized pickup
 FACE_RECOGNITION_MIN_CONFIDENCE = 0.7
+FACE_MATCH_TOP_K = 3  # Candidates returned with every match
+FACE_MATCH_AMBIGUOUS_MARGIN = 0.06  # Runner-up this close (and within tolerance) needs confirmation
+FACE_PENDING_SCAN_TTL = 120  # Seconds an ambiguous scan can be confirmed without rescanning
+FACE_GALLERY_CACHE_SIZE = 64  # Route galleries kept in memory per process
+FACE_TRIP_ROSTER_CACHE_SIZE = 128  # Trip check-in/out rosters kept in memory per process
+FACE_PICKUP_CACHE_SIZE = 512  # Per-student authorized pickup galleries kept in memory per process
+FACE_TRIP_WARMUP = True  # Preload gallery, roster and face workers when a trip starts
+FACE_SCAN_LATENCY_SAMPLES = 500  # Recent scan latencies kept per cold/warm label per process
+FACE_INDEX_CACHE_SIZE = 32  # School-wide face indexes kept in memory per process
+FACE_OFF_ROUTE_FALLBACK = True  # Search the school index when a scan misses its route (child on another bus)
+FACE_OFF_ROUTE_TOLERANCE = 0.25  # Stricter than the on-route acceptance (distance 0.3 by default)
+FACE_OFF_ROUTE_MIN_MARGIN = 0.1  # Required gap to the runner-up in the school-wide search
+FACE_OFF_ROUTE_BUDGET_MS = 150  # Time the scan waits for the school-wide search before giving up
+FACE_OFF_ROUTE_WORKERS = 2  # Threads running school-wide searches per process
+FACE_EMBEDDING_STORE_DIR = ''  # Directory for shared memory-mapped school indexes (e.g. BASE_DIR / 'face_store'); '' keeps them per process
+FACE_EMBEDDING_STORE_MIN_CAPACITY = 1024  # Rows reserved in a new store file
+FACE_EMBEDDING_STORE_GROWTH = 2.0  # Store capacity as a multiple of its encodings when rebuilt
+FACE_EMBEDDING_STORE_MAX_DEAD_FRACTION = 0.2  # Deleted rows that trigger a background rebuild
+FACE_INDEX_MIN_TRAIN_SIZE = 1024  # Below this a school index is an exact scan
+FACE_INDEX_NPROBE = 8  # Index cells scanned per identification query
+FACE_CENTROID_FILTER_MIN_STUDENTS = 256  # Galleries this large shortlist students by centroid first
+FACE_CENTROID_SHORTLIST = 16  # Students whose encodings are compared after the centroid pass
+FACE_MAX_ENCODINGS_PER_STUDENT = 5  # Diverse encodings kept per student after compaction
+FACE_DUPLICATE_DISTANCE = 0.15  # New encodings closer than this to an existing one are rejected
+FACE_DETECTION_MODEL = 'hog'  # 'hog' (CPU) or 'cnn' (GPU)
+FACE_DETECTION_UPSAMPLE = 1
+FACE_DETECTION_MAX_EDGE = 640  # Longest image edge used for face detection
+FACE_ENCODING_MAX_EDGE = 1280  # Longest image edge kept for encoding crops
+FACE_CROP_PADDING = 0.25  # Padding around detected box when cropping for encoding
+FACE_HINT_PADDING = 0.25  # Margin added around a client face box hint, as a fraction of its size
+FACE_HINT_DETECT_EDGE = 240  # Longest edge of the hint crop searched for the face
+FACE_HINT_MIN_SIZE = 0.05  # Smallest accepted face box side, as a fraction of the photo
+FACE_GROUP_MAX_FACES = 10  # Faces encoded from one group check-in photo
+FACE_SCAN_PHOTO_MAX_EDGE = 800  # Longest edge of the stored attendance scan photo
+FACE_SCAN_THUMBNAIL_EDGE = 160
+FACE_SCAN_PHOTO_FORMAT = 'WEBP'  # 'WEBP' or 'JPEG'
+FACE_SCAN_PHOTO_QUALITY = 80
+
+# Face encodings computed on the conductor device (must be the same dlib model)
+FACE_CLIENT_EMBEDDING_SAMPLE_RATE = 0.05  # Share of embedding scans that must also send the photo
+FACE_CLIENT_EMBEDDING_MIN_MARGIN = 0.08  # Closer runner-up than this requires the photo
+
+# Face inference worker pool (0 = run inline in the request thread)
+FACE_WORKER_PROCESSES = env.int('FACE_WORKER_PROCESSES', default=0)
+FACE_WORKER_MAX_PENDING = env.int('FACE_WORKER_MAX_PENDING', default=4 * max(FACE_WORKER_PROCESSES, 1))
+FACE_WORKER_TIMEOUT = 15  # Seconds before a scan gives up with 503
+FACE_WORKER_RETRY_AFTER = 2  # Retry-After seconds sent with 503
+
+# Face inference admission queue (per process, in front of the worker pool or inline inference)
+FACE_ADMISSION_CONTROL = True
+FACE_ADMISSION_CONCURRENCY = env.int('FACE_ADMISSION_CONCURRENCY', default=max(FACE_WORKER_PROCESSES, 2))
+FACE_ADMISSION_RESERVED_SCAN_SLOTS = 1  # Slots only attendance scans and handovers may use
+FACE_ADMISSION_MAX_QUEUE = 64  # Waiting requests before new ones are refused with 503
+FACE_ADMISSION_MAX_QUEUED_PER_SCHOOL = 16  # Waiting requests one school may hold
+FACE_ADMISSION_DEADLINES = {'scan': 5, 'identify': 10, 'enroll': 60}  # Seconds a request may wait per priority
+FACE_ADMISSION_WAIT_SAMPLES = 500  # Recent queue wait times kept per priority
+
+# Bulk face enrollment
+FACE_ENROLLMENT_CONCURRENCY = 4  # Photos encoded at once per job
+FACE_ENROLLMENT_BATCH_SIZE = 100  # FaceEncoding rows per bulk insert
+FACE_ENROLLMENT_MAX_FILES = 5000  # Photos accepted from one archive
+FACE_ENROLLMENT_MAX_FILE_BYTES = 15 * 1024 * 1024
+FACE_ENROLLMENT_STALE_AFTER = 600  # Seconds without progress after which a processing job is marked failed
+
+# Bus location tracking
+LOCATION_BATCH_MAX_FIXES = 500  # GPS fixes accepted in one batch upload
+LOCATION_WRITE_BEHIND = True  # Buffer WebSocket fixes in memory and write them in batches
+LOCATION_BUFFER_FLUSH_SIZE = 200  # Buffered fixes that trigger a write
+LOCATION_BUFFER_FLUSH_INTERVAL = 2.0  # Seconds between writes otherwise
+LOCATION_BUFFER_MAX_SIZE = 20000  # Oldest fixes are dropped beyond this while the database is unreachable
+LOCATION_BUFFER_BATCH_SIZE = 500  # Rows per INSERT
+LOCATION_BUFFER_SPILL_DIR = BASE_DIR / 'location_spill'  # Unwritten fixes are saved here on shutdown
+LOCATION_TRIP_REFRESH_INTERVAL = 30  # Seconds a location socket trusts its cached active trip
+LOCATION_POSITION_REDIS_URL = env('REDIS_URL', default='redis://localhost:6379/0')  # Shared last known trip positions; '' keeps them per process
+LOCATION_POSITION_TTL = 24 * 3600  # Seconds a trip's last known position is kept in Redis
+LOCATION_POSITION_LOCAL_TTL = 10  # Seconds a position is trusted from the per-process cache
+LOCATION_POSITION_CACHE_SIZE = 10000  # Trip positions kept in memory per process
+LOCATION_ROUTE_CACHE_SIZE = 1024  # Route stop geometries kept in memory per process
+LOCATION_STOP_ARRIVAL_KM = 0.05  # A bus this close to a stop has reached it
+LOCATION_ROUTE_CORRIDOR_KM = 0.3  # A bus farther than this from the route path is off route
+LOCATION_ROUTE_LOOKAHEAD_KM = 2.0  # Stretch of route ahead of a bus searched first for its next fix
+LOCATION_ETA_SPEED_WEIGHT = 0.6  # Weight of the bus's recent speed against the default 30 km/h in ETAs
+LOCATION_ETA_MIN_SPEED_KMH = 5  # Recent speed floor for ETAs (a bus waiting at a light still arrives)
+LOCATION_ETA_SPEED_WINDOW = 120  # Seconds between fixes beyond which no speed is measured
 
 # OTP Settings
 OTP_LENGTH = 6
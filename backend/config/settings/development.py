@@ -16,13 +16,20 @@ DATABASES = {
 # Email backend for development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
-# Use in-memory channel layer for development without Redis
+# Use in-memory channel layer, cache and trip positions for development
+# without Redis (single process only: changes do not reach other workers)
 if not env('REDIS_URL', default=''):
     CHANNEL_LAYERS = {
         'default': {
             'BACKEND': 'channels.layers.InMemoryChannelLayer',
         },
     }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    LOCATION_POSITION_REDIS_URL = ''
 
 # Disable Celery in development (run tasks synchronously)
 CELERY_TASK_ALWAYS_EAGER = True